@@ -0,0 +1,48 @@
+from tag_predictor import TagPredictor, top_k_agreement, export_paths
+import argparse
+import os
+import sys
+import pandas as pd
+
+# Exports the trained SBERT encoder + TagMLP to TorchScript (fp32 and/or dynamic int8)
+# and checks that the exported backends predict the same top-k tags as the fp32 model.
+# Run from ai/ after train_ai.py, like it:
+#   python export_model.py --int8
+# Then serve with TAG_PREDICTOR_BACKEND=torchscript-int8 (or torchscript).
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export TagPredictor to TorchScript and check parity")
+    parser.add_argument("--int8", action="store_true", help="Also export a dynamically quantized int8 model")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(__file__), "data", "prompts_tags.csv"),
+                        help="Prompts used for the parity check")
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="Minimum mean top-k overlap with fp32")
+    args = parser.parse_args()
+
+    reference = TagPredictor(backend="torch", cache_embeddings=False)
+    exported = ["torchscript"]
+    reference.export(quantize=False)
+    if args.int8:
+        reference.export(quantize=True)
+        exported.append("torchscript-int8")
+
+    df = pd.read_csv(args.data)
+    prompts = df["prompt_text" if "prompt_text" in df.columns else "prompt"].dropna().tolist()
+    print(f"Checking parity on {len(prompts)} prompts...")
+    expected = reference.predict_batch(prompts, threshold=0.0, top_n=args.top_n)
+
+    failed = False
+    for backend in exported:
+        candidate = TagPredictor(backend=backend, cache_embeddings=False)
+        if candidate.backend != backend:
+            print(f"{backend}: could not load {export_paths(backend.endswith('int8'))[0]}")
+            failed = True
+            continue
+        predicted = candidate.predict_batch(prompts, threshold=0.0, top_n=args.top_n)
+        agreement = top_k_agreement(expected, predicted, args.top_n)
+        top_1 = sum(a[:1] == b[:1] for a, b in zip(expected, predicted)) / max(len(prompts), 1)
+        status = "OK" if agreement >= args.min_agreement else "FAILED"
+        print(f"{backend}: top-{args.top_n} agreement {agreement:.3f}, top-1 match {top_1:.3f} [{status}]")
+        failed |= agreement < args.min_agreement
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,29 @@
+from tag_predictor import ModelRegistry
+import argparse
+
+# Model registry commands (see ModelRegistry in tag_predictor.py). Running API workers
+# poll the active version and swap models within MODEL_RELOAD_SECONDS, no restart needed.
+#   python manage_models.py list
+#   python manage_models.py activate v20250101-120000
+#   python manage_models.py rollback
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned tag models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Show published versions")
+    activate_parser = commands.add_parser("activate", help="Serve a published version")
+    activate_parser.add_argument("version")
+    commands.add_parser("rollback", help="Serve the previously active version again")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == "list":
+        active = registry.active_version()
+        for manifest in registry.versions():
+            marker = "*" if manifest["version"] == active else " "
+            metrics = ", ".join(f"{name}={value}" for name, value in manifest["metrics"].items())
+            print(f"{marker} {manifest['version']}  {manifest['num_tags']} tags  parent={manifest['parent']}  {metrics}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+    elif args.command == "rollback":
+        registry.rollback()
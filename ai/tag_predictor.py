@@ -1,31 +1,247 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
 from sentence_transformers import SentenceTransformer
 import pandas as pd
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.model_selection import train_test_split
 import numpy as np
 import os
+import copy
+import hashlib
+import json
+import shutil
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
 
 MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
 os.makedirs(MODEL_DIR, exist_ok=True)
 SBERT_MODEL_NAME = 'all-MiniLM-L6-v2' # Or another suitable model
 MLP_MODEL_PATH = os.path.join(MODEL_DIR, "tag_mlp_model.pt")
 MLB_CLASSES_PATH = os.path.join(MODEL_DIR, "mlb_classes.npy")
+REGISTRY_DIR = os.path.join(MODEL_DIR, "registry") # Versioned models, see ModelRegistry
+EXPORT_DIR = os.path.join(MODEL_DIR, "export") # TorchScript graphs written by ai/export_model.py
+# "torch": SentenceTransformer + TagMLP in eager fp32
+# "torchscript": the exported fp32 graphs, "torchscript-int8": the same with dynamic int8 Linear layers
+INFERENCE_BACKENDS = ("torch", "torchscript", "torchscript-int8")
+INFERENCE_BACKEND = os.getenv("TAG_PREDICTOR_BACKEND", "torch")
+EMBEDDING_CACHE_DIR = os.path.join(MODEL_DIR, "embedding_cache")
+EMBEDDING_CACHE_SIZE = 10000 # Embeddings kept in memory (~1.5 KB each for 384 dims)
+EMBEDDING_CACHE_DISK_SIZE = 100000 # Records in the on-disk shard before it is compacted to the newest half
+TRAINING_EMBEDDINGS_DIR = os.path.join(MODEL_DIR, "training_embeddings")
+TRAINING_EMBEDDINGS_KEEP = 3 # Most recently used datasets kept, every incremental run is a new one
 
-class PromptTagDataset(Dataset):
-    def __init__(self, prompts, embeddings, labels):
-        self.prompts = prompts
-        self.embeddings = embeddings
-        self.labels = labels
+def normalize_text(text: str) -> str:
+    """What gets embedded and hashed: NFKC, surrounding/repeated whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
 
-    def __len__(self):
-        return len(self.embeddings)
+class EmbeddingCache:
+    """
+    Sentence embeddings keyed by a hash of (model name, normalized text), so a text only
+    goes through the transformer once.
 
-    def __getitem__(self, idx):
-        return self.embeddings[idx], self.labels[idx]
+    Two tiers:
+      - a bounded in-memory LRU
+      - an append-only shard on disk, <cache_dir>/<model>/embeddings.bin: fixed-size
+        records (16-byte key + float32 vector), memory-mapped read-only. The key index
+        (key -> row) is rebuilt from the shard on load, and rows appended by other
+        processes are picked up on the next miss. Past max_disk_items records the shard
+        is rewritten with its newest half and renamed over the old one; other processes
+        notice the new file and re-index it.
+    """
+
+    def __init__(self, model_name: str, cache_dir=EMBEDDING_CACHE_DIR, max_memory_items=EMBEDDING_CACHE_SIZE,
+                 max_disk_items=EMBEDDING_CACHE_DISK_SIZE):
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        shard_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        os.makedirs(shard_dir, exist_ok=True)
+        self.path = os.path.join(shard_dir, "embeddings.bin")
+        self.meta_path = os.path.join(shard_dir, "meta.json")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # key -> vector
+        self._record_dtype = None
+        self._records = None # np.memmap of records
+        self._rows = {} # key -> row in the shard
+        self._count = 0
+        self._inode = None # Of the shard file _rows indexes, changes when it is compacted
+        self._sync()
+
+    def _set_dim(self, dim: int):
+        self._record_dtype = np.dtype([("key", "V16"), ("vector", "<f4", (dim,))])
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_name}\n{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _sync(self):
+        """Maps rows appended to the shard since the last look (by us or another worker)."""
+        if self._record_dtype is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path) as f: # Created by another worker since we started
+                self._set_dim(json.load(f)["dim"])
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode: # First look, or compacted meanwhile: index it from the start
+            self._records, self._rows, self._count, self._inode = None, {}, 0, stat.st_ino
+        count = stat.st_size // self._record_dtype.itemsize # Ignores a torn last record
+        if count <= self._count:
+            return
+        records = np.memmap(self.path, dtype=self._record_dtype, mode="r", shape=(count,))
+        for row, key in enumerate(records["key"][self._count:].tolist(), start=self._count):
+            self._rows.setdefault(key, row)
+        self._records, self._count = records, count
+
+    def _append(self, keys: list[bytes], vectors: np.ndarray):
+        if self._record_dtype is None:
+            self._set_dim(vectors.shape[1])
+            with open(self.meta_path, "w") as f:
+                json.dump({"model": self.model_name, "dim": int(vectors.shape[1])}, f)
+        records = np.empty(len(keys), dtype=self._record_dtype)
+        records["key"] = np.frombuffer(b"".join(keys), dtype="V16")
+        records["vector"] = vectors
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if size % self._record_dtype.itemsize: # Torn record from a crash, pad it out to keep rows aligned
+                os.write(fd, bytes(self._record_dtype.itemsize - size % self._record_dtype.itemsize))
+            os.write(fd, records.tobytes()) # One O_APPEND write per batch, so workers don't interleave rows
+        finally:
+            os.close(fd)
+        self._sync()
+        if self._count > self.max_disk_items:
+            self._compact()
+
+    def _compact(self):
+        """Rewrites the shard with its newest max_disk_items // 2 records (rows appended meanwhile by others are lost, it's a cache)."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        np.asarray(self._records[-(self.max_disk_items // 2):]).tofile(tmp_path)
+        os.replace(tmp_path, self.path)
+        self._sync()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def encode(self, texts: list[str], encode_fn, remember=True) -> np.ndarray:
+        """
+        Embeddings for `texts` (float32, len(texts) x dim). Only the texts found in neither
+        tier are passed, normalized and deduplicated, to `encode_fn(texts) -> array`.
+        remember=False is for bulk calls (training): cached embeddings are used, but new ones
+        are neither kept in memory nor appended to the shard, so serving workers don't index them.
+        """
+        texts = [normalize_text(text) for text in texts]
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats["memory_hits"] += len(found)
+            on_disk = [key for key in dict.fromkeys(keys) if key not in found]
+            if any(key not in self._rows for key in on_disk):
+                self._sync()
+            on_disk = [key for key in on_disk if key in self._rows]
+            if on_disk:
+                vectors = np.asarray(self._records["vector"][[self._rows[key] for key in on_disk]])
+                found.update(zip(on_disk, vectors))
+                self.stats["disk_hits"] += len(on_disk)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            found.update(zip(missing, vectors))
+            with self._lock:
+                self.stats["misses"] += len(missing)
+                if remember:
+                    self._append(list(missing), vectors)
+
+        if remember:
+            with self._lock:
+                for key in dict.fromkeys(keys):
+                    self._remember(key, found[key])
+        if not keys:
+            return np.zeros((0, self._record_dtype["vector"].shape[0] if self._record_dtype else 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+
+def dataset_hash(model_name: str, prompts: list[str]) -> str:
+    """Content hash of a training set's prompts (in order) for one encoder; labels don't change embeddings."""
+    digest = hashlib.blake2b(model_name.encode("utf-8"), digest_size=16)
+    for prompt in prompts:
+        digest.update(normalize_text(prompt).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class TrainingEmbeddingStore:
+    """
+    The embedding matrix of a training set, row i = prompt i, precomputed once and kept as
+    <directory>/<dataset hash>.npy, opened with np.memmap. A `.done` file marks which
+    chunks of rows are written, so an interrupted run resumes where it stopped. Only
+    missing chunks are encoded; those look up the predictor's embedding cache (prompts
+    already seen in production) but don't add the training prompts to it. Only the
+    `max_datasets` most recently used matrices are kept.
+    """
+
+    def __init__(self, directory=TRAINING_EMBEDDINGS_DIR, chunk_size=4096, max_datasets=TRAINING_EMBEDDINGS_KEEP):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_datasets = max_datasets
+
+    def _prune(self, current_key: str):
+        """Deletes the least recently used matrices beyond max_datasets (never the current one)."""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npy")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.max_datasets:]:
+            key = os.path.basename(path)[:-len(".npy")]
+            if key == current_key:
+                continue
+            for stale_path in (path, os.path.join(self.directory, f"{key}.done")):
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+
+    def load(self, predictor, prompts: list[str]) -> np.ndarray:
+        """Read-only (len(prompts) x dim) float32 memmap of the prompts' embeddings."""
+        os.makedirs(self.directory, exist_ok=True)
+        model_name = predictor.embedding_cache.model_name if predictor.embedding_cache else predictor.sbert_model_name
+        key = dataset_hash(model_name, prompts)
+        path = os.path.join(self.directory, f"{key}.npy")
+        done_path = os.path.join(self.directory, f"{key}.done")
+        num_chunks = (len(prompts) + self.chunk_size - 1) // self.chunk_size
+        done = np.fromfile(done_path, dtype=np.uint8) if os.path.exists(done_path) else np.zeros(0, dtype=np.uint8)
+        if os.path.exists(path) and len(done) == num_chunks and done.all():
+            print(f"Using precomputed embeddings for {len(prompts)} prompts ({path})")
+            os.utime(path) # Recently used, for _prune
+            self._prune(key)
+            return np.load(path, mmap_mode="r")
+
+        if len(done) != num_chunks or not os.path.exists(path):
+            dim = predictor.sbert_model.get_sentence_embedding_dimension()
+            matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(len(prompts), dim))
+            done = np.zeros(num_chunks, dtype=np.uint8)
+        else:
+            matrix = np.load(path, mmap_mode="r+")
+        missing = np.flatnonzero(done == 0)
+        print(f"Generating embeddings for {len(prompts)} prompts ({len(missing)}/{num_chunks} chunks to compute)...")
+        for chunk in missing:
+            start = chunk * self.chunk_size
+            matrix[start:start + self.chunk_size] = predictor.encode(prompts[start:start + self.chunk_size], remember=False)
+            matrix.flush()
+            done[chunk] = 1
+            done.tofile(done_path) # Only after the rows are flushed, so a crash never marks unwritten rows
+        del matrix
+        self._prune(key)
+        return np.load(path, mmap_mode="r")
 
 class TagMLP(nn.Module):
     def __init__(self, input_dim, num_tags):
@@ -44,26 +260,331 @@ class TagMLP(nn.Module):
         x = self.sigmoid(x)
         return x
 
+class ModelRegistry:
+    """
+    Versioned tag models. Each version is a directory, registry/<version>/, holding
+    tag_mlp_model.pt, mlb_classes.npy and manifest.json (encoder name, input size, number
+    of tags, metrics, parent version, creation time); it is written under a temporary
+    name and renamed into place, and never modified afterwards.
+    registry/ACTIVE.json names the version to serve plus the previously active ones, and is
+    replaced atomically: serving processes poll it and swap models (TagPredictor.load_version),
+    and rollback() just points it back at the previous version.
+    """
+
+    WEIGHTS_FILE = "tag_mlp_model.pt"
+    CLASSES_FILE = "mlb_classes.npy"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self.active_path = os.path.join(root, "ACTIVE.json")
+        os.makedirs(root, exist_ok=True)
+
+    def paths(self, version: str) -> tuple[str, str]:
+        """(weights, classes) paths of a version."""
+        return os.path.join(self.root, version, self.WEIGHTS_FILE), os.path.join(self.root, version, self.CLASSES_FILE)
+
+    def manifest(self, version: str) -> dict:
+        with open(os.path.join(self.root, version, self.MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def versions(self) -> list[dict]:
+        """Manifests of every published version, oldest first."""
+        manifests = [
+            self.manifest(name) for name in os.listdir(self.root)
+            if not name.startswith(".") and os.path.exists(os.path.join(self.root, name, self.MANIFEST_FILE))
+        ]
+        return sorted(manifests, key=lambda manifest: manifest["created_at"])
+
+    def _read_active(self) -> dict:
+        if not os.path.exists(self.active_path):
+            return {"version": None, "history": []}
+        with open(self.active_path) as f:
+            return json.load(f)
+
+    def _write_active(self, active: dict):
+        tmp_path = f"{self.active_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(active, f, indent=2)
+        os.replace(tmp_path, self.active_path)
+
+    def active_version(self):
+        return self._read_active()["version"]
+
+    def publish(self, weights_path: str, classes_path: str, encoder: str, input_dim: int, metrics=None,
+                parent=None, activate=True) -> str:
+        """Copies a trained model into a new version (and makes it the active one). Returns the version."""
+        version = datetime.now(timezone.utc).strftime("v%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(os.path.join(self.root, version)):
+            suffix += 1
+            version = f"{version.split('.')[0]}.{suffix}"
+        classes = np.load(classes_path, allow_pickle=True)
+        tmp_dir = os.path.join(self.root, f".{version}.tmp")
+        os.makedirs(tmp_dir)
+        shutil.copyfile(weights_path, os.path.join(tmp_dir, self.WEIGHTS_FILE))
+        shutil.copyfile(classes_path, os.path.join(tmp_dir, self.CLASSES_FILE))
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILE), "w") as f:
+            json.dump({
+                "version": version,
+                "encoder": encoder,
+                "input_dim": input_dim,
+                "num_tags": len(classes),
+                "metrics": metrics or {},
+                "parent": parent,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }, f, indent=2)
+        os.rename(tmp_dir, os.path.join(self.root, version))
+        print(f"Model registry: published {version}")
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version: str):
+        """Makes `version` the one to serve, remembering the current one for rollback."""
+        self.manifest(version) # Fails if it doesn't exist
+        active = self._read_active()
+        if active["version"] == version:
+            return
+        history = active["history"] + ([active["version"]] if active["version"] else [])
+        self._write_active({"version": version, "history": history[-20:]})
+        print(f"Model registry: {version} is now active")
+
+    def rollback(self) -> str:
+        """Re-activates the previously active version. Returns it."""
+        active = self._read_active()
+        if not active["history"]:
+            raise ValueError("No previous version to roll back to")
+        version = active["history"][-1]
+        self._write_active({"version": version, "history": active["history"][:-1]})
+        print(f"Model registry: rolled back from {active['version']} to {version}")
+        return version
+
+def grow_tag_mlp(model: TagMLP, num_tags: int, new_output_frequencies=None) -> TagMLP:
+    """
+    A TagMLP with `num_tags` outputs whose hidden layer and first outputs are copied from
+    `model`. The appended outputs keep the default init, except their bias is set to the
+    logit of their frequency (if given), so they start out predicting "rare", not 0.5.
+    """
+    old_num_tags = model.fc2.out_features
+    grown = TagMLP(model.fc1.in_features, num_tags).to(model.fc1.weight.device)
+    with torch.no_grad():
+        grown.fc1.load_state_dict(model.fc1.state_dict())
+        grown.fc2.weight[:old_num_tags] = model.fc2.weight
+        grown.fc2.bias[:old_num_tags] = model.fc2.bias
+        if new_output_frequencies is not None:
+            p = torch.as_tensor(np.clip(new_output_frequencies, 1e-3, 0.5), dtype=grown.fc2.bias.dtype)
+            grown.fc2.bias[old_num_tags:] = torch.log(p / (1 - p)).to(grown.fc2.bias.device)
+    return grown
+
+class SentenceEncoder(nn.Module):
+    """
+    The SentenceTransformer pipeline after tokenization (transformer, mean pooling,
+    optional L2 normalization) as one module over (input_ids, attention_mask), so it
+    can be traced to TorchScript.
+    """
+    def __init__(self, transformer, normalize=True):
+        super(SentenceEncoder, self).__init__()
+        self.transformer = transformer
+        self.normalize = normalize
+
+    def forward(self, input_ids, attention_mask):
+        token_embeddings = self.transformer(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+        mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+        embeddings = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        if self.normalize:
+            embeddings = nn.functional.normalize(embeddings, p=2, dim=1)
+        return embeddings
+
+def export_paths(quantize=False):
+    """(encoder, MLP, metadata) paths of an exported backend."""
+    suffix = "_int8" if quantize else ""
+    return (
+        os.path.join(EXPORT_DIR, f"sentence_encoder{suffix}.pt"),
+        os.path.join(EXPORT_DIR, f"tag_mlp{suffix}.pt"),
+        os.path.join(EXPORT_DIR, f"export{suffix}.json"),
+    )
+
+def top_k_agreement(reference: list[list[str]], candidate: list[list[str]], k: int) -> float:
+    """Mean overlap of the top-k tag lists of two backends (1.0 = same tags for every prompt)."""
+    if not reference:
+        return 1.0
+    return float(np.mean([len(set(a[:k]) & set(b[:k])) / max(len(a[:k]), 1) for a, b in zip(reference, candidate)]))
+
 class TagPredictor:
-    def __init__(self, sbert_model_name=SBERT_MODEL_NAME):
+    def __init__(self, sbert_model_name=SBERT_MODEL_NAME, backend=INFERENCE_BACKEND, cache_embeddings=True):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
+        self.sbert_model_name = sbert_model_name
         self.sbert_model = SentenceTransformer(sbert_model_name, device=self.device)
+        self.requested_backend = backend # Served whenever its export matches the loaded model
+        self.backend = "torch"
+        self.encoder_model = None # TorchScript SentenceEncoder when backend != "torch"
+        self.embedding_cache = None
         self.mlp_model = None
         self.mlb = None # MultiLabelBinarizer
+        self.model_version = None # Registry version being served, None for the unversioned MLP_MODEL_PATH
+        # The served model (mlp_model, mlb, encoder_model, embedding_cache, device) is swapped,
+        # and read by predictions, as one unit under this lock, see _serving_state
+        self._model_lock = threading.Lock()
+        self.training_store = TrainingEmbeddingStore()
+        self.registry = ModelRegistry()
 
-        # Try to load a pre-trained model
-        if os.path.exists(MLP_MODEL_PATH) and os.path.exists(MLB_CLASSES_PATH):
+        # Try to load a pre-trained model: the registry's active version, else the plain files
+        active_version = self.registry.active_version()
+        if active_version:
+            self.load_version(active_version)
+        elif os.path.exists(MLP_MODEL_PATH) and os.path.exists(MLB_CLASSES_PATH):
             print(f"Loading pre-trained MLP model from {MLP_MODEL_PATH}")
-            self.mlb = MultiLabelBinarizer()
-            self.mlb.classes_ = np.load(MLB_CLASSES_PATH, allow_pickle=True)
-            sbert_output_dim = self.sbert_model.get_sentence_embedding_dimension()
-            self.mlp_model = TagMLP(sbert_output_dim, len(self.mlb.classes_))
-            self.mlp_model.load_state_dict(torch.load(MLP_MODEL_PATH, map_location=self.device))
-            self.mlp_model.to(self.device)
-            self.mlp_model.eval()
+            self._swap_in(*self._load_model_files(MLP_MODEL_PATH, MLB_CLASSES_PATH), version=None)
         else:
             print("No pre-trained MLP model found. Call train() first.")
+        if cache_embeddings and self.embedding_cache is None:
+            self.embedding_cache = EmbeddingCache(self._embedding_cache_name())
+
+    def _embedding_cache_name(self, backend=None):
+        # int8 embeddings differ slightly from fp32 ones, keep them apart
+        backend = backend or self.backend
+        return f"{self.sbert_model_name}@int8" if backend.endswith("int8") else self.sbert_model_name
+
+    def _load_model_files(self, weights_path, classes_path):
+        mlb = MultiLabelBinarizer()
+        mlb.classes_ = np.load(classes_path, allow_pickle=True)
+        sbert_output_dim = self.sbert_model.get_sentence_embedding_dimension()
+        mlp_model = TagMLP(sbert_output_dim, len(mlb.classes_))
+        mlp_model.load_state_dict(torch.load(weights_path, map_location=self.device))
+        mlp_model.to(self.device)
+        mlp_model.eval()
+        return mlp_model, mlb
+
+    def load_version(self, version: str):
+        """
+        Loads a registry version next to the current model, then swaps it in atomically:
+        a prediction running during the load finishes on the old model, the next one uses
+        the new one. Only the MLP head changes, so the encoder must be the same.
+        """
+        manifest = self.registry.manifest(version)
+        if manifest["encoder"] != self.sbert_model_name:
+            raise ValueError(f"Model {version} was trained on '{manifest['encoder']}', this predictor runs "
+                             f"'{self.sbert_model_name}' (start a new process to switch encoders)")
+        mlp_model, mlb = self._load_model_files(*self.registry.paths(version))
+        self._swap_in(mlp_model, mlb, version)
+        print(f"Tag predictor: serving model {version} ({len(mlb.classes_)} tags, '{self.backend}' backend)")
+
+    def _swap_in(self, mlp_model, mlb, version):
+        """
+        Serves a newly loaded fp32 model: on the requested exported backend if its export
+        matches this model, else explicitly on "torch", so the encoder and the MLP always
+        come from the same backend.
+        """
+        encoder_model, backend, device = None, "torch", self.device
+        if self.requested_backend != "torch":
+            exported = self._load_exported(self.requested_backend, mlb, version)
+            if exported is not None:
+                (encoder_model, mlp_model), backend = exported, self.requested_backend
+                device = torch.device("cpu") # Quantized kernels are CPU-only
+        embedding_cache = self.embedding_cache
+        if embedding_cache is not None and embedding_cache.model_name != self._embedding_cache_name(backend):
+            embedding_cache = EmbeddingCache(self._embedding_cache_name(backend))
+        with self._model_lock:
+            previous_backend = self.backend
+            self.mlp_model, self.mlb, self.model_version = mlp_model, mlb, version
+            self.encoder_model, self.backend, self.embedding_cache = encoder_model, backend, embedding_cache
+            self.device = device
+        if backend != previous_backend:
+            print(f"Tag predictor: switched from the '{previous_backend}' to the '{backend}' backend")
+
+    def publish(self, metrics=None, activate=True) -> str:
+        """Publishes the saved MLP_MODEL_PATH / MLB_CLASSES_PATH as a new registry version."""
+        version = self.registry.publish(
+            MLP_MODEL_PATH, MLB_CLASSES_PATH, encoder=self.sbert_model_name,
+            input_dim=self.sbert_model.get_sentence_embedding_dimension(),
+            metrics=metrics, parent=self.model_version, activate=activate,
+        )
+        if activate:
+            with self._model_lock:
+                self.model_version = version
+        return version
+
+    def _load_exported(self, backend, mlb, version):
+        """The exported TorchScript (encoder, mlp) of this model, or None if they are missing or stale."""
+        encoder_path, mlp_path, meta_path = export_paths(quantize=backend.endswith("int8"))
+        if not all(os.path.exists(path) for path in (encoder_path, mlp_path, meta_path)):
+            print(f"No exported '{backend}' model in {EXPORT_DIR}, run ai/export_model.py. Using 'torch'.")
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta["sbert_model"] != self.sbert_model_name or meta["num_tags"] != len(mlb.classes_)
+                or meta.get("model_version") != version):
+            print(f"Exported '{backend}' model does not match model {version}, re-run ai/export_model.py. Using 'torch'.")
+            return None
+        # Quantized kernels are CPU-only, so exported graphs always run on the CPU
+        encoder_model = torch.jit.load(encoder_path, map_location="cpu").eval()
+        mlp_model = torch.jit.load(mlp_path, map_location="cpu").eval()
+        print(f"Tag predictor: using the '{backend}' backend from {EXPORT_DIR}")
+        return encoder_model, mlp_model
+
+    def export(self, quantize=False):
+        """
+        Traces the encoder and scripts the MLP to TorchScript under EXPORT_DIR, optionally
+        with dynamic int8 quantization of their Linear layers (weights stored as int8,
+        activations quantized on the fly). Load the result with TagPredictor(backend=...).
+        """
+        if not self.mlp_model or not self.mlb or self.backend != "torch":
+            raise ValueError("export() needs the trained fp32 model, train() first and use the 'torch' backend")
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        encoder_path, mlp_path, meta_path = export_paths(quantize)
+        transformer = self.sbert_model[0].auto_model
+        normalize = any(type(module).__name__ == "Normalize" for module in self.sbert_model)
+        encoder = copy.deepcopy(SentenceEncoder(transformer, normalize=normalize)).cpu().eval()
+        mlp = copy.deepcopy(self.mlp_model).cpu().eval()
+        if quantize:
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {nn.Linear}, dtype=torch.qint8)
+            mlp = torch.ao.quantization.quantize_dynamic(mlp, {nn.Linear}, dtype=torch.qint8)
+
+        # Trace with a padded batch so the graph handles any batch size and sequence length
+        example = self._tokenize(["an example prompt", "a somewhat longer example prompt for tracing the encoder"], device="cpu")
+        with torch.no_grad():
+            traced_encoder = torch.jit.trace(encoder, (example["input_ids"], example["attention_mask"]), strict=False)
+            scripted_mlp = torch.jit.script(mlp)
+        torch.jit.save(traced_encoder, encoder_path)
+        torch.jit.save(scripted_mlp, mlp_path)
+        with open(meta_path, "w") as f:
+            json.dump({
+                "sbert_model": self.sbert_model_name,
+                "model_version": self.model_version,
+                "num_tags": len(self.mlb.classes_),
+                "quantized": quantize,
+                "normalize": normalize,
+            }, f)
+        print(f"Exported {'int8' if quantize else 'fp32'} TorchScript model to {encoder_path} and {mlp_path}")
+        return encoder_path, mlp_path
+
+    def _tokenize(self, texts: list[str], device=None):
+        return self.sbert_model.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.sbert_model.max_seq_length, return_tensors="pt",
+        ).to(device or self.device)
+
+    def _serving_state(self):
+        """(mlp_model, mlb, encoder_model, embedding_cache, device) of the served model, all from one backend."""
+        with self._model_lock:
+            return self.mlp_model, self.mlb, self.encoder_model, self.embedding_cache, self.device
+
+    def _encode_uncached(self, texts: list[str], encoder_model=None, device=None, batch_size=64) -> np.ndarray:
+        """Runs the TorchScript `encoder_model` if given, else SBERT."""
+        if encoder_model is None:
+            return self.sbert_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=len(texts) > 1000)
+        # Sort by length so each padded batch wastes as little as possible, like SentenceTransformer.encode
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.sbert_model.get_sentence_embedding_dimension()), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                rows = order[start:start + batch_size]
+                tokens = self._tokenize([texts[i] for i in rows], device=device)
+                embeddings[rows] = encoder_model(tokens["input_ids"], tokens["attention_mask"]).cpu().numpy()
+        return embeddings
 
     def _preprocess_data(self, data_path="ai/data/prompts_tags.csv"):
         """
@@ -78,13 +599,26 @@ class TagPredictor:
         self.mlb = mlb # Store for later use
 
         prompts = df['prompt_text'].tolist()
-        print(f"Generating embeddings for {len(prompts)} prompts...")
-        # Batch processing for SBERT is much faster
-        embeddings = self.sbert_model.encode(prompts, convert_to_tensor=True, show_progress_bar=True)
-        return prompts, embeddings.cpu(), torch.tensor(labels, dtype=torch.float32)
+        # Precomputed per dataset version (see TrainingEmbeddingStore), only new rows are encoded
+        embeddings = torch.from_numpy(np.array(self.training_store.load(self, prompts)))
+        return prompts, embeddings, torch.tensor(labels, dtype=torch.float32)
+
+    def encode(self, texts: list[str], remember=True) -> np.ndarray:
+        """SBERT embeddings (float32, len(texts) x dim), through the embedding cache."""
+        _, _, encoder_model, embedding_cache, device = self._serving_state()
+        return self._encode(texts, encoder_model, embedding_cache, device, remember=remember)
+
+    def _encode(self, texts: list[str], encoder_model, embedding_cache, device, remember=True) -> np.ndarray:
+        """encode() with the encoder, cache and device of one _serving_state() snapshot."""
+        encode_fn = lambda batch: self._encode_uncached(batch, encoder_model=encoder_model, device=device)
+        if embedding_cache is None:
+            return np.asarray(encode_fn([normalize_text(text) for text in texts]), dtype=np.float32)
+        return embedding_cache.encode(texts, encode_fn, remember=remember)
 
 
     def train(self, data_path="ai/data/prompts_tags.csv", epochs=20, lr=1e-4, batch_size=32):
+        if self.backend != "torch":
+            raise ValueError(f"train() needs the fp32 'torch' backend, not '{self.backend}' (export again after training)")
         if self.mlb is None: # Ensure MLB is fitted if not loaded
             prompts, embeddings, labels = self._preprocess_data(data_path)
         else: # MLB already loaded or fitted
@@ -94,85 +628,172 @@ class TagPredictor:
             df['tags_list'] = df['tags'].apply(lambda x: [tag.strip() for tag in x.split(',')] if pd.notnull(x) else [])
             labels_for_split = self.mlb.transform(df['tags_list']) # Use existing mlb
             prompts = df['prompt_text'].tolist()
-            print(f"Generating embeddings for {len(prompts)} prompts...")
-            embeddings = self.sbert_model.encode(prompts, convert_to_tensor=True, show_progress_bar=True).cpu()
+            embeddings = torch.from_numpy(np.array(self.training_store.load(self, prompts)))
             labels = torch.tensor(labels_for_split, dtype=torch.float32)
 
-
-        # Split data
-        train_embeddings, val_embeddings, train_labels, val_labels = train_test_split(
-            embeddings, labels, test_size=0.2, random_state=42
-        )
-
-        # Create DataLoaders
-        train_dataset = PromptTagDataset(None, train_embeddings, train_labels) # Prompts not needed for DataLoader
-        val_dataset = PromptTagDataset(None, val_embeddings, val_labels)
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=batch_size)
-
         sbert_output_dim = self.sbert_model.get_sentence_embedding_dimension()
         num_tags = len(self.mlb.classes_)
         self.mlp_model = TagMLP(sbert_output_dim, num_tags).to(self.device)
+        print(f"Training MLP with {num_tags} tags...")
+        val_loss = self._fit(embeddings, labels, epochs=epochs, lr=lr, batch_size=batch_size)
+
+        torch.save(self.mlp_model.state_dict(), MLP_MODEL_PATH)
+        print(f"MLP model saved to {MLP_MODEL_PATH}")
+        return {"pairs": len(prompts), "num_tags": num_tags, "val_loss": val_loss}
+
+    def train_incremental(self, prompts: list[str], tag_lists: list[list[str]], epochs=5, lr=5e-5, batch_size=32,
+                          replay_prompts: list[str] = None, replay_tag_lists: list[list[str]] = None) -> dict:
+        """
+        Fine-tunes the saved TagMLP on new (prompt, tags) pairs instead of retraining from scratch.
+        Tags the model doesn't know yet are appended to the label space: existing outputs keep
+        their index and weights, new output rows start from a fresh init with a bias matching
+        the tag's frequency. Replay pairs (e.g. the original CSV) are mixed in so the model
+        doesn't forget older tags. Saves the weights and classes, returns a summary.
+        """
+        if self.backend != "torch":
+            raise ValueError(f"train_incremental() needs the fp32 'torch' backend, not '{self.backend}'")
+        if not self.mlp_model or not self.mlb:
+            raise ValueError("No trained model to fine-tune, run train() first")
+        all_prompts = list(prompts) + list(replay_prompts or [])
+        all_tag_lists = [list(tags) for tags in tag_lists] + [list(tags) for tags in (replay_tag_lists or [])]
+        if not all_prompts:
+            return {"pairs": 0, "new_tags": []}
+
+        known = set(self.mlb.classes_.tolist())
+        new_tags = sorted({tag for tags in tag_lists for tag in tags} - known)
+        if new_tags:
+            classes = np.concatenate([self.mlb.classes_, np.array(new_tags, dtype=object)])
+            frequencies = np.array([sum(tag in tags for tags in all_tag_lists) for tag in new_tags]) / len(all_tag_lists)
+            self.mlp_model = grow_tag_mlp(self.mlp_model, len(classes), new_output_frequencies=frequencies).to(self.device)
+            self.mlb.classes_ = classes
+            self.mlb._cached_dict = None # MultiLabelBinarizer caches the class -> index map
+            print(f"Label space grown by {len(new_tags)} tags to {len(classes)}")
+
+        class_index = {tag: i for i, tag in enumerate(self.mlb.classes_.tolist())}
+        labels = torch.zeros((len(all_prompts), len(class_index)), dtype=torch.float32)
+        for row, tags in enumerate(all_tag_lists):
+            labels[row, [class_index[tag] for tag in tags if tag in class_index]] = 1.0
+        embeddings = torch.from_numpy(np.array(self.training_store.load(self, all_prompts)))
+
+        print(f"Fine-tuning MLP on {len(prompts)} new pairs (+{len(all_prompts) - len(prompts)} replayed)...")
+        val_loss = self._fit(embeddings, labels, epochs=epochs, lr=lr, batch_size=batch_size)
+        self._save_atomically()
+        return {"pairs": len(prompts), "replayed": len(all_prompts) - len(prompts), "new_tags": new_tags,
+                "num_tags": len(class_index), "val_loss": val_loss}
+
+    def _save_atomically(self):
+        """Writes weights and classes next to the live files and renames them in (a reader never sees half a file)."""
+        torch.save(self.mlp_model.state_dict(), MLP_MODEL_PATH + ".tmp")
+        with open(MLB_CLASSES_PATH + ".tmp", "wb") as f:
+            np.save(f, self.mlb.classes_, allow_pickle=True)
+        os.replace(MLB_CLASSES_PATH + ".tmp", MLB_CLASSES_PATH)
+        os.replace(MLP_MODEL_PATH + ".tmp", MLP_MODEL_PATH)
+        print(f"MLP model saved to {MLP_MODEL_PATH}")
+
+    def _fit(self, embeddings, labels, epochs, lr, batch_size) -> float:
+        """Trains self.mlp_model in place on an 80/20 split. Returns the last validation loss."""
+        # Split data
+        train_indices, val_indices = train_test_split(np.arange(len(embeddings)), test_size=0.2, random_state=42)
+        # Whole splits as contiguous tensors on the device: batches are slices, no DataLoader/collate per item
+        train_embeddings = embeddings[train_indices].to(self.device)
+        train_labels = labels[train_indices].to(self.device)
+        val_embeddings = embeddings[val_indices].to(self.device)
+        val_labels = labels[val_indices].to(self.device)
+        num_train_batches = (len(train_indices) + batch_size - 1) // batch_size
+        num_val_batches = (len(val_indices) + batch_size - 1) // batch_size
+        generator = torch.Generator(device="cpu").manual_seed(42)
 
         criterion = nn.BCELoss() # Binary Cross-Entropy for multi-label
         optimizer = optim.Adam(self.mlp_model.parameters(), lr=lr)
 
-        print(f"Training MLP with {num_tags} tags...")
+        avg_val_loss = float("nan")
         for epoch in range(epochs):
             self.mlp_model.train()
-            total_loss = 0
-            for emb_batch, label_batch in train_loader:
-                emb_batch, label_batch = emb_batch.to(self.device), label_batch.to(self.device)
+            # Shuffle once per epoch with one gather, then every batch is a contiguous slice
+            order = torch.randperm(len(train_indices), generator=generator).to(self.device)
+            epoch_embeddings, epoch_labels = train_embeddings[order], train_labels[order]
+            total_loss = torch.zeros((), device=self.device)
+            for start in range(0, len(train_indices), batch_size):
                 optimizer.zero_grad()
-                outputs = self.mlp_model(emb_batch)
-                loss = criterion(outputs, label_batch)
+                outputs = self.mlp_model(epoch_embeddings[start:start + batch_size])
+                loss = criterion(outputs, epoch_labels[start:start + batch_size])
                 loss.backward()
                 optimizer.step()
-                total_loss += loss.item()
-            avg_train_loss = total_loss / len(train_loader)
+                total_loss += loss.detach() # No .item() per step, it would sync with the device every batch
+            avg_train_loss = total_loss.item() / num_train_batches
 
             # Validation
             self.mlp_model.eval()
-            total_val_loss = 0
+            total_val_loss = torch.zeros((), device=self.device)
             with torch.no_grad():
-                for emb_batch, label_batch in val_loader:
-                    emb_batch, label_batch = emb_batch.to(self.device), label_batch.to(self.device)
-                    outputs = self.mlp_model(emb_batch)
-                    loss = criterion(outputs, label_batch)
-                    total_val_loss += loss.item()
-            avg_val_loss = total_val_loss / len(val_loader)
+                for start in range(0, len(val_indices), batch_size):
+                    outputs = self.mlp_model(val_embeddings[start:start + batch_size])
+                    total_val_loss += criterion(outputs, val_labels[start:start + batch_size])
+            avg_val_loss = total_val_loss.item() / max(num_val_batches, 1)
             print(f"Epoch [{epoch+1}/{epochs}], Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}")
-
-        torch.save(self.mlp_model.state_dict(), MLP_MODEL_PATH)
-        print(f"MLP model saved to {MLP_MODEL_PATH}")
+        self.mlp_model.eval()
+        return avg_val_loss
 
     def predict(self, prompt_text: str, threshold=0.3, top_n=5) -> list[str]:
-        if not self.mlp_model or not self.mlb:
+        return [tag for tag, _ in self.predict_with_scores(prompt_text, threshold=threshold, top_n=top_n)]
+
+    def predict_with_scores(self, prompt_text: str, threshold=0.3, top_n=5) -> list[tuple[str, float]]:
+        """Like predict, but returns (tag, probability) pairs, most probable first."""
+        return self.predict_batch_with_scores([prompt_text], threshold=threshold, top_n=top_n)[0]
+
+    def predict_batch(self, prompts: list[str], threshold=0.3, top_n=5) -> list[list[str]]:
+        """predict for many prompts at once: one SBERT encode and one MLP forward pass."""
+        return [[tag for tag, _ in tags] for tags in self.predict_batch_with_scores(prompts, threshold=threshold, top_n=top_n)]
+
+    def predict_batch_with_scores(self, prompts: list[str], threshold=0.3, top_n=5) -> list[list[tuple[str, float]]]:
+        # One consistent model (MLP, classes, encoder, cache, device) even if load_version swaps it meanwhile
+        mlp_model, mlb, encoder_model, embedding_cache, device = self._serving_state()
+        if not mlp_model or not mlb:
             print("Model not trained or loaded. Please train or ensure model files exist.")
+            return [[] for _ in prompts]
+        if not prompts:
             return []
 
-        self.mlp_model.eval()
+        mlp_model.eval()
         with torch.no_grad():
-            embedding = self.sbert_model.encode(prompt_text, convert_to_tensor=True).to(self.device)
-            # SBERT might return a 2D tensor if input is a list, ensure it's 1D for single prompt
-            if embedding.ndim > 1:
-                embedding = embedding.squeeze(0)
-            
-            output_probs = self.mlp_model(embedding.unsqueeze(0)) # Add batch dim for MLP
-
-        output_probs = output_probs.squeeze().cpu().numpy() # Remove batch dim and move to numpy
-
-        # Method 1: Thresholding
-        # predicted_indices = np.where(output_probs > threshold)[0]
-        # predicted_tags = self.mlb.classes_[predicted_indices].tolist()
-
-        # Method 2: Top N
-        sorted_indices = np.argsort(output_probs)[::-1] # Sort descending
-        top_n_indices = sorted_indices[:top_n]
+            embeddings = torch.from_numpy(self._encode(prompts, encoder_model, embedding_cache, device)).to(device)
+            output_probs = mlp_model(embeddings).cpu().numpy() # (batch, num_tags)
+
+        # Top N per row without sorting every tag: argpartition, then sort only the N winners
+        top_n = min(top_n, output_probs.shape[1])
+        top_indices = np.argpartition(-output_probs, top_n - 1, axis=1)[:, :top_n]
+        top_probs = np.take_along_axis(output_probs, top_indices, axis=1)
+        order = np.argsort(-top_probs, axis=1)
+        top_indices = np.take_along_axis(top_indices, order, axis=1)
+        top_probs = np.take_along_axis(top_probs, order, axis=1)
         # Filter by threshold as well for top_n to ensure relevance
-        predicted_tags = [self.mlb.classes_[i] for i in top_n_indices if output_probs[i] > threshold]
+        keep = top_probs > threshold
+
+        classes = mlb.classes_
+        return [
+            [(classes[i], float(p)) for i, p in zip(row_indices[row_keep], row_probs[row_keep])]
+            for row_indices, row_probs, row_keep in zip(top_indices, top_probs, keep)
+        ]
+
+# The shared predictor instance, created on first use rather than at import: loading SBERT
+# and the weights takes seconds and shouldn't slow down (or serialize) every process start
+_predictor = None
+_predictor_lock = threading.Lock()
+
+def get_predictor() -> TagPredictor:
+    """The shared TagPredictor, loaded on first call (thread-safe)."""
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = TagPredictor()
+    return _predictor
 
-        return predicted_tags
+def is_predictor_loaded() -> bool:
+    return _predictor is not None
 
-# Create a global predictor instance (can be loaded once in ai_service.py)
-predictor = TagPredictor()
+def __getattr__(name):
+    # `from ai.tag_predictor import predictor` still works, it just loads on first access
+    if name == "predictor":
+        return get_predictor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
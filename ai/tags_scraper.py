@@ -1,7 +1,13 @@
 import pylast
 import time
 import os
+import json
+import hashlib
+import pickle
+import sqlite3
+import threading
 import joblib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,35 +21,246 @@ password_hash = pylast.md5(os.getenv("LASTFM_PASSWORD_HASH"))
 
 network = pylast.LastFMNetwork(api_key=lastfm_key, api_secret=lastfm_secret, username=lastfm_username, password_hash=password_hash)
 
-def collect_expanded_tags(tag_limit=100, track_limit=30):
-    base_tags = network.get_top_tags(limit=tag_limit)
-    all_tags = set()
-
-    for tag_obj in base_tags:
-        tag_name = tag_obj.item.get_name().lower()
-        all_tags.add(tag_name)
-
-        print(f"▶️ Expanding from tag: {tag_name}")
-        try:
-            tracks = tag_obj.item.get_top_tracks(limit=track_limit)
-            for track_obj, _ in tracks:
-                try:
-                    track_tags = track_obj.get_top_tags(limit=5)
-                    for t in track_tags:
-                        all_tags.add(t.item.get_name().lower())
-                except:
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+TAG_VOCABULARY_FORMAT_VERSION = 1
+
+def _atomic_write(path, write):
+    """Writes through `write(tmp_path)` and renames into place, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` calls per second on average, up to `burst` back to back."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1 # Reserve a token now, possibly going into debt...
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait) # ...and wait for it outside the lock
+
+class ResponseCache:
+    """
+    On-disk cache of Last.fm responses (SQLite, one row per call), so a rerun or a resumed
+    crawl only calls the API for what it hasn't seen, or what is older than max_age_days.
+    Only successful responses are stored ("not found" counts as a successful empty one).
+    """
+
+    def __init__(self, path, max_age_days=30):
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, fetched_at REAL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.max_age_seconds:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, json.dumps(value), time.time()))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+class LastfmCrawler:
+    """
+    Expands Last.fm's top tags through their top tracks' tags: a bounded pool of
+    `max_concurrency` threads works on base tags in parallel, every API call goes through
+    one token bucket (`rate` calls/s) and the response cache, transient errors are retried
+    with backoff. After each base tag the progress is checkpointed, so an interrupted
+    crawl resumes where it stopped.
+    """
+
+    def __init__(self, network, cache_path, checkpoint_path, max_concurrency=8, rate=4.0, max_retries=3,
+                 max_age_days=30):
+        self.network = network
+        self.cache = ResponseCache(cache_path, max_age_days)
+        self.checkpoint_path = checkpoint_path
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate, burst=max_concurrency)
+        self.max_retries = max_retries
+        self.stats = {"api_calls": 0, "cache_hits": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _call(self, key, fetch):
+        """Cached, rate-limited, retried API call. Returns None if it kept failing."""
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            self._count("api_calls")
+            try:
+                value = fetch()
+            except pylast.WSError as e:
+                if e.status == "6": # Not found: a valid, empty answer
+                    value = []
+                elif attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+                    continue
+                else:
+                    print(f"⚠️ Giving up on {key}: {e}")
+                    self._count("errors")
+                    return None
+            except (pylast.NetworkError, pylast.MalformedResponseError) as e:
+                if attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+                    continue
+                print(f"⚠️ Giving up on {key}: {e}")
+                self._count("errors")
+                return None
+            self.cache.set(key, value)
+            return value
+
+    # The lookups below return None when the call kept failing, which is not "no results"
+    def top_tags(self, limit):
+        return self._call(f"chart.getTopTags:{limit}",
+                          lambda: [item.item.get_name().lower() for item in self.network.get_top_tags(limit=limit)])
+
+    def tag_top_tracks(self, tag, limit):
+        return self._call(f"tag.getTopTracks:{tag}:{limit}", lambda: [
+            [item.item.artist.name, item.item.title] for item in pylast.Tag(tag, self.network).get_top_tracks(limit=limit)
+        ])
+
+    def track_top_tags(self, artist, title, limit=5):
+        return self._call(f"track.getTopTags:{artist}:{title}:{limit}", lambda: [
+            item.item.get_name().lower() for item in pylast.Track(artist, title, self.network).get_top_tags(limit=limit)
+        ])
+
+    def tag_exists(self, tag):
+        """A tag is usable if Last.fm has tracks for it (getTag alone doesn't hit the API). None if unknown."""
+        exists = self._call(f"tag.exists:{tag}", lambda: bool(pylast.Tag(tag, self.network).get_top_tracks(limit=1)))
+        return None if exists is None else bool(exists) # "Not found" is cached as []
+
+    def validate_tags(self, tags):
+        """
+        Checks the whole vocabulary concurrently. Answers come from the response cache while
+        fresh, so a rerun only calls the API for new or expired tags. Returns {tag: bool or None}.
+        """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            results = dict(zip(tags, pool.map(self.tag_exists, tags)))
+        self.report(time.perf_counter() - started)
+        return results
+
+    def expand_tag(self, tag, track_limit):
+        """
+        The tag itself plus the top tags of its top tracks, or None if a lookup failed (the
+        successful ones are cached, so retrying the tag later is cheap).
+        """
+        tracks = self.tag_top_tracks(tag, track_limit)
+        if tracks is None:
+            return None
+        tags = {tag}
+        for artist, title in tracks:
+            track_tags = self.track_top_tags(artist, title)
+            if track_tags is None:
+                return None
+            tags.update(track_tags)
+        return tags
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return set(), set()
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        return set(checkpoint["done"]), set(checkpoint["tags"])
+
+    def _save_checkpoint(self, done, tags):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump({"done": sorted(done), "tags": sorted(tags)}, f)
+        _atomic_write(self.checkpoint_path, write)
+
+    def crawl(self, tag_limit=100, track_limit=30):
+        """
+        Returns (sorted collected tags, base tags that failed), resuming from the checkpoint if
+        there is one. Failed base tags are not checkpointed as done, so the next run retries them.
+        """
+        started = time.perf_counter()
+        done, all_tags = self._load_checkpoint()
+        base_tags = self.top_tags(tag_limit)
+        if base_tags is None:
+            raise RuntimeError("Could not fetch Last.fm's top tags")
+        failed = []
+        todo = [tag for tag in base_tags if tag not in done]
+        if done:
+            print(f"↩️ Resuming: {len(done)} base tags already expanded, {len(todo)} to go")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = {pool.submit(self.expand_tag, tag, track_limit): tag for tag in todo}
+            for future in as_completed(futures):
+                tag = futures[future]
+                expanded = future.result()
+                if expanded is None:
+                    failed.append(tag)
+                    print(f"⚠️ Could not expand {tag}, it will be retried on the next run")
                     continue
-            time.sleep(0.3)  # Rate limit safe
-        except Exception as e:
-            print(f"⚠️ Error on {tag_name}: {e}")
+                all_tags.update(expanded)
+                done.add(tag)
+                self._save_checkpoint(done, all_tags)
+                print(f"▶️ Expanded {tag} ({len(done)}/{len(base_tags)}, {len(all_tags)} tags)")
+        self.report(time.perf_counter() - started)
+        return sorted(all_tags), failed
+
+    def report(self, elapsed):
+        calls, hits = self.stats["api_calls"], self.stats["cache_hits"]
+        lookups = calls + hits
+        print(f"\n⏱️ {elapsed:.1f}s: {calls} API calls ({calls / max(elapsed, 1e-9):.1f}/s), "
+              f"{lookups / max(elapsed, 1e-9):.1f} lookups/s, cache hit rate {hits / max(lookups, 1):.1%}, "
+              f"{self.stats['errors']} failed calls")
+
+def _make_crawler(max_concurrency=8, rate=4.0, max_age_days=30):
+    return LastfmCrawler(
+        network,
+        cache_path=os.path.join(DATA_DIR, "lastfm_cache.sqlite"),
+        checkpoint_path=os.path.join(DATA_DIR, "lastfm_crawl_checkpoint.json"),
+        max_concurrency=max_concurrency,
+        rate=rate,
+        max_age_days=max_age_days,
+    )
+
+def collect_expanded_tags(tag_limit=100, track_limit=30, max_concurrency=8, rate=4.0):
+    crawler = _make_crawler(max_concurrency, rate)
+    try:
+        tags, failed = crawler.crawl(tag_limit=tag_limit, track_limit=track_limit)
+    finally:
+        crawler.cache.close()
+    if failed:
+        # Incomplete: keep the previous tag list and the checkpoint, a rerun retries only these
+        print(f"\n❌ {len(failed)} base tags could not be expanded, nothing saved. Run again to resume.")
+        return None
 
-    tags = sorted(all_tags)
     print(f"\n✅ Total collected tags: {len(tags)}\n")
-    for tag in tags:
-        print(tag)
-        output_path = os.path.join(os.path.dirname(__file__), "..", "data", "lastfm_tags_list.pkl")
-        joblib.dump(tags, output_path)
+    output_path = os.path.join(DATA_DIR, "lastfm_tags_list.pkl")
+    _atomic_write(output_path, lambda tmp_path: joblib.dump(tags, tmp_path)) # Once, at the end
+    if os.path.exists(crawler.checkpoint_path):
+        os.remove(crawler.checkpoint_path) # Finished: the next crawl starts over (from the response cache)
     print(f"\n📦 Tags saved to {output_path}")
+    return tags
 
 def save_spotify_tags(file):
     with open(file, "r") as f:
@@ -55,42 +272,70 @@ def save_spotify_tags(file):
     print(tags)
     return tags
 
-def compare_genres_lastfmtags(spotify_tags):
-    # take each tag from spotify_tags and check if it exists in lastfm using the api
-    # use network and pylast to check if the tag exists
-    for tag in spotify_tags:
-        try:
-            network.get_tag(tag)
-        except pylast.WSError as e:
-            if e.code == 404:
-                print(f"❌ Tag '{tag}' not found in Last.fm")
-                spotify_tags.remove(tag)
-            else:
-                print(f"⚠️ Error checking tag '{tag}': {e}")
-    print(f"\n✅ Common tags found: {len(spotify_tags)}")
-    print(spotify_tags)
-    output_path = os.path.join(os.path.dirname(__file__), "..", "data", "genre_tags_list.pkl")
-    joblib.dump(spotify_tags, output_path)
+def compare_genres_lastfmtags(spotify_tags, max_age_days=30):
+    # Keeps the Spotify genres Last.fm knows, checked concurrently and cached with a timestamp:
+    # a rerun only asks Last.fm about new tags or answers older than max_age_days.
+    # The result goes to its own file: genre_tags_list.pkl (from genres.txt) stays the full
+    # input, so a genre rejected once is checked again when its answer expires
+    crawler = _make_crawler(max_age_days=max_age_days)
+    try:
+        results = crawler.validate_tags(sorted(set(spotify_tags)))
+    finally:
+        crawler.cache.close()
+
+    common_tags = []
+    for tag, exists in results.items():
+        if exists is False:
+            print(f"❌ Tag '{tag}' not found in Last.fm")
+        else:
+            if exists is None: # Kept, and checked again on the next run
+                print(f"⚠️ Could not check tag '{tag}', keeping it")
+            common_tags.append(tag)
+    print(f"\n✅ Common tags found: {len(common_tags)}/{len(results)}")
+    output_path = os.path.join(DATA_DIR, "validated_genre_tags_list.pkl")
+    _atomic_write(output_path, lambda tmp_path: joblib.dump(common_tags, tmp_path))
     print(f"\n📦 Common tags saved to {output_path}")
-    return spotify_tags
+    return common_tags
+
+def save_tag_vocabulary(tags, path):
+    # Versioned and compact: one newline-joined string unpickles far faster than a list of
+    # thousands of str objects, and the content hash tells consumers when the vocabulary changed
+    tags = sorted({tag for tag in tags if "\n" not in tag})
+    blob = "\n".join(tags)
+    vocabulary = {
+        "format_version": TAG_VOCABULARY_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "sha1": hashlib.sha1(blob.encode("utf-8")).hexdigest(),
+        "count": len(tags),
+        "tags": blob,
+    }
+    _atomic_write(path, lambda tmp_path: joblib.dump(vocabulary, tmp_path, protocol=pickle.HIGHEST_PROTOCOL))
+
+def load_tag_vocabulary(path):
+    # Sorted tag list, from a versioned vocabulary file or a legacy pickled list
+    data = joblib.load(path)
+    if isinstance(data, list):
+        return data
+    if data.get("format_version") != TAG_VOCABULARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported tag vocabulary format {data.get('format_version')} in {path}")
+    return data["tags"].split("\n") if data["tags"] else []
 
 def append_lastfm_tags_to_spotify_tags(spotify_tags, lastfm_tags):
     # Append Last.fm tags to Spotify tags
-    combined_tags = set(spotify_tags + lastfm_tags)
-    combined_tags = sorted(combined_tags)
-    output_path = os.path.join(os.path.dirname(__file__), "..", "data", "combined_tags_list.pkl")
-    joblib.dump(combined_tags, output_path)
+    combined_tags = sorted(set(spotify_tags) | set(lastfm_tags))
+    output_path = os.path.join(DATA_DIR, "combined_tags_list.pkl")
+    save_tag_vocabulary(combined_tags, output_path)
     print(f"\n📦 Combined tags saved to {output_path}")
     return combined_tags
 
 def main():
     # Collect and save Last.fm tags
-    # collect_expanded_tags(tag_limit=70, track_limit=25)
+    # collect_expanded_tags(tag_limit=70, track_limit=25) # Resumable: rerun after an interruption
     # genres_file = os.path.join(os.path.dirname(__file__), "..", "data", "genres.txt")
     # spotify_tags = save_spotify_tags(genres_file)
 
-    lastfm_tags = joblib.load(os.path.join(os.path.dirname(__file__), "..", "data", "lastfm_tags_list.pkl"))
-    spotify_tags = joblib.load(os.path.join(os.path.dirname(__file__), "..", "data", "genre_tags_list.pkl"))
+    lastfm_tags = joblib.load(os.path.join(DATA_DIR, "lastfm_tags_list.pkl"))
+    spotify_tags = joblib.load(os.path.join(DATA_DIR, "genre_tags_list.pkl"))
     common_tags = compare_genres_lastfmtags(spotify_tags)
     append_lastfm_tags_to_spotify_tags(common_tags, lastfm_tags)
 
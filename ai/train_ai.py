@@ -41,8 +41,10 @@ if __name__ == "__main__":
     # 3. Run the training process
     #    This calls the .train() method of the TagPredictor class.
     print("Starting model training...")
-    predictor_instance.train(data_path=training_data_path, epochs=50, lr=1e-4, batch_size=16) # Adjust params as needed
+    metrics = predictor_instance.train(data_path=training_data_path, epochs=50, lr=1e-4, batch_size=16) # Adjust params as needed
     print("Model training complete.")
+    # New registry version, picked up by running API workers without a restart
+    predictor_instance.publish(metrics=metrics)
 
     # 4. (Optional) Test prediction after training
     print("\nTesting prediction with the newly trained model:")
@@ -16,6 +16,18 @@ class Settings(BaseSettings):
 
     # OpenAI
     OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
+    OPENAI_STREAMING: bool = os.getenv("OPENAI_STREAMING", "true").lower() == "true" # Streaming endpoint parses songs as tokens arrive
+
+    # Recommendation engine: "openai", "local" (tag recommender, no external call) or
+    # "auto" (OpenAI, falling back to local if it fails or takes longer than the timeout)
+    RECOMMENDER_ENGINE: str = os.getenv("RECOMMENDER_ENGINE", "auto")
+    OPENAI_FALLBACK_TIMEOUT_SECONDS: float = float(os.getenv("OPENAI_FALLBACK_TIMEOUT_SECONDS", 8)) # "auto" only
+    LOCAL_RECOMMENDER_TOP_TAGS: int = int(os.getenv("LOCAL_RECOMMENDER_TOP_TAGS", 8)) # Predicted tags used as the query
+    # Tag prediction (TagPredictor): concurrent requests are coalesced into one batch
+    TAG_PREDICTION_MAX_BATCH_SIZE: int = int(os.getenv("TAG_PREDICTION_MAX_BATCH_SIZE", 32))
+    TAG_PREDICTION_MAX_WAIT_MS: float = float(os.getenv("TAG_PREDICTION_MAX_WAIT_MS", 5)) # How long the first request waits for company
+    LOCAL_RECOMMENDER_MAX_POSTINGS_PER_TAG: int = int(os.getenv("LOCAL_RECOMMENDER_MAX_POSTINGS_PER_TAG", 20000)) # 0 = exact scoring
+    LOCAL_RECOMMENDER_REFRESH_SECONDS: int = int(os.getenv("LOCAL_RECOMMENDER_REFRESH_SECONDS", 600)) # Index rebuild interval
 
     # Spotify
     SPOTIFY_CLIENT_ID: Optional[str] = os.getenv("SPOTIFY_CLIENT_ID")
@@ -23,12 +35,73 @@ class Settings(BaseSettings):
     SPOTIFY_REDIRECT_URI: str = os.getenv("SPOTIFY_REDIRECT_URI", "http://localhost:8000/api/v1/spotify/callback")
     SPOTIFY_PLAYLIST_MAX_TRACKS: int = int(os.getenv("SPOTIFY_PLAYLIST_MAX_TRACKS", 25)) # Cast to int
     SPOTIFY_SCOPE: str = "playlist-modify-public playlist-modify-private user-library-read" # Add scope here
+    SPOTIFY_THREAD_POOL_SIZE: int = int(os.getenv("SPOTIFY_THREAD_POOL_SIZE", 16)) # Threads for blocking Spotipy calls
+    SPOTIFY_SEARCH_CONCURRENCY: int = int(os.getenv("SPOTIFY_SEARCH_CONCURRENCY", 8)) # Parallel track searches per playlist
+    SPOTIFY_CLIENT_POOL_SIZE: int = int(os.getenv("SPOTIFY_CLIENT_POOL_SIZE", 100)) # Pooled clients (users/tokens)
+    SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS: int = int(os.getenv("SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS", 300)) # Refresh this long before expiry
+    SPOTIFY_ID_REVALIDATE_SECONDS: int = int(os.getenv("SPOTIFY_ID_REVALIDATE_SECONDS", 30 * 24 * 3600)) # Re-check stored track IDs
+    SPOTIFY_MISS_RETRY_SECONDS: int = int(os.getenv("SPOTIFY_MISS_RETRY_SECONDS", 7 * 24 * 3600)) # Don't search unfound songs again before
 
     # Last.fm
     LASTFM_API_KEY: Optional[str] = os.getenv("LASTFM_API_KEY")
     LASTFM_API_SECRET: Optional[str] = os.getenv("LASTFM_API_SECRET")
+    LASTFM_MAX_CONCURRENCY: int = int(os.getenv("LASTFM_MAX_CONCURRENCY", 8)) # Parallel tag lookups per request
+    LASTFM_REQUESTS_PER_SECOND: float = float(os.getenv("LASTFM_REQUESTS_PER_SECOND", 5)) # Shared across all requests
+
+    # Tag cache (DB + in-process LRU in front of Last.fm)
+    TAG_CACHE_TTL_SECONDS: int = int(os.getenv("TAG_CACHE_TTL_SECONDS", 30 * 24 * 3600)) # Songs with tags
+    TAG_CACHE_NEGATIVE_TTL_SECONDS: int = int(os.getenv("TAG_CACHE_NEGATIVE_TTL_SECONDS", 7 * 24 * 3600)) # "No tags / not found"
+    TAG_CACHE_MAX_ENTRIES: int = int(os.getenv("TAG_CACHE_MAX_ENTRIES", 10000))
+
+    # Background tag enrichment (enrichment_jobs queue + in-process workers)
+    ENRICHMENT_IN_BACKGROUND: bool = os.getenv("ENRICHMENT_IN_BACKGROUND", "true").lower() == "true" # false = fetch tags before responding
+    ENRICHMENT_WORKERS: int = int(os.getenv("ENRICHMENT_WORKERS", 2))
+    ENRICHMENT_BATCH_SIZE: int = int(os.getenv("ENRICHMENT_BATCH_SIZE", 25)) # Jobs claimed per worker iteration
+    ENRICHMENT_POLL_SECONDS: float = float(os.getenv("ENRICHMENT_POLL_SECONDS", 5))
+    ENRICHMENT_MAX_ATTEMPTS: int = int(os.getenv("ENRICHMENT_MAX_ATTEMPTS", 5))
+    ENRICHMENT_RETRY_BASE_SECONDS: int = int(os.getenv("ENRICHMENT_RETRY_BASE_SECONDS", 30)) # Doubles per attempt
+    ENRICHMENT_LEASE_SECONDS: int = int(os.getenv("ENRICHMENT_LEASE_SECONDS", 300)) # Running jobs older than this are retaken
+
+    # Prompt cache (reuses stored recommendations for repeated prompts)
+    PROMPT_CACHE_TTL_SECONDS: int = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", 7 * 24 * 3600)) # 0 disables the cache
+    # Semantic prompt cache: reuse the recommendations of a paraphrased prompt
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9)) # Min cosine similarity
+
+    # Directory for persisted vector indexes (memory-mapped at runtime)
+    INDEX_DIR: str = os.getenv("INDEX_DIR", os.path.join(os.path.dirname(__file__), "indexes"))
+    # Song embedding index (title, artist and tags), for nearest-neighbour retrieval from prompts
+    SONG_INDEX_ENABLED: bool = os.getenv("SONG_INDEX_ENABLED", "true").lower() == "true"
+    SONG_INDEX_DTYPE: str = os.getenv("SONG_INDEX_DTYPE", "float16") # float16 halves the file, float32 is exact
+    SONG_INDEX_NPROBE: int = int(os.getenv("SONG_INDEX_NPROBE", 16)) # IVF lists scanned per query
+
+    # Startup: the tag model and API clients load lazily; warm-up loads them in the background
+    # right after startup (GET /ready reports when it is done) instead of on the first request
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+    # gunicorn (backend/gunicorn_conf.py): load the model and read-only indexes once in the master
+    # before forking, so workers share those pages copy-on-write instead of each loading a copy
+    PRELOAD_MODELS: bool = os.getenv("PRELOAD_MODELS", "true").lower() == "true"
+    # How often workers check the model registry for a new active tag model (0 = never)
+    MODEL_RELOAD_SECONDS: float = float(os.getenv("MODEL_RELOAD_SECONDS", 30))
 
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./moodtunes.db")
+    # Async engine (aiosqlite / asyncpg) for the request path, so DB waits overlap with API waits
+    DATABASE_ASYNC: bool = os.getenv("DATABASE_ASYNC", "false").lower() == "true"
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", 5)) # Connections kept open (non-SQLite)
+
+    # Engine profile: "production" applies the settings below, "default" uses SQLAlchemy/SQLite defaults
+    DATABASE_PROFILE: str = os.getenv("DATABASE_PROFILE", "production")
+    # SQLite (per-connection PRAGMAs)
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL") # Readers don't block the writer
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # Safe with WAL, no fsync per commit
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)) # Wait for locks instead of "database is locked"
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)) # Bytes
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024)) # Page cache per connection
+    # Postgres / other pooled backends
+    DATABASE_MAX_OVERFLOW: int = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+    DATABASE_POOL_PRE_PING: bool = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+    DATABASE_POOL_RECYCLE_SECONDS: int = int(os.getenv("DATABASE_POOL_RECYCLE_SECONDS", 1800))
+    DATABASE_STATEMENT_CACHE_SIZE: int = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", 500)) # SQLAlchemy + asyncpg prepared statements
     
     class Config:
         # If your .env file is named something else or you want to specify its path explicitly
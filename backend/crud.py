@@ -1,19 +1,27 @@
 # backend/crud.py
-from sqlalchemy.orm import Session
+from sqlalchemy import tuple_, update, delete, and_, or_, select, func
+from sqlalchemy.orm import Session, selectinload
 from . import models, schemas # schemas might need updates
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple, Iterable
+from datetime import datetime
 
 # --- Prompt CRUD ---
 def get_prompt_by_text(db: Session, text: str) -> Optional[models.Prompt]:
     return db.query(models.Prompt).filter(models.Prompt.text == text).first()
 
-def create_prompt(db: Session, text: str) -> models.Prompt:
-    db_prompt = models.Prompt(text=text)
+def create_prompt(db: Session, text: str, normalized_text: Optional[str] = None) -> models.Prompt:
+    db_prompt = models.Prompt(text=text, normalized_text=normalized_text)
     db.add(db_prompt)
     db.commit()
     db.refresh(db_prompt)
     return db_prompt
 
+def get_or_create_prompt(db: Session, text: str, normalized_text: Optional[str] = None) -> models.Prompt:
+    db_prompt = get_prompt_by_text(db, text)
+    if db_prompt:
+        return db_prompt
+    return create_prompt(db, text, normalized_text)
+
 # --- Song CRUD ---
 def get_song_by_title_artist(db: Session, title: str, artist: str) -> Optional[models.Song]:
     return db.query(models.Song).filter(models.Song.title == title, models.Song.artist == artist).first()
@@ -31,6 +39,24 @@ def get_or_create_song(db: Session, title: str, artist: str) -> models.Song:
         return db_song
     return create_song(db, title, artist)
 
+def set_song_spotify_id(db: Session, song: models.Song, spotify_id: str, checked_at: datetime, retry_after: datetime):
+    # spotify_id is unique: two spellings of the same song can resolve to one track, first one keeps it
+    owner = db.query(models.Song).filter(models.Song.spotify_id == spotify_id, models.Song.id != song.id).first()
+    if owner:
+        # Recorded like a miss, so the duplicate isn't searched again on every request
+        print(f"Spotify ID {spotify_id} already stored for song #{owner.id}, not saving it for #{song.id}")
+        record_spotify_miss(db, song, checked_at=checked_at, retry_after=retry_after)
+        return
+    song.spotify_id = spotify_id
+    song.spotify_checked_at = checked_at
+    song.spotify_retry_after = None
+    db.flush() # So the uniqueness check above sees IDs set earlier in the same transaction
+
+def record_spotify_miss(db: Session, song: models.Song, checked_at: datetime, retry_after: datetime):
+    song.spotify_id = None
+    song.spotify_checked_at = checked_at
+    song.spotify_retry_after = retry_after
+
 # --- Tag CRUD ---
 def get_tag_by_name(db: Session, name: str) -> Optional[models.Tag]:
     return db.query(models.Tag).filter(models.Tag.name == name).first()
@@ -70,10 +96,311 @@ def link_prompt_to_song(db: Session, prompt: models.Prompt, song: models.Song, s
 
 # If using an association object for prompt_song_recommendation to store 'source'
 from .models import prompt_song_recommendation # The table object
-def link_prompt_to_song_with_source(db: Session, prompt_id: int, song_id: int, source: str = "openai"):
+def link_prompt_to_song_with_source(db: Session, prompt_id: int, song_id: int, source: str = "openai", position: Optional[int] = None):
     # Check if exists
     existing_link = db.query(prompt_song_recommendation).filter_by(prompt_id=prompt_id, song_id=song_id).first()
     if not existing_link:
-        stmt = prompt_song_recommendation.insert().values(prompt_id=prompt_id, song_id=song_id, source=source)
+        stmt = prompt_song_recommendation.insert().values(prompt_id=prompt_id, song_id=song_id, source=source, position=position)
         db.execute(stmt)
-        db.commit()
\ No newline at end of file
+        db.commit()
+
+def clear_prompt_recommendations(db: Session, prompt_id: int):
+    """Removes the stored recommendations of a prompt, e.g. before saving a fresh OpenAI answer."""
+    db.execute(prompt_song_recommendation.delete().where(prompt_song_recommendation.c.prompt_id == prompt_id))
+    db.commit()
+
+def get_recommended_songs_for_prompt(db: Session, prompt_id: int, sources: List[str]) -> List[models.Song]:
+    """Songs stored for a prompt from one of `sources`, in their original order."""
+    psr = prompt_song_recommendation
+    return (
+        db.query(models.Song)
+        .join(psr, psr.c.song_id == models.Song.id)
+        .filter(psr.c.prompt_id == prompt_id, psr.c.source.in_(sources))
+        .order_by(psr.c.position, models.Song.id)
+        .all()
+    )
+
+def get_latest_recommendations_for_normalized_prompt(
+    db: Session, normalized_text: str, since: datetime, sources: List[str]
+) -> List[models.Song]:
+    """
+    Returns the songs of the most recent recommendation (newer than `since`, from one of `sources`)
+    stored for any prompt with this normalized text, in their original order.
+    """
+    psr = prompt_song_recommendation
+    latest = (
+        db.query(psr.c.prompt_id)
+        .join(models.Prompt, models.Prompt.id == psr.c.prompt_id)
+        .filter(
+            models.Prompt.normalized_text == normalized_text,
+            psr.c.source.in_(sources),
+            psr.c.recommended_at >= since,
+        )
+        .order_by(psr.c.recommended_at.desc())
+        .first()
+    )
+    if not latest:
+        return []
+    return get_recommended_songs_for_prompt(db, latest.prompt_id, sources)
+
+def get_recent_recommendations_for_prompt(
+    db: Session, prompt_id: int, since: datetime, sources: List[str]
+) -> List[models.Song]:
+    """Like get_recommended_songs_for_prompt, but only if the recommendation is newer than `since`."""
+    psr = prompt_song_recommendation
+    recent = (
+        db.query(psr.c.prompt_id)
+        .filter(psr.c.prompt_id == prompt_id, psr.c.source.in_(sources), psr.c.recommended_at >= since)
+        .first()
+    )
+    if not recent:
+        return []
+    return get_recommended_songs_for_prompt(db, prompt_id, sources)
+
+def get_prompts_after_id(db: Session, after_id: int, limit: int = 500) -> List[models.Prompt]:
+    """Pages through prompts by id, used to (re)build the prompt embedding index."""
+    return db.query(models.Prompt).filter(models.Prompt.id > after_id).order_by(models.Prompt.id).limit(limit).all()
+
+
+# --- Bulk CRUD ---
+# Set-based versions of the functions above for the playlist hot path: a handful of
+# INSERT ... ON CONFLICT DO NOTHING statements instead of one SELECT/INSERT/commit per row.
+# They do NOT commit; the caller commits once per batch.
+
+def _insert_ignore(db: Session, table, index_elements: List[str], rows: List[Dict]):
+    """Inserts the `rows` (dicts) whose `index_elements` key is not in `table` yet."""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        _insert_missing(db, table, index_elements, rows)
+        return
+    db.execute(insert(table).on_conflict_do_nothing(index_elements=index_elements), rows)
+
+def _insert_missing(db: Session, table, index_elements: List[str], rows: List[Dict], chunk_size: int = 500):
+    """
+    Portable fallback of _insert_ignore for dialects without ON CONFLICT DO NOTHING: looks the
+    keys up first, then inserts the rest. Not atomic, a concurrent insert of the same key can
+    still raise IntegrityError.
+    """
+    columns = [table.c[name] for name in index_elements]
+    def key(row):
+        return tuple(row[name] for name in index_elements)
+    existing = set()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        condition = or_(*(and_(*(column == value for column, value in zip(columns, key(row)))) for row in chunk))
+        existing.update(tuple(found) for found in db.execute(select(*columns).where(condition)))
+    new_rows = {}
+    for row in rows:
+        if key(row) not in existing:
+            new_rows.setdefault(key(row), row)
+    if new_rows:
+        db.execute(table.insert(), list(new_rows.values()))
+
+def upsert_songs(db: Session, songs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """Inserts the (title, artist) pairs that don't exist yet. Returns {(title, artist): song_id} for all of them."""
+    pairs = list(dict.fromkeys(songs)) # Dedupe, keep order
+    if not pairs:
+        return {}
+    _insert_ignore(db, models.Song.__table__, ["title", "artist"], [{"title": title, "artist": artist} for title, artist in pairs])
+    rows = db.query(models.Song.id, models.Song.title, models.Song.artist).filter(
+        tuple_(models.Song.title, models.Song.artist).in_(pairs)
+    ).all()
+    return {(row.title, row.artist): row.id for row in rows}
+
+def upsert_tags(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    """Inserts missing tags (names normalized like add_tags_to_song). Returns {name: tag_id}."""
+    names = list(dict.fromkeys(name.lower().strip() for name in names if name and name.strip()))
+    if not names:
+        return {}
+    _insert_ignore(db, models.Tag.__table__, ["name"], [{"name": name} for name in names])
+    rows = db.query(models.Tag.id, models.Tag.name).filter(models.Tag.name.in_(names)).all()
+    return {row.name: row.id for row in rows}
+
+def link_songs_to_tags(db: Session, song_tag_ids: Iterable[Tuple[int, int]]):
+    rows = [{"song_id": song_id, "tag_id": tag_id} for song_id, tag_id in dict.fromkeys(song_tag_ids)]
+    _insert_ignore(db, models.song_tag_association, ["song_id", "tag_id"], rows)
+
+def link_prompt_to_songs(db: Session, prompt_id: int, song_ids: List[int], source: str = "openai", start_position: int = 0):
+    """
+    Links songs to a prompt in order (position = start_position + index in song_ids);
+    existing links are kept as they are.
+    """
+    rows = [
+        {"prompt_id": prompt_id, "song_id": song_id, "source": source, "position": position}
+        for position, song_id in enumerate(song_ids, start=start_position)
+    ]
+    _insert_ignore(db, prompt_song_recommendation, ["prompt_id", "song_id"], rows)
+
+def save_tags_for_songs(db: Session, tags_by_song_id: Dict[int, List[str]], fetched_at: datetime):
+    """
+    Stores Last.fm tags for many songs, replacing the tags they had, and marks them as
+    fetched at `fetched_at` (songs with an empty list record a "no tags" result).
+    """
+    if not tags_by_song_id:
+        return
+    # A refetch replaces the song's tags: Last.fm may have dropped some, or all of them
+    db.execute(
+        delete(models.song_tag_association)
+        .where(models.song_tag_association.c.song_id.in_(list(tags_by_song_id)))
+    )
+    tag_ids = upsert_tags(db, (name for tags in tags_by_song_id.values() for name in tags))
+    link_songs_to_tags(db, (
+        (song_id, tag_ids[name.lower().strip()])
+        for song_id, tags in tags_by_song_id.items()
+        for name in tags if name.lower().strip() in tag_ids
+    ))
+    db.execute(
+        update(models.Song)
+        .where(models.Song.id.in_(list(tags_by_song_id)))
+        .values(tags_fetched_at=fetched_at)
+        .execution_options(synchronize_session=False)
+    )
+
+def save_recommendations(db: Session, prompt_id: int, songs: List[Tuple[str, str]], source: str,
+                         start_position: int = 0) -> List[models.Song]:
+    """
+    Upserts the recommended (title, artist) pairs, links them to the prompt in order and returns the Song rows.
+    start_position is used when the recommendations are saved in several calls (streaming).
+    """
+    song_ids_by_key = upsert_songs(db, songs)
+    song_ids = [song_ids_by_key[key] for key in songs]
+    link_prompt_to_songs(db, prompt_id=prompt_id, song_ids=song_ids, source=source, start_position=start_position)
+    db.commit()
+    return get_songs_by_ids(db, song_ids)
+
+def get_songs_by_ids(db: Session, song_ids: List[int]) -> List[models.Song]:
+    """Loads songs (with their tags, in one extra query) in the order of song_ids."""
+    songs = (
+        db.query(models.Song).options(selectinload(models.Song.tags))
+        .filter(models.Song.id.in_(song_ids))
+        .populate_existing() # Refresh rows already in the session, e.g. after a bulk tag write
+        .all()
+    )
+    by_id = {song.id: song for song in songs}
+    return [by_id[song_id] for song_id in song_ids if song_id in by_id]
+
+# --- Enrichment job CRUD ---
+def enqueue_enrichment_jobs(db: Session, song_ids: List[int], now: datetime):
+    """
+    Queues a tag lookup per song. Songs that already have a pending/running job are left
+    alone (dedupe by song); finished or failed jobs are re-queued. Does not commit.
+    """
+    song_ids = list(dict.fromkeys(song_ids))
+    if not song_ids:
+        return
+    _insert_ignore(db, models.EnrichmentJob.__table__, ["song_id"], [
+        {"song_id": song_id, "status": "pending", "attempts": 0, "run_after": now, "updated_at": now}
+        for song_id in song_ids
+    ])
+    db.execute(
+        update(models.EnrichmentJob)
+        .where(models.EnrichmentJob.song_id.in_(song_ids), models.EnrichmentJob.status.in_(["done", "failed"]))
+        .values(status="pending", attempts=0, last_error=None, run_after=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+def claim_enrichment_jobs(db: Session, limit: int, now: datetime, lease_expired_before: datetime) -> List[models.EnrichmentJob]:
+    """
+    Marks up to `limit` due jobs as running and returns them. Also takes over running jobs
+    whose lease expired (worker crashed). Each job is claimed with a conditional UPDATE,
+    so several processes can share the queue. Commits.
+    """
+    job = models.EnrichmentJob
+    due = or_(
+        and_(job.status == "pending", or_(job.run_after.is_(None), job.run_after <= now)),
+        and_(job.status == "running", job.updated_at < lease_expired_before),
+    )
+    candidates = db.query(job.id).filter(due).order_by(job.id).limit(limit).all()
+    claimed_ids = []
+    for candidate in candidates:
+        # Re-checking `due` makes the claim atomic: another worker may have taken the job meanwhile
+        result = db.execute(
+            update(job)
+            .where(job.id == candidate.id, due)
+            .values(status="running", attempts=job.attempts + 1, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed_ids.append(candidate.id)
+    db.commit()
+    if not claimed_ids:
+        return []
+    return db.query(job).filter(job.id.in_(claimed_ids)).populate_existing().all()
+
+def complete_enrichment_jobs(db: Session, job_ids: List[int], now: datetime):
+    if job_ids:
+        db.execute(
+            update(models.EnrichmentJob).where(models.EnrichmentJob.id.in_(job_ids))
+            .values(status="done", last_error=None, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+def fail_enrichment_job(db: Session, job_id: int, error: str, now: datetime, retry_after: Optional[datetime]):
+    """Re-queues the job for `retry_after`, or marks it failed when retry_after is None."""
+    db.execute(
+        update(models.EnrichmentJob).where(models.EnrichmentJob.id == job_id)
+        .values(status="pending" if retry_after else "failed", last_error=error, run_after=retry_after, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+def get_enrichment_job_for_song(db: Session, song_id: int) -> Optional[models.EnrichmentJob]:
+    return db.query(models.EnrichmentJob).filter(models.EnrichmentJob.song_id == song_id).first()
+
+def get_song_with_tags(db: Session, song_id: int) -> Optional[models.Song]:
+    return db.query(models.Song).options(selectinload(models.Song.tags)).filter(models.Song.id == song_id).first()
+
+
+# --- Local recommender ---
+def get_song_tag_pairs(db: Session) -> List[Tuple[int, str]]:
+    """(song_id, tag name) for every song-tag link, used to build the local recommender index."""
+    return (
+        db.query(models.song_tag_association.c.song_id, models.Tag.name)
+        .join(models.Tag, models.Tag.id == models.song_tag_association.c.tag_id)
+        .all()
+    )
+
+def get_tagged_songs(db: Session) -> List[Tuple[int, str, str]]:
+    """(id, title, artist) of every song that has at least one tag."""
+    tagged_ids = select(models.song_tag_association.c.song_id)
+    return db.query(models.Song.id, models.Song.title, models.Song.artist).filter(models.Song.id.in_(tagged_ids)).all()
+
+def get_enriched_songs_after_id(db: Session, after_id: int, limit: int = 500) -> List[models.Song]:
+    """Songs whose tags were fetched (with their tags), by id, for paging through the catalog."""
+    return (
+        db.query(models.Song).options(selectinload(models.Song.tags))
+        .filter(models.Song.id > after_id, models.Song.tags_fetched_at.isnot(None))
+        .order_by(models.Song.id).limit(limit).all()
+    )
+
+
+# --- Incremental tag model training ---
+def get_recommendation_song_counts(db: Session, after: datetime, until: datetime, sources: List[str]) -> List[Tuple[int, str, int]]:
+    """(prompt_id, prompt text, recommended songs) for prompts recommended from `sources` in (after, until]."""
+    psr = prompt_song_recommendation
+    return (
+        db.query(models.Prompt.id, models.Prompt.text, func.count(psr.c.song_id))
+        .join(psr, psr.c.prompt_id == models.Prompt.id)
+        .filter(psr.c.source.in_(sources), psr.c.recommended_at > after, psr.c.recommended_at <= until)
+        .group_by(models.Prompt.id, models.Prompt.text)
+        .order_by(models.Prompt.id)
+        .all()
+    )
+
+def get_recommendation_tag_counts(db: Session, after: datetime, until: datetime, sources: List[str]) -> List[Tuple[int, str, int]]:
+    """(prompt_id, tag name, recommended songs with that tag) for the same prompts as get_recommendation_song_counts."""
+    psr = prompt_song_recommendation
+    sta = models.song_tag_association
+    return (
+        db.query(psr.c.prompt_id, models.Tag.name, func.count(psr.c.song_id))
+        .join(sta, sta.c.song_id == psr.c.song_id)
+        .join(models.Tag, models.Tag.id == sta.c.tag_id)
+        .filter(psr.c.source.in_(sources), psr.c.recommended_at > after, psr.c.recommended_at <= until)
+        .group_by(psr.c.prompt_id, models.Tag.name)
+        .all()
+    )
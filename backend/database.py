@@ -1,17 +1,88 @@
-from sqlalchemy import create_engine
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Dict, Union
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from .config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    # connect_args are only needed for SQLite for single-threaded access in FastAPI
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+# What request-path code receives from get_session and hands to run_db
+DBSession = Union[Session, "AsyncSession"]
+
+def get_engine_kwargs(url: str, profile: str = settings.DATABASE_PROFILE, is_async: bool = False) -> Dict[str, Any]:
+    """create_engine/create_async_engine arguments for a DATABASE_URL and engine profile."""
+    kwargs: Dict[str, Any] = {}
+    if "sqlite" in url:
+        if not is_async:
+            # connect_args are only needed for SQLite for single-threaded access in FastAPI
+            kwargs["connect_args"] = {"check_same_thread": False}
+        return kwargs
+    if profile != "production":
+        return kwargs
+    kwargs.update(
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE_SECONDS,
+        query_cache_size=settings.DATABASE_STATEMENT_CACHE_SIZE,
+    )
+    if "asyncpg" in url:
+        kwargs["connect_args"] = {"prepared_statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE}
+    return kwargs
+
+def apply_sqlite_pragmas(engine, profile: str = settings.DATABASE_PROFILE):
+    """Sets the SQLite PRAGMAs of the profile on every new connection (WAL, synchronous, busy timeout, mmap, cache)."""
+    if profile != "production":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_KB)}") # Negative = KiB
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+def create_db_engine(url: str = settings.DATABASE_URL, profile: str = settings.DATABASE_PROFILE):
+    db_engine = create_engine(url, **get_engine_kwargs(url, profile))
+    if "sqlite" in url:
+        apply_sqlite_pragmas(db_engine, profile)
+    return db_engine
+
+engine = create_db_engine()
+# expire_on_commit=False: objects stay readable after commit without a lazy refresh query
+# (which would run on the event loop thread, or fail outright under an AsyncSession)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
 Base = declarative_base()
 
+def get_async_database_url(url: str) -> str:
+    """Maps a sync DATABASE_URL to its async driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url # Already has an explicit async driver
+
+# Async engine/session, only created when DATABASE_ASYNC is enabled (needs aiosqlite or asyncpg)
+async_engine = None
+AsyncSessionLocal = None
+if settings.DATABASE_ASYNC:
+    # Imported here so the sync setup doesn't need greenlet / the async drivers
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    async_database_url = get_async_database_url(settings.DATABASE_URL)
+    async_engine = create_async_engine(async_database_url, **get_engine_kwargs(async_database_url, is_async=True))
+    if "sqlite" in async_database_url:
+        apply_sqlite_pragmas(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -19,7 +90,119 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# FastAPI dependency for endpoints that go through run_db: an AsyncSession if DATABASE_ASYNC is set
+get_session = get_async_db if settings.DATABASE_ASYNC else get_db
+
+@asynccontextmanager
+async def session_scope():
+    """
+    Same session type as get_session, for work that outlives the dependency scope:
+    FastAPI closes yield dependencies before a StreamingResponse body is sent.
+    """
+    if settings.DATABASE_ASYNC:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+async def run_db(db: DBSession, fn, *args, commit: bool = False, **kwargs):
+    """
+    Runs a synchronous crud-style function `fn(session, *args, **kwargs)` without blocking
+    the event loop, optionally committing afterwards.
+    With an AsyncSession it runs through run_sync on the async driver; with a plain Session
+    it runs in a worker thread. Either way the crud functions stay plain sync code.
+    Calls on the same session are serialized, so concurrent tasks can share one session.
+    A cancelled call still waits for its database work to finish before re-raising.
+    """
+    def _call(session):
+        result = fn(session, *args, **kwargs)
+        if commit:
+            session.commit()
+        return result
+
+    lock = db.info.get("run_db_lock")
+    if lock is None:
+        lock = db.info["run_db_lock"] = asyncio.Lock()
+    async with lock:
+        if hasattr(db, "run_sync"): # AsyncSession
+            call = asyncio.ensure_future(db.run_sync(_call))
+        else:
+            call = asyncio.ensure_future(asyncio.to_thread(_call, db))
+        try:
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            # The worker thread can't be interrupted: keep the lock, and so everyone else
+            # (including the session's close) off the session, until it has finished
+            while not call.done():
+                try:
+                    await asyncio.wait([call])
+                except asyncio.CancelledError:
+                    pass
+            if not call.cancelled():
+                call.exception() # Reported to nobody, the caller is gone
+            raise
+
+# Columns added to tables that already existed in released databases: create_all only
+# creates missing tables, so add_missing_columns adds these to older databases
+ADDED_COLUMNS = {
+    "prompts": ["normalized_text"],
+    "prompt_song_recommendation": ["position"],
+    "songs": ["spotify_checked_at", "spotify_retry_after", "tags_fetched_at"],
+}
+
+def add_missing_columns(db_engine=engine):
+    """
+    Idempotent schema upgrade: ALTER TABLE ... ADD COLUMN for every column in ADDED_COLUMNS
+    missing from an existing table, plus the indexes on those columns.
+    """
+    from . import models # Registers the tables on Base
+    existing_tables = set(inspect(db_engine).get_table_names())
+    for table_name, column_names in ADDED_COLUMNS.items():
+        if table_name not in existing_tables:
+            continue # create_all creates it with every column
+        table = Base.metadata.tables[table_name]
+        for name in column_names:
+            if name in {column["name"] for column in inspect(db_engine).get_columns(table_name)}:
+                continue
+            column = table.c[name]
+            column_type = column.type.compile(dialect=db_engine.dialect)
+            try:
+                with db_engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                print(f"Database: added column {table_name}.{name}")
+            except Exception:
+                # Another process may have added it meanwhile
+                if name not in {column["name"] for column in inspect(db_engine).get_columns(table_name)}:
+                    raise
+        for index in table.indexes:
+            if any(column.name in column_names for column in index.columns):
+                index.create(bind=db_engine, checkfirst=True)
+
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
 def create_db_and_tables():
-    # This is a simple way to create tables. For production, use Alembic migrations.
-    Base.metadata.create_all(bind=engine)
-    print("Database tables created (if they didn't exist).")
\ No newline at end of file
+    """Creates missing tables and columns once per process; later calls return immediately (thread-safe)."""
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _db_init_lock:
+        if _db_initialized:
+            return
+        from . import models # Registers the tables on Base
+        # This is a simple way to create tables. For production, use Alembic migrations.
+        Base.metadata.create_all(bind=engine)
+        add_missing_columns(engine)
+        _db_initialized = True
+        print("Database tables created (if they didn't exist).")
+
+def is_db_initialized() -> bool:
+    return _db_initialized
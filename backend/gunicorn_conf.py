@@ -0,0 +1,39 @@
+# backend/gunicorn_conf.py
+"""
+gunicorn settings for running several API workers:
+
+    gunicorn -c backend/gunicorn_conf.py backend.main:app
+
+With PRELOAD_MODELS=true (default) the app is imported once in the master, which also
+loads the tag model and read-only indexes (see services/warmup.preload_for_fork), and
+workers are forked from it: their copies of those pages stay shared (copy-on-write) until
+written, instead of every worker loading its own. benchmarks/worker_memory.py measures
+the difference. Jobs that should run once per deployment (index backfills, the
+enrichment queue workers) run in whichever worker holds the leader lock (services/leader.py).
+"""
+import os
+
+from backend.config import settings
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.PRELOAD_MODELS
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before the first worker is forked
+    if preload_app:
+        from backend.services.warmup import preload_for_fork
+        preload_for_fork()
+
+
+def post_fork(server, worker):
+    # N workers each using every core for torch would oversubscribe the CPU
+    import sys
+    threads = max(1, (os.cpu_count() or 1) // server.cfg.workers)
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads)) # torch not imported yet (no preload)
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
@@ -1,30 +1,39 @@
 # backend/main.py
 import json
-from venv import create
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import RedirectResponse
+import asyncio
+from typing import List, Literal
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orms import Session
+from sqlalchemy.orm import Session
 
 from . import crud, models, schemas
-from .database import SessionLocal, engine, create_db_and_tables, get_db
+from .database import SessionLocal, engine, get_db, get_session, run_db, DBSession
 
 from .schemas import PromptRequest, PlaylistResponse, SpotifyAuthData
 from .config import settings
 
-from .services.openai_service import get_song_recommendations_from_openai
-from .services.openai_service import extract_music_tags_from_prompt
-from .services.lastfm_service import get_tags_for_track
+from .services.tag_cache import tag_cache, utcnow
+from .services.enrichment_worker import enrichment_worker
+from .services.prompt_cache import normalize_prompt
+from .services.recommendation_service import get_stored_recommendations, get_fresh_recommendations, accept_song
+from .services.tag_recommender import tag_recommender
+from .services.playlist_stream import stream_playlist_events, format_event, STREAM_FORMATS
+from .services.spotify_id_cache import build_spotify_tracks, save_spotify_lookups
+from .services.semantic_cache import backfill_prompt_index
+from .services.song_index import backfill_song_index, find_similar_songs, song_indexer
+from .services.warmup import readiness, init_database, warm_up
+from .services.model_reloader import run_model_reload_loop
+from .services.leader import leader_lock
 
 from .services.spotify_service import (
     create_spotify_playlist_from_tracks,
     get_spotify_auth_url,
     handle_spotify_callback_and_get_token,
+    spotify_client_pool,
     SpotifyOAuthError
 )
 
-create_db_and_tables()  # Ensure database and tables are created at startup
-
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title=settings.APP_NAME,
@@ -47,6 +56,60 @@ app.add_middleware(
     allow_headers=["*"],    # Allows all headers
 )
 
+# --- Startup ---
+@app.on_event("startup")
+async def start_background_tasks():
+    # Tables first (fast, and everything below needs them); nothing heavy runs at import time
+    await init_database()
+
+    # Tag model, Last.fm client...: loaded lazily on first use, or here in the background
+    if settings.WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(warm_up())
+
+    # Jobs that must run once per deployment, not once per gunicorn worker: one worker
+    # holds the leader lock and runs them, another takes over if it exits
+    def _start_single_instance_jobs():
+        # Embed prompts (and songs) stored before their indexes existed, without delaying startup
+        def _backfill():
+            db = SessionLocal()
+            try:
+                backfill_prompt_index(db)
+            except Exception as e:
+                print(f"Could not backfill prompt index: {e}")
+            try:
+                if settings.SONG_INDEX_ENABLED:
+                    backfill_song_index(db)
+            except Exception as e:
+                print(f"Could not backfill song index: {e}")
+            finally:
+                db.close()
+        asyncio.get_running_loop().run_in_executor(None, _backfill)
+
+        # Last.fm tag enrichment runs after the playlist response (see /songs/{song_id}/tags)
+        enrichment_worker.start()
+    app.state.leader_task = asyncio.create_task(leader_lock.run_when_leader(_start_single_instance_jobs))
+
+    # New songs are embedded as their tags arrive (in the worker that stored them)
+    song_indexer.start()
+
+    # Per-process state from here on: every worker refreshes its own copy
+    # Keep pooled Spotify tokens fresh so playlist requests never wait on a refresh
+    app.state.spotify_token_refresh_task = asyncio.create_task(spotify_client_pool.run_refresh_loop())
+
+    # Local recommender index (tag -> songs), rebuilt periodically to pick up new tags
+    app.state.tag_recommender_task = asyncio.create_task(
+        tag_recommender.run_refresh_loop(SessionLocal, settings.LOCAL_RECOMMENDER_REFRESH_SECONDS)
+    )
+
+    # Newly published/rolled back tag models are swapped in without a restart
+    if settings.MODEL_RELOAD_SECONDS > 0:
+        app.state.model_reload_task = asyncio.create_task(run_model_reload_loop(settings.MODEL_RELOAD_SECONDS))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await enrichment_worker.stop()
+    await song_indexer.stop()
+
 # todo:
 # --- Spotify Authentication Endpoints (Simplified for Dev) ---
 # In a real app, you'd store tokens securely (e.g., in a database linked to users or secure session)
@@ -91,70 +154,74 @@ async def spotify_callback(code: str, request: Request): # FastAPI automatically
 @app.post(f"{settings.API_V1_STR}/generate-playlist", response_model=schemas.PlaylistResponse, tags=["Playlist Generation"])
 async def generate_playlist_endpoint(
     prompt_request: PromptRequest,
-    db: Session = Depends(get_db)
+    db: DBSession = Depends(get_session)
 ):
+    # All DB work goes through run_db, so it never blocks the event loop (see database.py)
     print(f"Received prompt: {prompt_request.prompt}")
-    db_prompt = crud.create_prompt(db, prompt_request.prompt)
-    if not db_prompt:
-        db_prompt = crud.get_prompt_by_text(db, prompt_request.prompt)
+    db_prompt = await run_db(db, crud.get_or_create_prompt, prompt_request.prompt, normalize_prompt(prompt_request.prompt))
 
-    try:
-        openai_recommended_song = await get_song_recommendations_from_openai(
-            prompt_request.prompt,
-            max_songs=settings.SPOTIFY_PLAYLIST_MAX_TRACKS + 5)
-        if not openai_recommended_song:
-            raise HTTPException(status_code=404, detail="OpenAI could not recommend any songs for this prompt.")
-    except ValueError as ve:
-        raise HTTPException(status_code=503, detail=f"OpenAI error: {str(ve)}")
-    except Exception as e:
-        print(f"Error calling OpenAI service: {e}")
-        raise HTTPException(status_code=503, detail=f"AI service unavailable or failed: {str(e)}")
+    # Cached answers for the same or a paraphrased prompt skip OpenAI (see recommendation_service)
+    openai_recommended_song, recommendation_source = await get_stored_recommendations(
+        db, db_prompt, force_refresh=prompt_request.force_refresh
+    )
+
+    if not openai_recommended_song:
+        try:
+            openai_recommended_song, recommendation_source = await get_fresh_recommendations(
+                prompt_request.prompt,
+                engine=prompt_request.engine,
+                max_songs=settings.SPOTIFY_PLAYLIST_MAX_TRACKS + 5)
+            if not openai_recommended_song:
+                raise HTTPException(status_code=404, detail="OpenAI could not recommend any songs for this prompt.")
+        except ValueError as ve:
+            raise HTTPException(status_code=503, detail=f"OpenAI error: {str(ve)}")
+        except Exception as e:
+            print(f"Error calling OpenAI service: {e}")
+            raise HTTPException(status_code=503, detail=f"AI service unavailable or failed: {str(e)}")
+        # A fresh answer replaces whatever was stored for this prompt before
+        await run_db(db, crud.clear_prompt_recommendations, db_prompt.id)
     
     print(f"OpenAI recommended the following Songs: {openai_recommended_song}")
 
-    final_list_for_spotify = []
     song_details_for_fe = []
 
     processed_song_identifiers = set() # set for avoiding duplicates
+    unique_songs = [] # (title, artist) pairs, deduplicated and capped to the playlist size
 
     for song in openai_recommended_song:
-        title = song.get("title")
-        artist = song.get("artist")
-        if not title or not artist:
-            print(f"Skipping song with missing title/artist: {song}")
-            continue
-        
-        # Check for duplicates based on title and artist
-        identifier = f"{title.lower()} - {artist.lower()}"
-        if identifier in processed_song_identifiers:
-            print(f"Skipping duplicate song: {title} by {artist}")
+        pair = accept_song(song, processed_song_identifiers)
+        if pair is None:
             continue
-        
-        processed_song_identifiers.add(identifier)
-        db_song = crud.get_or_create_song(db, title=title, artist=artist)
-        crud.link_prompt_to_song_with_source(db, prompt_id=db_prompt.id, song_id=db_song.id, source="openai")
-
-        # get tags for each song using Last.fm
-        await asyncio.sleep(0.1)  # Small delay to avoid rate limiting
-        lfm_tags = await get_tags_for_track(title, artist)
-        if lfm_tags:
-            crud.add_tags_to_song(db, db_song, lfm_tags)
-            print(f"Added tags {lfm_tags} to song {title} by {artist}")
-        else:
-            print(f"No tags found for {title} by {artist}, skipping.")
-        
-        final_list_for_spotify.append({
-            "title": title,
-            "artist": artist,
-        })
+        unique_songs.append(pair)
+
+        if len(unique_songs) >= settings.SPOTIFY_PLAYLIST_MAX_TRACKS:
+            break
+
+    # Create the songs and link them to the prompt with a few set-based statements and one commit
+    db_songs = await run_db(db, crud.save_recommendations, db_prompt.id, unique_songs, recommendation_source)
+
+    # Tags don't affect the playlist: fresh ones come from the DB/LRU cache, the rest are
+    # fetched by the background enrichment worker after we respond
+    if settings.ENRICHMENT_IN_BACKGROUND:
+        tags_per_song = [tag_cache.get_cached_tags(song) for song in db_songs]
+        pending_song_ids = [song.id for song, tags in zip(db_songs, tags_per_song) if tags is None]
+        if pending_song_ids:
+            await run_db(db, crud.enqueue_enrichment_jobs, pending_song_ids, utcnow(), commit=True)
+            enrichment_worker.notify()
+    else:
+        tags_per_song = await tag_cache.get_tags_for_songs(db, db_songs)
+
+    for db_song, lfm_tags in zip(db_songs, tags_per_song):
         song_details_for_fe.append({
-            "title": title,
-            "artist": artist,
-            "tags": lfm_tags  # Include tags for the song
+            "id": db_song.id,
+            "title": db_song.title,
+            "artist": db_song.artist,
+            "tags": lfm_tags or [],  # Include tags for the song
+            "tags_status": "pending" if lfm_tags is None else "ready",
         })
 
-        if len(final_list_for_spotify) >= settings.SPOTIFY_PLAYLIST_MAX_TRACKS:
-            break
+    # Songs resolved before carry their stored Spotify ID, so they skip the search
+    final_list_for_spotify = build_spotify_tracks(db_songs)
         
     if not final_list_for_spotify:
         raise HTTPException(status_code=404, detail="No valid songs processed for playlist creation.")
@@ -162,7 +229,7 @@ async def generate_playlist_endpoint(
     # Creating the Spotify Playlist
     try:
         playlist_url = await create_spotify_playlist_from_tracks(
-            tracks_info=final_list_for_spotify, 
+            tracks=final_list_for_spotify,
             playlist_name=f"MoodTunes: {prompt_request.prompt[:30]}..."
             # access_token would be passed here in a multi-user app from their session
         )
@@ -182,11 +249,88 @@ async def generate_playlist_endpoint(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to create Spotify playlist: {str(e)}")
+    finally:
+        # Keep resolved IDs and misses even if playlist creation failed afterwards
+        await run_db(db, save_spotify_lookups, db_songs, final_list_for_spotify)
+
+# --- Streaming Playlist Generation Endpoint ---
+@app.post(f"{settings.API_V1_STR}/generate-playlist/stream", tags=["Playlist Generation"])
+async def generate_playlist_stream_endpoint(
+    prompt_request: PromptRequest,
+    stream_format: Literal["ndjson", "sse"] = Query("ndjson", alias="format"),
+):
+    """
+    Same pipeline as /generate-playlist, streamed as NDJSON lines or Server-Sent Events:
+    each song as soon as it is saved, then its tags and Spotify ID as they resolve,
+    and the playlist URL (or an error) last. See playlist_stream.stream_playlist_events.
+    """
+    print(f"Received prompt (streaming): {prompt_request.prompt}")
+
+    async def body():
+        async for event, data in stream_playlist_events(prompt_request.prompt, prompt_request.force_refresh, prompt_request.engine):
+            yield format_event(event, data, stream_format)
+
+    return StreamingResponse(
+        body(),
+        media_type=STREAM_FORMATS[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Don't let proxies buffer the stream
+    )
+
+# --- Song Tags Endpoint ---
+@app.get(f"{settings.API_V1_STR}/songs/{{song_id}}/tags", response_model=schemas.SongTagsResponse, tags=["Songs"])
+async def get_song_tags_endpoint(song_id: int, db: DBSession = Depends(get_session)):
+    """
+    Tags of a song and the status of its background enrichment job.
+    Poll this for songs returned with tags_status="pending".
+    """
+    song = await run_db(db, crud.get_song_with_tags, song_id)
+    if not song:
+        raise HTTPException(status_code=404, detail="Song not found.")
+    job = await run_db(db, crud.get_enrichment_job_for_song, song_id)
+    tags = [tag.name for tag in song.tags]
+    if job and job.status != "done":
+        status = job.status
+    elif song.tags_fetched_at is not None:
+        status = "ready"
+    else:
+        status = "pending"
+    return schemas.SongTagsResponse(
+        song_id=song.id,
+        title=song.title,
+        artist=song.artist,
+        status=status,
+        tags=tags,
+        attempts=job.attempts if job else 0,
+        last_error=job.last_error if job else None,
+    )
+
+# --- Similar Songs Endpoint ---
+@app.get(f"{settings.API_V1_STR}/songs/similar", response_model=List[schemas.SimilarSong], tags=["Songs"])
+async def similar_songs_endpoint(prompt: str, k: int = Query(10, ge=1, le=100), db: DBSession = Depends(get_session)):
+    """
+    Songs closest to the prompt in embedding space (title, artist and tags),
+    from the song index. Only songs whose tags were fetched are indexed.
+    """
+    if not settings.SONG_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Song index is disabled.")
+    results = await find_similar_songs(db, prompt, k)
+    return [
+        schemas.SimilarSong(id=song.id, title=song.title, artist=song.artist, tags=[tag.name for tag in song.tags], score=score)
+        for song, score in results
+    ]
 
 # --- Health Check Endpoint ---
 @app.get("/health", tags=["Utilities"])
 async def health_check():
     """
-    Simple health check endpoint.
+    Simple health check endpoint (liveness: the process is up and serving).
+    """
+    return {"status": "ok", "message": "MoodTunes API is running!"}
+
+@app.get("/ready", tags=["Utilities"])
+async def readiness_check():
+    """
+    Readiness probe: 200 once the database is initialized and the background warm-up
+    (tag model, API clients) has finished, 503 before that. Lists each component's state.
     """
-    return {"status": "ok", "message": "MoodTunes API is running!"}
\ No newline at end of file
+    return JSONResponse(readiness.report(), status_code=200 if readiness.is_ready else 503)
\ No newline at end of file
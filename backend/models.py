@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, UniqueConstraint, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -17,13 +17,16 @@ prompt_song_recommendation = Table(
     Column('prompt_id', Integer, ForeignKey('prompts.id'), primary_key=True),
     Column('song_id', Integer, ForeignKey('songs.id'), primary_key=True),
     Column('recommended_at', DateTime(timezone=True), server_default=func.now()),
-    Column('source', String, default="openai") # To track where recommendation came from
+    Column('source', String, default="openai"), # To track where recommendation came from
+    Column('position', Integer, nullable=True) # Order of the song in the recommendation list
 )
 
 class Prompt(Base):
     __tablename__ = "prompts"
     id = Column(Integer, primary_key=True, index=True)
     text = Column(String, unique=True, index=True, nullable=False)
+    # Lowercased, punctuation/whitespace-collapsed text used as the prompt cache key
+    normalized_text = Column(String, index=True, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationship to songs recommended for this prompt
@@ -40,6 +43,10 @@ class Song(Base):
     artist = Column(String, index=True, nullable=False)
     # Optional: Add spotify_id, lastfm_url etc.
     spotify_id = Column(String, unique=True, nullable=True)
+    spotify_checked_at = Column(DateTime(timezone=True), nullable=True) # Last search/validation of spotify_id
+    spotify_retry_after = Column(DateTime(timezone=True), nullable=True) # Set when search found nothing
+    # When Last.fm tags were last fetched (also set when Last.fm had no tags), NULL = never
+    tags_fetched_at = Column(DateTime(timezone=True), nullable=True)
 
     # Many-to-many relationship with Tag
     tags = relationship(
@@ -66,4 +73,23 @@ class Tag(Base):
         "Song",
         secondary=song_tag_association,
         back_populates="tags"
-    )
\ No newline at end of file
+    )
+
+
+class EnrichmentJob(Base):
+    """
+    Background Last.fm tag lookup for one song (at most one job per song).
+    status: pending -> running -> done, or back to pending with a later run_after on
+    failure until max attempts, then failed.
+    """
+    __tablename__ = "enrichment_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    song_id = Column(Integer, ForeignKey('songs.id'), unique=True, nullable=False)
+    status = Column(String, index=True, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime(timezone=True), nullable=True) # Not before this time (retry backoff)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now()) # Also the lease start while running
+
+    song = relationship("Song")
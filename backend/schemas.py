@@ -1,13 +1,17 @@
 from pydantic import BaseModel, HttpUrl
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 class PromptRequest(BaseModel):
     prompt: str
+    force_refresh: bool = False # Skip the prompt cache and ask OpenAI again
+    engine: Optional[Literal["openai", "local", "auto"]] = None # Defaults to settings.RECOMMENDER_ENGINE
 
 class SongDetail(BaseModel):
+    id: Optional[int] = None
     title: str
     artist: str
     tags: List[str] = [] # Tags associated with this song
+    tags_status: str = "ready" # "pending" while the background worker fetches them (see /songs/{id}/tags)
 
     class Config:
         from_attributes = True # For Pydantic v2, was orm_mode = True
@@ -17,6 +21,22 @@ class PlaylistResponse(BaseModel):
     message: str
     songs: List[SongDetail] = [] # Return the list of songs in the playlist
 
+class SongTagsResponse(BaseModel):
+    song_id: int
+    title: str
+    artist: str
+    status: str # "ready", "pending", "running" or "failed"
+    tags: List[str] = []
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+class SimilarSong(BaseModel):
+    id: int
+    title: str
+    artist: str
+    tags: List[str] = []
+    score: float # Cosine similarity between the prompt and the song embedding
+
 class SpotifyAuthData(BaseModel): # If you were to return token info to frontend
     access_token: str
     refresh_token: Optional[str] = None
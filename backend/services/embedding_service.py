@@ -0,0 +1,36 @@
+# backend/services/embedding_service.py
+import asyncio
+from typing import List
+
+import numpy as np
+
+def get_predictor():
+    """
+    Returns the TagPredictor from ai/tag_predictor.py, whose SBERT model (all-MiniLM-L6-v2)
+    and embedding cache are shared with the backend instead of keeping a second copy in
+    memory. Loaded on first use (thread-safe, see ai.tag_predictor.get_predictor).
+    """
+    from ai.tag_predictor import get_predictor as get_tag_predictor # Heavy import (torch), only when first needed
+    return get_tag_predictor()
+
+def get_sbert_model():
+    return get_predictor().sbert_model
+
+def encode_texts(texts: List[str], cache: bool = True) -> np.ndarray:
+    """
+    Encodes texts into L2-normalized float32 embeddings (len(texts) x dim).
+    With cache=True they go through the predictor's embedding cache, so a prompt that was
+    already embedded (for tag prediction, the semantic cache, ...) is not encoded again.
+    """
+    if cache:
+        embeddings = get_predictor().encode(texts)
+    else:
+        embeddings = get_sbert_model().encode(texts, batch_size=64, convert_to_numpy=True)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+async def encode_texts_async(texts: List[str], cache: bool = True) -> np.ndarray:
+    # Transformer inference is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(encode_texts, texts, cache)
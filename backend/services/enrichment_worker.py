@@ -0,0 +1,106 @@
+# backend/services/enrichment_worker.py
+import asyncio
+from datetime import timedelta
+from typing import List, Optional
+
+from .. import crud
+from ..config import settings
+from ..database import SessionLocal, run_db
+from .tag_cache import tag_cache, utcnow
+
+
+class EnrichmentWorker:
+    """
+    In-process workers for the enrichment_jobs queue: fetch Last.fm tags for queued songs
+    after the playlist response has been sent. The queue lives in the DB, so jobs survive
+    restarts and can be shared by several server processes (claims are atomic, and
+    running jobs whose lease expired are picked up again).
+    Failed lookups are retried with exponential backoff up to max_attempts.
+    """
+
+    def __init__(self, num_workers: int, batch_size: int, poll_seconds: float,
+                 max_attempts: int, retry_base_seconds: int, lease_seconds: int):
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Starts the worker tasks on the running event loop (call from app startup)."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(n)) for n in range(self.num_workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wakes the workers up right away instead of at the next poll (call after enqueueing)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self, worker_no: int):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                print(f"Enrichment worker {worker_no} error: {e}")
+                processed = 0
+            if processed:
+                continue # More work may be waiting
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_batch(self) -> int:
+        """Claims and processes one batch of due jobs. Returns how many jobs were claimed."""
+        db = SessionLocal()
+        try:
+            now = utcnow()
+            jobs = await run_db(
+                db, crud.claim_enrichment_jobs, self.batch_size, now,
+                lease_expired_before=now - timedelta(seconds=self.lease_seconds),
+            )
+            if not jobs:
+                return 0
+            songs = await run_db(db, crud.get_songs_by_ids, [job.song_id for job in jobs])
+            songs_by_id = {song.id: song for song in songs}
+            jobs = [job for job in jobs if job.song_id in songs_by_id]
+            # Goes through the tag cache: fresh songs are skipped, results are written to the DB
+            results = await tag_cache.fetch_tags_for_songs(db, [songs_by_id[job.song_id] for job in jobs])
+
+            def _finish(session):
+                finished_at = utcnow()
+                crud.complete_enrichment_jobs(session, [job.id for job, tags in zip(jobs, results) if tags is not None], finished_at)
+                for job, tags in zip(jobs, results):
+                    if tags is not None:
+                        continue
+                    retry_after = None
+                    if job.attempts < self.max_attempts:
+                        retry_after = finished_at + timedelta(seconds=self.retry_base_seconds * 2 ** (job.attempts - 1))
+                    crud.fail_enrichment_job(session, job.id, "Last.fm lookup failed", finished_at, retry_after)
+                session.commit()
+
+            await run_db(db, _finish)
+            print(f"Enrichment: processed {len(jobs)} jobs")
+            return len(jobs)
+        finally:
+            db.close()
+
+
+enrichment_worker = EnrichmentWorker(
+    num_workers=settings.ENRICHMENT_WORKERS,
+    batch_size=settings.ENRICHMENT_BATCH_SIZE,
+    poll_seconds=settings.ENRICHMENT_POLL_SECONDS,
+    max_attempts=settings.ENRICHMENT_MAX_ATTEMPTS,
+    retry_base_seconds=settings.ENRICHMENT_RETRY_BASE_SECONDS,
+    lease_seconds=settings.ENRICHMENT_LEASE_SECONDS,
+)
@@ -0,0 +1,130 @@
+# backend/services/incremental_training.py
+"""
+Incremental training of the tag model (ai/tag_predictor.py) from production data:
+every prompt answered by OpenAI is a (prompt -> tags) example, labelled with the
+Last.fm tags shared by its recommended songs. Only recommendations made since the last
+checkpoint are used, and the saved TagMLP is fine-tuned rather than retrained.
+
+Each run publishes a new version to the model registry, which the API workers load
+without a restart. Run from the repo root (e.g. nightly from cron):
+    python -m backend.services.incremental_training
+"""
+import argparse
+import csv
+import json
+import os
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..database import SessionLocal, create_db_and_tables
+from .prompt_cache import CACHEABLE_SOURCES
+from .tag_cache import utcnow
+
+# Local/cached answers are excluded: the local ones come from the model itself
+TRAINING_SOURCES = CACHEABLE_SOURCES
+
+
+def checkpoint_path() -> str:
+    from ai.tag_predictor import MODEL_DIR
+    return os.path.join(MODEL_DIR, "incremental_checkpoint.json")
+
+def load_checkpoint() -> Dict:
+    path = checkpoint_path()
+    if not os.path.exists(path):
+        return {"trained_until": datetime(1970, 1, 1).isoformat(), "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint: Dict):
+    path = checkpoint_path()
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def collect_training_pairs(db: Session, after: datetime, until: datetime, min_tag_share: float = 0.3,
+                           max_tags: int = 8, min_tagged_songs: int = 3) -> List[Tuple[str, List[str]]]:
+    """
+    (prompt, tags) pairs for prompts recommended in (after, until]. A prompt's labels are
+    the tags carried by at least `min_tag_share` of its songs (most common first, at most
+    `max_tags`); prompts whose songs have fewer than `min_tagged_songs` tag hits are skipped.
+    """
+    prompts = crud.get_recommendation_song_counts(db, after, until, TRAINING_SOURCES)
+    tag_counts: Dict[int, List[Tuple[str, int]]] = defaultdict(list)
+    for prompt_id, tag_name, count in crud.get_recommendation_tag_counts(db, after, until, TRAINING_SOURCES):
+        tag_counts[prompt_id].append((tag_name, count))
+
+    pairs = []
+    for prompt_id, text, song_count in prompts:
+        counts = sorted(tag_counts.get(prompt_id, []), key=lambda item: (-item[1], item[0]))
+        if not counts or counts[0][1] < min(min_tagged_songs, song_count):
+            continue
+        tags = [tag for tag, count in counts if count >= min_tag_share * song_count][:max_tags]
+        if tags:
+            pairs.append((text, tags))
+    return pairs
+
+def load_replay_pairs(data_path: str, limit: int) -> Tuple[List[str], List[List[str]]]:
+    """Up to `limit` random rows of the original training CSV, replayed so older tags aren't forgotten."""
+    if limit <= 0 or not os.path.exists(data_path):
+        return [], []
+    with open(data_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    rows = random.Random(42).sample(rows, min(limit, len(rows)))
+    prompts = [row.get("prompt_text") or row.get("prompt") or "" for row in rows]
+    tag_lists = [[tag.strip() for tag in row["tags"].split(",")] if row.get("tags") else [] for row in rows]
+    return prompts, tag_lists
+
+def run_incremental_training(settle_minutes: int = 60, min_pairs: int = 20, epochs: int = 5, lr: float = 5e-5,
+                             replay_data_path: str = os.path.join("ai", "data", "prompts_tags.csv"),
+                             replay_ratio: float = 1.0) -> Dict:
+    """
+    Fine-tunes the saved model on pairs recommended since the last checkpoint and moves the
+    checkpoint forward. Recommendations younger than `settle_minutes` are left for the next
+    run, so the background enrichment has had time to fetch their songs' tags.
+    """
+    from ai.tag_predictor import TagPredictor # Heavy import (torch), only when training
+
+    create_db_and_tables()
+    checkpoint = load_checkpoint()
+    after = datetime.fromisoformat(checkpoint["trained_until"])
+    until = utcnow() - timedelta(minutes=settle_minutes)
+    db = SessionLocal()
+    try:
+        pairs = collect_training_pairs(db, after, until)
+    finally:
+        db.close()
+    if len(pairs) < min_pairs:
+        print(f"Incremental training: {len(pairs)} new pairs since {after.isoformat()}, waiting for {min_pairs}")
+        return {"pairs": len(pairs), "trained": False}
+
+    predictor = TagPredictor(backend="torch")
+    replay_prompts, replay_tag_lists = load_replay_pairs(replay_data_path, int(len(pairs) * replay_ratio))
+    summary = predictor.train_incremental(
+        [prompt for prompt, _ in pairs], [tags for _, tags in pairs], epochs=epochs, lr=lr,
+        replay_prompts=replay_prompts, replay_tag_lists=replay_tag_lists,
+    )
+    summary["version"] = predictor.publish(metrics={"val_loss": summary["val_loss"], "pairs": summary["pairs"],
+                                                    "new_tags": len(summary["new_tags"])})
+    checkpoint["trained_until"] = until.isoformat()
+    checkpoint["runs"] = checkpoint.get("runs", [])[-49:] + [dict(summary, trained_until=until.isoformat(), finished_at=utcnow().isoformat())]
+    save_checkpoint(checkpoint)
+    print(f"Incremental training: {summary['pairs']} pairs, {len(summary['new_tags'])} new tags, "
+          f"val loss {summary['val_loss']:.4f}, checkpoint at {until.isoformat()}")
+    return dict(summary, trained=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settle-minutes", type=int, default=60, help="Skip recommendations younger than this")
+    parser.add_argument("--min-pairs", type=int, default=20, help="Don't train on fewer new pairs")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--replay-data", default=os.path.join("ai", "data", "prompts_tags.csv"))
+    parser.add_argument("--replay-ratio", type=float, default=1.0, help="Replayed CSV rows per new pair")
+    args = parser.parse_args()
+    run_incremental_training(args.settle_minutes, args.min_pairs, args.epochs, args.lr, args.replay_data, args.replay_ratio)
@@ -1,48 +1,81 @@
-import pylast
-from ..config import settings
-from typing import List, Dict, Any
-
-network = pylast.LastFMNetwork(
-    api_key=settings.LASTFM_API_KEY,
-    api_secret=settings.LASTFM_API_SECRET
-)
-
 # backend/services/lastfm_service.py
 import pylast
 from ..config import settings
-from typing import List, Optional, Dict, Any
+from .rate_limiter import AsyncRateLimiter
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
+import threading
 
-# ... (network initialization as before) ...
+_network: Optional[pylast.LastFMNetwork] = None
+_network_lock = threading.Lock()
 
-async def get_tags_for_track(title: str, artist: str) -> List[str]:
+def get_network() -> Optional[pylast.LastFMNetwork]:
+    """The shared Last.fm client, created on first use (thread-safe). None if it can't be created."""
+    global _network
+    if _network is None:
+        with _network_lock:
+            if _network is None:
+                try:
+                    _network = pylast.LastFMNetwork(
+                        api_key=settings.LASTFM_API_KEY,
+                        api_secret=settings.LASTFM_API_SECRET
+                    )
+                except Exception as e:
+                    print(f"Failed to initialize the Last.fm network: {e}")
+    return _network
+
+# One limiter for the whole process, so concurrent requests share the Last.fm quota
+# (each track lookup makes two API calls).
+lastfm_rate_limiter = AsyncRateLimiter(rate=settings.LASTFM_REQUESTS_PER_SECOND, burst=settings.LASTFM_MAX_CONCURRENCY)
+
+async def get_tags_for_track(title: str, artist: str) -> Optional[List[str]]:
     """
     Fetches top tags for a specific track from Last.fm.
+    Returns [] when the track is unknown or has no tags, and None when the lookup
+    itself failed (so callers can tell a real "no tags" apart from a transient error).
     """
+    network = get_network()
     if not network:
         print("Last.fm network not initialized.")
-        return []
+        return None
 
     try:
         # pylast methods are synchronous, run them in a thread
+        await lastfm_rate_limiter.acquire()
         track_obj = await asyncio.to_thread(network.get_track, artist, title)
         if not track_obj:
             print(f"Last.fm: Track '{title}' by '{artist}' not found.")
             return []
 
+        await lastfm_rate_limiter.acquire()
         top_tags_items = await asyncio.to_thread(track_obj.get_top_tags, limit=5) # Get top 5 tags
-        
+
         tags = [tag_item.item.name.lower() for tag_item in top_tags_items if hasattr(tag_item, 'item') and hasattr(tag_item.item, 'name')]
-        
+
         # print(f"Last.fm: Tags for '{title}' by '{artist}': {tags}")
         return tags
     except pylast.WSError as e:
         # Common errors: "Track not found" (code 6), "Artist not found"
         if e.status == '6': # Error 6 often means "not found"
             print(f"Last.fm: Track or artist not found for '{title}' by '{artist}'. Details: {e.details}")
-        else:
-            print(f"Last.fm API WSError for '{title}' by '{artist}': {e}")
-        return []
+            return []
+        print(f"Last.fm API WSError for '{title}' by '{artist}': {e}")
+        return None
     except Exception as e:
         print(f"Unexpected error fetching tags from Last.fm for '{title}' by '{artist}': {e}")
-        return []
+        return None
+
+async def get_tags_for_tracks(tracks: List[Tuple[str, str]], max_concurrency: Optional[int] = None) -> List[Optional[List[str]]]:
+    """
+    Fetches tags for many (title, artist) pairs concurrently.
+    At most `max_concurrency` lookups are in flight at once and all of them go through
+    the shared rate limiter. Returns one tag list per input track, in the same order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or settings.LASTFM_MAX_CONCURRENCY)
+
+    async def _fetch(title: str, artist: str) -> Optional[List[str]]:
+        async with semaphore:
+            return await get_tags_for_track(title, artist)
+
+    # get_tags_for_track never raises, it returns None on errors
+    return await asyncio.gather(*(_fetch(title, artist) for title, artist in tracks))
@@ -0,0 +1,46 @@
+# backend/services/leader.py
+import asyncio
+import fcntl
+import os
+from typing import Callable, Optional, TextIO
+
+from ..config import settings
+
+
+class LeaderLock:
+    """
+    Picks the one process, among the workers of a deployment, that runs the jobs meant to
+    run once (index backfills, the enrichment queue workers): whoever holds a non-blocking
+    flock on `path` is the leader until it exits, and then another worker takes over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[TextIO] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._file = f # Held (open) for the life of the process
+        return True
+
+    async def run_when_leader(self, start: Callable[[], None], retry_seconds: float = 30):
+        """Background task: calls `start` once this process is the leader, retrying every retry_seconds."""
+        while not self.try_acquire():
+            await asyncio.sleep(retry_seconds)
+        print(f"Leader: process {os.getpid()} runs the single-instance jobs")
+        start()
+
+
+leader_lock = LeaderLock(os.path.join(settings.INDEX_DIR, "leader.lock"))
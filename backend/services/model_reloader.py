@@ -0,0 +1,25 @@
+# backend/services/model_reloader.py
+import asyncio
+import sys
+
+
+async def run_model_reload_loop(interval_seconds: float):
+    """
+    Background task: when the model registry's active version changes (a new model was
+    published, activated or rolled back, see ai/manage_models.py), loads it in a thread
+    and swaps it into the running predictor. Requests keep being served by the old model
+    until the swap, so nothing is dropped and no restart is needed.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        tag_predictor = sys.modules.get("ai.tag_predictor")
+        if tag_predictor is None or not tag_predictor.is_predictor_loaded():
+            continue # Not loaded yet: it loads the active version on first use
+        predictor = tag_predictor.get_predictor()
+        try:
+            version = await asyncio.to_thread(predictor.registry.active_version)
+            if version and version != predictor.model_version:
+                print(f"Model reloader: switching from {predictor.model_version} to {version}")
+                await asyncio.to_thread(predictor.load_version, version)
+        except Exception as e:
+            print(f"Model reloader error: {e}")
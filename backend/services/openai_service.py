@@ -1,21 +1,28 @@
 # backend/services/openai_service.py
+import asyncio
 import openai
 from ..config import settings
-from typing import List, Optional
+from typing import AsyncIterator, List, Dict, Optional
 import re # For parsing
 
-# ... (OpenAI API key setup as before) ...
+OPENAI_MODEL = "gpt-3.5-turbo" # Or "gpt-4"
 
-async def get_song_recommendations_from_openai(prompt: str, max_songs: int = 10) -> Optional[List[Dict[str, str]]]:
-    """
-    Uses OpenAI's ChatCompletion to get song recommendations (title and artist)
-    based on a user prompt.
-    Returns a list of dicts: [{"title": "...", "artist": "..."}, ...]
-    """
+# Regex to capture title and artist, robust to "by" variations
+_SONG_LINE_RE = re.compile(r"^(.*?)\s+by\s+(.*?)$", re.IGNORECASE)
+
+_client: Optional[openai.AsyncOpenAI] = None
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    """Shared async client, so requests reuse its HTTP connection pool."""
+    global _client
     if not settings.OPENAI_API_KEY:
         raise ValueError("OpenAI API key is not configured.")
+    if _client is None:
+        _client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    return _client
 
-    system_prompt = f"""
+def build_system_prompt(max_songs: int) -> str:
+    return f"""
     You are an expert music curator for an application called MoodTunes.
     Given a user's text prompt describing a mood, vibe, or desired music, your task is to recommend a list of songs.
     Return a list of up to {max_songs} songs.
@@ -36,47 +43,128 @@ async def get_song_recommendations_from_openai(prompt: str, max_songs: int = 10)
     Skinny Love by Bon Iver
     """
 
+def _build_messages(prompt: str, max_songs: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": build_system_prompt(max_songs)},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_song_line(line: str) -> Optional[Dict[str, str]]:
+    """Parses one "Track Title by Artist Name" line. Returns None for empty or unparseable lines."""
+    line = line.strip()
+    if not line:
+        return None
+    match = _SONG_LINE_RE.match(line)
+    if not match:
+        print(f"OpenAI Service: Could not parse song line: '{line}'")
+        return None
+    # Basic cleaning for common AI artifacts like quotes
+    title = match.group(1).strip().replace('"', '')
+    artist = match.group(2).strip().replace('"', '')
+    if not title or not artist:
+        return None
+    return {"title": title, "artist": artist}
+
+
+class SongLineParser:
+    """
+    Incremental parser for a streamed completion: feed() it text deltas as they arrive
+    and it returns the songs of every line completed so far. The last line has no
+    trailing newline, so call flush() once the stream ends.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[Dict[str, str]]:
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split("\n")
+        return [song for song in map(parse_song_line, lines) if song]
+
+    def flush(self) -> List[Dict[str, str]]:
+        line, self._buffer = self._buffer, ""
+        song = parse_song_line(line)
+        return [song] if song else []
+
+
+async def get_song_recommendations_from_openai(prompt: str, max_songs: int = 10) -> Optional[List[Dict[str, str]]]:
+    """
+    Uses OpenAI's ChatCompletion to get song recommendations (title and artist)
+    based on a user prompt.
+    Returns a list of dicts: [{"title": "...", "artist": "..."}, ...]
+    """
+    client = get_openai_client()
     try:
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo", # Or "gpt-4"
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+        response = await client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=_build_messages(prompt, max_songs),
             temperature=0.5, # Slightly higher for more diverse recommendations
             max_tokens=300  # Adjust based on max_songs
         )
-        
-        content = response.choices[0].message.content.strip()
-        
+
+        content = (response.choices[0].message.content or "").strip()
+
         if not content:
             return []
 
         # Parse "Track Title by Artist Name" lines
-        recommended_songs = []
-        lines = content.split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            # Regex to capture title and artist, robust to "by" variations
-            match = re.match(r"^(.*?)\s+by\s+(.*?)$", line, re.IGNORECASE)
-            if match:
-                title = match.group(1).strip()
-                artist = match.group(2).strip()
-                # Basic cleaning for common AI artifacts like quotes
-                title = title.replace('"', '')
-                artist = artist.replace('"', '')
-                if title and artist:
-                    recommended_songs.append({"title": title, "artist": artist})
-            else:
-                print(f"OpenAI Service: Could not parse song line: '{line}'")
-        
+        recommended_songs = [song for song in map(parse_song_line, content.split('\n')) if song]
         return recommended_songs[:max_songs]
 
-    except openai.error.OpenAIError as e:
+    except openai.OpenAIError as e:
         print(f"OpenAI API error in get_song_recommendations_from_openai: {e}")
         return None
     except Exception as e:
         print(f"An unexpected error in get_song_recommendations_from_openai: {e}")
         return None
+
+
+async def stream_song_recommendations_from_openai(prompt: str, max_songs: int = 10) -> AsyncIterator[Dict[str, str]]:
+    """
+    Streaming mode of get_song_recommendations_from_openai: yields each song as soon as
+    its line is complete in the token stream, instead of after the whole completion.
+    Stops reading (and closes the stream) once max_songs songs were yielded.
+    Raises ValueError / openai.OpenAIError like the API does.
+    """
+    client = get_openai_client()
+    stream = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=_build_messages(prompt, max_songs),
+        temperature=0.5,
+        max_tokens=300,
+        stream=True,
+    )
+    parser = SongLineParser()
+    count = 0
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            for song in parser.feed(chunk.choices[0].delta.content or ""):
+                yield song
+                count += 1
+                if count >= max_songs:
+                    return
+        for song in parser.flush():
+            yield song
+    finally:
+        await stream.close()
+
+
+async def enqueue_song_recommendations_from_openai(
+    prompt: str, queue: "asyncio.Queue[Optional[Dict[str, str]]]", max_songs: int = 10
+) -> int:
+    """
+    Runs stream_song_recommendations_from_openai and puts each song on `queue` as it is
+    parsed, followed by None when the completion ends (also on errors, which are re-raised
+    to whoever awaits this). Run it as a task, so downstream stages consume song 1 while the
+    model is still generating the rest. Returns how many songs were queued.
+    """
+    count = 0
+    try:
+        async for song in stream_song_recommendations_from_openai(prompt, max_songs):
+            queue.put_nowait(song)
+            count += 1
+    finally:
+        queue.put_nowait(None)
+    return count
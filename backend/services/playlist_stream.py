@@ -0,0 +1,251 @@
+# backend/services/playlist_stream.py
+import asyncio
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from .. import crud, models
+from ..config import settings
+from ..database import run_db, session_scope, DBSession
+from .enrichment_worker import enrichment_worker
+from .openai_service import enqueue_song_recommendations_from_openai
+from .prompt_cache import normalize_prompt
+from .recommendation_service import get_stored_recommendations, get_fresh_recommendations, get_local_recommendations, accept_song
+from .spotify_id_cache import build_spotify_tracks, save_spotify_lookups
+from .spotify_service import get_spotify_client_async, map_tracks_to_spotify_ids, create_spotify_playlist_from_ids
+from .tag_cache import tag_cache, utcnow
+from .tag_recommender import LOCAL_SOURCE
+
+# ?format= value -> media type of the streaming playlist endpoint
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+async def _iterate(songs: Iterable[Dict[str, str]]) -> AsyncIterator[Dict[str, str]]:
+    for song in songs:
+        yield song
+
+
+def format_event(event: str, data: Dict[str, Any], stream_format: str = "ndjson") -> str:
+    """Serializes one event as an NDJSON line or as a Server-Sent Event."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+class PlaylistStream:
+    """
+    One streaming playlist request. Songs are saved and announced one by one, and each
+    song's Last.fm tags and Spotify ID are resolved by its own task as soon as it is saved,
+    so the client sees results while the rest of the pipeline is still running.
+    Everything is funnelled through one queue that events() drains in arrival order.
+    """
+
+    def __init__(self, db: DBSession, prompt_text: str, force_refresh: bool = False, engine: Optional[str] = None):
+        self.db = db
+        self.prompt_text = prompt_text
+        self.force_refresh = force_refresh
+        self.engine = engine or settings.RECOMMENDER_ENGINE
+        self.source = "openai" # Recommendation source stored with the links, may change on fallback
+        self.songs: List[models.Song] = []
+        self.tracks: List[Dict[str, Any]] = [] # Spotify lookup state per song, see build_spotify_tracks
+        self._queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue()
+        self._resolvers: List[asyncio.Task] = []
+        self._spotify_client: Optional[asyncio.Task] = None
+        self._openai_task: Optional[asyncio.Task] = None
+        self._openai_error: Optional[Exception] = None
+
+    async def events(self) -> AsyncIterator[Event]:
+        # Authenticating with Spotify doesn't depend on the songs, start it right away
+        self._spotify_client = asyncio.create_task(get_spotify_client_async())
+        producer = None
+        try:
+            db_prompt = await run_db(self.db, crud.get_or_create_prompt, self.prompt_text, normalize_prompt(self.prompt_text))
+            max_songs = settings.SPOTIFY_PLAYLIST_MAX_TRACKS + 5
+            recommended, self.source = await get_stored_recommendations(self.db, db_prompt, self.force_refresh)
+            if recommended is not None:
+                songs = _iterate(recommended)
+            elif settings.OPENAI_STREAMING and self.engine != "local":
+                songs = self._stream_openai_songs(db_prompt.id, max_songs, fallback=self.engine == "auto")
+            else:
+                try:
+                    recommended, self.source = await get_fresh_recommendations(self.prompt_text, self.engine, max_songs)
+                except Exception as e:
+                    print(f"Error calling OpenAI service: {e}")
+                    yield "error", {"status_code": 503, "detail": f"AI service unavailable or failed: {str(e)}"}
+                    return
+                if not recommended:
+                    yield "error", {"status_code": 404, "detail": "OpenAI could not recommend any songs for this prompt."}
+                    return
+                # A fresh answer replaces whatever was stored for this prompt before
+                await run_db(self.db, crud.clear_prompt_recommendations, db_prompt.id)
+                songs = _iterate(recommended)
+
+            producer = asyncio.create_task(self._produce(db_prompt.id, songs))
+            while True:
+                event = await self._queue.get()
+                if event is None:
+                    break
+                yield event
+            try:
+                await producer # Re-raises if saving the songs failed
+            except Exception as e:
+                print(f"Error saving the streamed recommendations: {e}")
+                yield "error", {"status_code": 500, "detail": f"Failed to save the recommendations: {str(e)}"}
+                return
+
+            if not self.songs and self._openai_error is not None:
+                yield "error", {"status_code": 503, "detail": f"AI service unavailable or failed: {str(self._openai_error)}"}
+                return
+            if not self.songs:
+                yield "error", {"status_code": 404, "detail": "No valid songs processed for playlist creation."}
+                return
+            yield await self._create_playlist()
+        finally:
+            # Client went away or something failed: don't leave lookups running
+            tasks = [task for task in [producer, self._openai_task, self._spotify_client, *self._resolvers] if task is not None]
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Wait for them to unwind before session_scope closes the session they use
+            # (also marks an auth failure we never reported as retrieved)
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stream_openai_songs(self, prompt_id: int, max_songs: int, fallback: bool = False) -> AsyncIterator[Dict[str, str]]:
+        """
+        Songs parsed from the streamed OpenAI completion. A separate task reads the token
+        stream into a queue, so the model keeps generating while earlier songs are saved.
+        With `fallback`, the local recommender takes over if OpenAI fails before the first
+        song or the first song takes longer than OPENAI_FALLBACK_TIMEOUT_SECONDS.
+        """
+        queue: "asyncio.Queue[Optional[Dict[str, str]]]" = asyncio.Queue()
+        self._openai_task = asyncio.create_task(enqueue_song_recommendations_from_openai(self.prompt_text, queue, max_songs=max_songs))
+        first_song_timeout = settings.OPENAI_FALLBACK_TIMEOUT_SECONDS if fallback else None
+        yielded = 0
+        timed_out = False
+        while True:
+            try:
+                song = await asyncio.wait_for(queue.get(), timeout=first_song_timeout if yielded == 0 else None)
+            except asyncio.TimeoutError:
+                print(f"OpenAI took longer than {first_song_timeout}s, using the local recommender")
+                self._openai_task.cancel()
+                timed_out = True
+                break
+            if song is None:
+                break
+            if yielded == 0:
+                # A fresh answer replaces whatever was stored for this prompt before
+                await run_db(self.db, crud.clear_prompt_recommendations, prompt_id)
+            yield song
+            yielded += 1
+        if not timed_out:
+            try:
+                await self._openai_task
+            except Exception as e:
+                # Songs parsed before the failure are still used
+                print(f"Error calling OpenAI service: {e}")
+                self._openai_error = e
+
+        if fallback and yielded == 0:
+            local_songs = await get_local_recommendations(self.prompt_text, max_songs)
+            if local_songs:
+                self.source = LOCAL_SOURCE
+                self._openai_error = None
+                await run_db(self.db, crud.clear_prompt_recommendations, prompt_id)
+                for song in local_songs:
+                    yield song
+
+    async def _produce(self, prompt_id: int, recommended: AsyncIterable[Dict[str, str]]):
+        seen = set()
+        try:
+            async for song in recommended:
+                pair = accept_song(song, seen)
+                if pair is None:
+                    continue
+                index = len(self.songs)
+                db_song = (await run_db(self.db, crud.save_recommendations, prompt_id, [pair], self.source, start_position=index))[0]
+                track = build_spotify_tracks([db_song])[0]
+                self.songs.append(db_song)
+                self.tracks.append(track)
+                self._queue.put_nowait(("song", {"index": index, "id": db_song.id, "title": db_song.title, "artist": db_song.artist}))
+                self._resolvers.append(asyncio.create_task(self._resolve(index, db_song, track)))
+                if len(self.songs) >= settings.SPOTIFY_PLAYLIST_MAX_TRACKS:
+                    break
+            await asyncio.gather(*self._resolvers)
+        finally:
+            self._queue.put_nowait(None)
+
+    async def _resolve(self, index: int, db_song: models.Song, track: Dict[str, Any]):
+        await asyncio.gather(self._resolve_tags(index, db_song), self._resolve_spotify_id(index, db_song, track))
+
+    async def _resolve_tags(self, index: int, db_song: models.Song):
+        try:
+            tags = (await tag_cache.fetch_tags_for_songs(self.db, [db_song]))[0]
+        except Exception as e:
+            print(f"Could not fetch tags for {db_song.title} by {db_song.artist}: {e}")
+            tags = None
+        if tags is None:
+            # Failed lookups are retried by the enrichment worker (see /songs/{song_id}/tags)
+            await run_db(self.db, crud.enqueue_enrichment_jobs, [db_song.id], utcnow(), commit=True)
+            enrichment_worker.notify()
+        self._queue.put_nowait(("tags", {
+            "index": index,
+            "id": db_song.id,
+            "tags": tags or [],
+            "tags_status": "pending" if tags is None else "ready",
+        }))
+
+    async def _resolve_spotify_id(self, index: int, db_song: models.Song, track: Dict[str, Any]):
+        try:
+            sp = await self._spotify_client
+        except Exception:
+            return # Reported once, in place of the playlist
+        try:
+            await map_tracks_to_spotify_ids(sp, [track], limit_per_search=1)
+        except Exception as e:
+            print(f"Spotify lookup failed for {db_song.title} by {db_song.artist}: {e}")
+            track['spotify_lookup'] = "error"
+        self._queue.put_nowait(("spotify", {
+            "index": index,
+            "id": db_song.id,
+            "spotify_id": track.get('spotify_id'),
+            "status": track.get('spotify_lookup'),
+        }))
+
+    async def _create_playlist(self) -> Event:
+        try:
+            sp = await self._spotify_client
+        except Exception as e:
+            return "error", {
+                "status_code": 401,
+                "detail": f"Spotify authentication required or token invalid. Please login via /api/v1/spotify/login. Error: {str(e)}",
+            }
+        try:
+            playlist_url = await create_spotify_playlist_from_ids(
+                sp,
+                [track.get('spotify_id') for track in self.tracks],
+                playlist_name=f"MoodTunes: {self.prompt_text[:30]}...",
+            )
+            return "playlist", {"playlist_url": playlist_url, "message": "Awesome playlist created successfully!"}
+        except Exception as e:
+            print(f"Failed to create Spotify playlist: {str(e)}")
+            return "error", {"status_code": 500, "detail": f"Failed to create Spotify playlist: {str(e)}"}
+        finally:
+            # Keep resolved IDs and misses even if playlist creation failed afterwards
+            await run_db(self.db, save_spotify_lookups, self.songs, self.tracks)
+
+
+async def stream_playlist_events(prompt_text: str, force_refresh: bool = False,
+                                 engine: Optional[str] = None) -> AsyncIterator[Event]:
+    """
+    Playlist generation as (event, data) pairs, for the streaming endpoint:
+      "song"     {index, id, title, artist}       as soon as a song is saved
+      "tags"     {index, id, tags, tags_status}   when its Last.fm tags resolve
+      "spotify"  {index, id, spotify_id, status}  when its Spotify lookup resolves
+      "playlist" {playlist_url, message}          last, once the playlist exists
+      "error"    {status_code, detail}            instead of "playlist" if the request failed
+    Uses its own session: the request's get_session dependency is closed before the body streams.
+    """
+    async with session_scope() as db:
+        async for event in PlaylistStream(db, prompt_text, force_refresh, engine).events():
+            yield event
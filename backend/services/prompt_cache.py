@@ -0,0 +1,42 @@
+# backend/services/prompt_cache.py
+import re
+from datetime import timedelta
+from typing import List, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..config import settings
+from .tag_cache import utcnow
+
+# Only answers that really came from OpenAI are reused; links created when serving
+# a cached answer are stored with CACHE_SOURCE (or semantic_cache.SEMANTIC_CACHE_SOURCE)
+# so the TTL doesn't extend itself.
+CACHEABLE_SOURCES = ["openai"]
+CACHE_SOURCE = "prompt_cache"
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(text: str) -> str:
+    """
+    Cache key for a prompt: lowercased, punctuation removed, whitespace collapsed.
+    "Sad, rainy-day songs!" and "sad rainy day songs" map to the same key.
+    """
+    text = _PUNCTUATION_RE.sub(" ", text.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def get_cached_recommendations(db: Session, prompt_text: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Returns the stored recommendations for a prompt with the same normalized text,
+    as [{"title": ..., "artist": ...}, ...], or None on a cache miss.
+    """
+    if settings.PROMPT_CACHE_TTL_SECONDS <= 0:
+        return None
+    since = utcnow() - timedelta(seconds=settings.PROMPT_CACHE_TTL_SECONDS)
+    songs = crud.get_latest_recommendations_for_normalized_prompt(
+        db, normalize_prompt(prompt_text), since=since, sources=CACHEABLE_SOURCES
+    )
+    if not songs:
+        return None
+    return [{"title": song.title, "artist": song.artist} for song in songs]
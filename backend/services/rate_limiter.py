@@ -0,0 +1,38 @@
+# backend/services/rate_limiter.py
+import asyncio
+import time
+
+
+class AsyncRateLimiter:
+    """
+    Token-bucket rate limiter shared by all coroutines that call the same external API.
+    `rate` is the number of calls allowed per second, `burst` how many may go out back to back.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:  # Rate limiting disabled
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                # Sleep while holding the lock so waiters are served in FIFO order
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
@@ -0,0 +1,101 @@
+# backend/services/recommendation_service.py
+import asyncio
+from typing import List, Dict, Optional, Set, Tuple
+
+from .. import models
+from ..config import settings
+from ..database import run_db, DBSession
+from .openai_service import get_song_recommendations_from_openai
+from .prompt_cache import get_cached_recommendations, CACHE_SOURCE as PROMPT_CACHE_SOURCE
+from .semantic_cache import get_similar_prompt_recommendations, SEMANTIC_CACHE_SOURCE
+from .tag_recommender import tag_recommender, LOCAL_SOURCE
+
+OPENAI_SOURCE = "openai"
+
+
+async def get_stored_recommendations(
+    db: DBSession, db_prompt: models.Prompt, force_refresh: bool = False
+) -> Tuple[Optional[List[Dict[str, str]]], str]:
+    """
+    Recommendations that can be served without asking OpenAI, shared by the JSON and
+    streaming playlist endpoints. Returns (songs, source), or (None, "openai") on a miss.
+    """
+    # Repeated prompts (same text after normalization) reuse the stored recommendations
+    songs = None
+    source = OPENAI_SOURCE
+    if not force_refresh:
+        songs = await run_db(db, get_cached_recommendations, db_prompt.text)
+        if songs:
+            source = PROMPT_CACHE_SOURCE
+            print(f"Prompt cache hit, skipping OpenAI ({len(songs)} songs)")
+
+    # Paraphrased prompts reuse the recommendations of the closest earlier prompt.
+    # The prompt is indexed either way (in the background after an exact hit), so later
+    # paraphrases can find it.
+    similar_prompt_songs = await get_similar_prompt_recommendations(
+        db, db_prompt, lookup=not force_refresh and not songs
+    )
+    if similar_prompt_songs and not songs:
+        songs = similar_prompt_songs
+        source = SEMANTIC_CACHE_SOURCE
+    return songs or None, source
+
+async def get_local_recommendations(prompt_text: str, max_songs: int) -> List[Dict[str, str]]:
+    """Recommendations from the local tag recommender, [] if it has nothing (or fails)."""
+    try:
+        songs = await tag_recommender.recommend_async(prompt_text, k=max_songs)
+    except Exception as e:
+        print(f"Local recommender failed: {e}")
+        return []
+    return [{"title": song["title"], "artist": song["artist"]} for song in songs]
+
+async def get_fresh_recommendations(
+    prompt_text: str, engine: Optional[str], max_songs: int
+) -> Tuple[Optional[List[Dict[str, str]]], str]:
+    """
+    Asks the selected engine (default settings.RECOMMENDER_ENGINE) for new recommendations.
+    Returns (songs, source). "openai" raises/returns None like get_song_recommendations_from_openai;
+    "auto" uses the local recommender if OpenAI fails or is slower than OPENAI_FALLBACK_TIMEOUT_SECONDS.
+    """
+    engine = engine or settings.RECOMMENDER_ENGINE
+    if engine == "local":
+        return await get_local_recommendations(prompt_text, max_songs), LOCAL_SOURCE
+    if engine != "auto":
+        return await get_song_recommendations_from_openai(prompt_text, max_songs=max_songs), OPENAI_SOURCE
+
+    try:
+        songs = await asyncio.wait_for(
+            get_song_recommendations_from_openai(prompt_text, max_songs=max_songs),
+            timeout=settings.OPENAI_FALLBACK_TIMEOUT_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        print(f"OpenAI took longer than {settings.OPENAI_FALLBACK_TIMEOUT_SECONDS}s, using the local recommender")
+        songs = None
+    except ValueError as e: # Not configured
+        print(f"OpenAI unavailable ({e}), using the local recommender")
+        songs = None
+    if songs:
+        return songs, OPENAI_SOURCE
+    local_songs = await get_local_recommendations(prompt_text, max_songs)
+    if local_songs:
+        return local_songs, LOCAL_SOURCE
+    return songs, OPENAI_SOURCE
+
+def accept_song(song: Dict[str, str], seen: Set[str]) -> Optional[Tuple[str, str]]:
+    """
+    Returns the (title, artist) pair of a recommended song, or None if it is incomplete
+    or a duplicate of a song in `seen` (updated in place).
+    """
+    title = song.get("title")
+    artist = song.get("artist")
+    if not title or not artist:
+        print(f"Skipping song with missing title/artist: {song}")
+        return None
+
+    # Check for duplicates based on title and artist
+    identifier = f"{title.lower()} - {artist.lower()}"
+    if identifier in seen:
+        print(f"Skipping duplicate song: {title} by {artist}")
+        return None
+    seen.add(identifier)
+    return title, artist
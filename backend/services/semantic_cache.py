@@ -0,0 +1,108 @@
+# backend/services/semantic_cache.py
+import asyncio
+import os
+import threading
+from datetime import timedelta
+from typing import List, Dict, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .. import crud, models
+from ..config import settings
+from ..database import run_db, DBSession
+from .embedding_service import encode_texts, encode_texts_async
+from .prompt_cache import CACHEABLE_SOURCES
+from .tag_cache import utcnow
+from .vector_index import VectorIndex
+
+SEMANTIC_CACHE_SOURCE = "semantic_cache"
+
+# Every stored prompt, keyed by Prompt.id. Opened on first use, not at import: opening
+# creates the index directory and lock files and repairs the data files under a flock
+_prompt_index: Optional[VectorIndex] = None
+_prompt_index_lock = threading.Lock()
+
+def get_prompt_index() -> VectorIndex:
+    """The shared prompt index, opened on first call (thread-safe)."""
+    global _prompt_index
+    if _prompt_index is None:
+        with _prompt_index_lock:
+            if _prompt_index is None:
+                _prompt_index = VectorIndex(os.path.join(settings.INDEX_DIR, "prompts"))
+    return _prompt_index
+
+async def get_similar_prompt_recommendations(
+    db: DBSession, db_prompt: models.Prompt, lookup: bool = True
+) -> Optional[List[Dict[str, str]]]:
+    """
+    Embeds the prompt, adds it to the prompt index and (if `lookup`) returns the stored
+    recommendations of the most similar earlier prompt whose cosine similarity is at least
+    SEMANTIC_CACHE_THRESHOLD. Returns None on a miss or if embedding fails.
+    Without `lookup` (the answer came from elsewhere) it returns right away and the prompt
+    is embedded and indexed by a background task.
+    """
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    prompt_index = await asyncio.to_thread(get_prompt_index)
+    if not lookup:
+        if db_prompt.id not in prompt_index:
+            index_prompt_later(db_prompt.id, db_prompt.text)
+        return None
+    try:
+        embedding = (await encode_texts_async([db_prompt.text]))[0]
+    except Exception as e:
+        print(f"Semantic cache: could not embed prompt: {e}")
+        return None
+
+    recommendations = None
+    hits = await asyncio.to_thread(prompt_index.search, embedding, 5)
+    since = utcnow() - timedelta(seconds=settings.PROMPT_CACHE_TTL_SECONDS)
+    for prompt_id, score in hits:
+        if score < settings.SEMANTIC_CACHE_THRESHOLD:
+            break # Hits are sorted, the rest are further away
+        if prompt_id == db_prompt.id:
+            continue
+        songs = await run_db(db, crud.get_recent_recommendations_for_prompt, prompt_id, since=since, sources=CACHEABLE_SOURCES)
+        if songs:
+            print(f"Semantic cache hit: prompt #{prompt_id} (similarity {score:.3f})")
+            recommendations = [{"title": song.title, "artist": song.artist} for song in songs]
+            break
+
+    if db_prompt.id not in prompt_index:
+        await asyncio.to_thread(prompt_index.add, [db_prompt.id], embedding[None, :])
+    return recommendations
+
+# Background indexing tasks, referenced until done so they aren't garbage collected
+_indexing_tasks: Set[asyncio.Task] = set()
+
+def index_prompt_later(prompt_id: int, text: str) -> asyncio.Task:
+    """Embeds and indexes a prompt in a background task, off the request path."""
+    task = asyncio.create_task(_index_prompt(prompt_id, text))
+    _indexing_tasks.add(task)
+    task.add_done_callback(_indexing_tasks.discard)
+    return task
+
+async def _index_prompt(prompt_id: int, text: str):
+    try:
+        embeddings = await encode_texts_async([text])
+        await asyncio.to_thread(get_prompt_index().add, [prompt_id], embeddings)
+    except Exception as e:
+        print(f"Semantic cache: could not index prompt #{prompt_id}: {e}")
+
+def backfill_prompt_index(db: Session, batch_size: int = 256) -> int:
+    """Embeds every stored prompt that is missing from the index. Returns how many were added."""
+    prompt_index = get_prompt_index()
+    added = 0
+    last_id = 0
+    while True:
+        prompts = crud.get_prompts_after_id(db, last_id, limit=batch_size)
+        if not prompts:
+            break
+        last_id = prompts[-1].id
+        missing = [p for p in prompts if p.id not in prompt_index]
+        if missing:
+            prompt_index.add([p.id for p in missing], encode_texts([p.text for p in missing]))
+            added += len(missing)
+    if added:
+        print(f"Semantic cache: indexed {added} stored prompts ({len(prompt_index)} total)")
+    return added
@@ -0,0 +1,160 @@
+# backend/services/song_index.py
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Dict, List, Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from .. import crud, models
+from ..config import settings
+from ..database import SessionLocal, run_db, DBSession
+from .embedding_service import encode_texts, encode_texts_async
+from .vector_index import VectorIndex
+
+# Every song whose tags were fetched, keyed by Song.id. Opened on first use, not at import
+# (see semantic_cache.get_prompt_index)
+_song_vectors: Optional[VectorIndex] = None
+_song_vectors_lock = threading.Lock()
+
+def get_song_vectors() -> VectorIndex:
+    """The shared song index, opened on first call (thread-safe)."""
+    global _song_vectors
+    if _song_vectors is None:
+        with _song_vectors_lock:
+            if _song_vectors is None:
+                _song_vectors = VectorIndex(
+                    os.path.join(settings.INDEX_DIR, "songs"),
+                    dtype=settings.SONG_INDEX_DTYPE,
+                    nprobe=settings.SONG_INDEX_NPROBE,
+                )
+    return _song_vectors
+
+def song_embedding_text(title: str, artist: str, tags: Iterable[str]) -> str:
+    """What gets embedded for a song: "Title by Artist. Tags: a, b, c"."""
+    tags = list(tags)
+    text = f"{title} by {artist}"
+    if tags:
+        text += f". Tags: {', '.join(tags)}"
+    return text
+
+def tags_fingerprint(tags: Iterable[str]) -> int:
+    """Identifies a song's tag set in the index, so a song is embedded again when its tags change."""
+    digest = hashlib.blake2b("\n".join(sorted(set(tags))).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True) or 1 # 0 = rows indexed before fingerprints
+
+def index_songs(songs: List[models.Song]) -> int:
+    """
+    Embeds the songs with tags that are not in the index yet, or whose tags changed since
+    (blocking). Returns how many were (re-)embedded.
+    """
+    song_vectors = get_song_vectors()
+    missing, fingerprints = [], []
+    for song in songs:
+        tags = [tag.name for tag in song.tags]
+        fingerprint = tags_fingerprint(tags)
+        if tags and song_vectors.fingerprint(song.id) != fingerprint: # Untagged songs wait for their tags
+            missing.append(song)
+            fingerprints.append(fingerprint)
+    if not missing:
+        return 0
+    texts = [song_embedding_text(song.title, song.artist, (tag.name for tag in song.tags)) for song in missing]
+    # Each version of a song is embedded once anyway, skip the embedding cache
+    song_vectors.add([song.id for song in missing], encode_texts(texts, cache=False), fingerprints)
+    return len(missing)
+
+def backfill_song_index(db: Session, batch_size: int = 256) -> int:
+    """Embeds every song with fetched tags that is missing from the index. Returns how many were added."""
+    added = 0
+    last_id = 0
+    while True:
+        songs = crud.get_enriched_songs_after_id(db, last_id, limit=batch_size)
+        if not songs:
+            break
+        last_id = songs[-1].id
+        added += index_songs(songs)
+        db.expunge_all() # Keep memory flat while paging through the catalog
+    if added:
+        print(f"Song index: indexed {added} stored songs ({len(get_song_vectors())} total)")
+    return added
+
+def search_song_ids(embedding: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+    """Top-k (song_id, cosine similarity) for a prompt embedding, best first."""
+    return get_song_vectors().search(embedding, k=k, nprobe=nprobe)
+
+async def find_similar_songs(db: DBSession, prompt_text: str, k: int = 10) -> List[Tuple[models.Song, float]]:
+    """Embeds the prompt and returns the k nearest songs with their similarity."""
+    embedding = (await encode_texts_async([prompt_text]))[0]
+    hits = await asyncio.to_thread(search_song_ids, embedding, k)
+    songs = await run_db(db, crud.get_songs_by_ids, [song_id for song_id, _ in hits])
+    scores = dict(hits)
+    return [(song, scores[song.id]) for song in songs]
+
+
+class SongIndexer:
+    """
+    Adds songs to the index as soon as their tags are stored (see TagCache), in batches
+    and off the request path: the embedding includes the tag names, so songs are indexed
+    when they have tags, and again when a refresh changes them.
+    """
+
+    def __init__(self, batch_size: int = 64):
+        self.batch_size = batch_size
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, tags_by_song_id: Dict[int, List[str]]):
+        """Queues the songs whose freshly stored tags are not the ones they are indexed with."""
+        if not settings.SONG_INDEX_ENABLED:
+            return
+        with self._lock:
+            self._pending.update(
+                song_id for song_id, tags in tags_by_song_id.items()
+                if tags and get_song_vectors().fingerprint(song_id) != tags_fingerprint(tag.lower().strip() for tag in tags if tag.strip())
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Starts the indexing task on the running event loop (call from app startup)."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _take_batch(self) -> List[int]:
+        with self._lock:
+            batch = [self._pending.pop() for _ in range(min(self.batch_size, len(self._pending)))]
+        return batch
+
+    def _index_ids(self, song_ids: List[int]) -> int:
+        db = SessionLocal()
+        try:
+            return index_songs(crud.get_songs_by_ids(db, song_ids))
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                try:
+                    added = await asyncio.to_thread(self._index_ids, batch)
+                    print(f"Song index: embedded {added} songs ({len(get_song_vectors())} total)")
+                except Exception as e:
+                    print(f"Song index: could not index {len(batch)} songs: {e}")
+
+
+song_indexer = SongIndexer()
@@ -0,0 +1,42 @@
+# backend/services/spotify_id_cache.py
+from datetime import timedelta
+from typing import List, Dict, Any
+
+from sqlalchemy.orm import Session
+
+from .. import crud, models
+from ..config import settings
+from .tag_cache import utcnow, as_naive_utc
+
+
+def build_spotify_tracks(songs: List[models.Song]) -> List[Dict[str, Any]]:
+    """
+    Builds the track dicts for map_tracks_to_spotify_ids from Song rows, carrying the
+    stored Spotify ID (flagged for re-validation when older than SPOTIFY_ID_REVALIDATE_SECONDS)
+    or a "skip_search" flag for songs that were not found recently.
+    """
+    now = utcnow()
+    revalidate_after = timedelta(seconds=settings.SPOTIFY_ID_REVALIDATE_SECONDS)
+    tracks = []
+    for song in songs:
+        track = {"title": song.title, "artist": song.artist, "song_id": song.id}
+        if song.spotify_id:
+            track["spotify_id"] = song.spotify_id
+            checked_at = song.spotify_checked_at
+            track["revalidate"] = checked_at is None or now - as_naive_utc(checked_at) > revalidate_after
+        elif song.spotify_retry_after and now < as_naive_utc(song.spotify_retry_after):
+            track["skip_search"] = True
+        tracks.append(track)
+    return tracks
+
+def save_spotify_lookups(db: Session, songs: List[models.Song], tracks: List[Dict[str, Any]]):
+    """Writes the results of map_tracks_to_spotify_ids back to the songs table (one commit)."""
+    now = utcnow()
+    retry_after = now + timedelta(seconds=settings.SPOTIFY_MISS_RETRY_SECONDS)
+    for song, track in zip(songs, tracks):
+        status = track.get("spotify_lookup")
+        if status in ("found", "validated"):
+            crud.set_song_spotify_id(db, song, track["spotify_id"], checked_at=now, retry_after=retry_after)
+        elif status == "miss":
+            crud.record_spotify_miss(db, song, checked_at=now, retry_after=retry_after)
+    db.commit()
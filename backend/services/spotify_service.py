@@ -1,13 +1,28 @@
 # backend/services/spotify_service.py
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth, SpotifyOauthError
 from ..config import settings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+SpotifyOAuthError = SpotifyOauthError # Name used by main.py
 
 # This scope allows creating public and private playlists and modifying them.
 # Also allows reading user's library to check if song is already saved (optional).
 SPOTIFY_SCOPE = "playlist-modify-public playlist-modify-private user-library-read"
 
+# Spotipy is synchronous. All of its calls go through this bounded pool (see run_spotify_call)
+# instead of the default executor, so Spotify can't starve other to_thread users like Last.fm.
+_spotify_executor = ThreadPoolExecutor(max_workers=settings.SPOTIFY_THREAD_POOL_SIZE, thread_name_prefix="spotify")
+
 # Initialize SpotifyOAuth.
 # In a real web app, the user would be redirected to Spotify to authorize.
 # The token would then be stored (e.g., in a session or database associated with the user).
@@ -32,28 +47,90 @@ SPOTIFY_SCOPE = "playlist-modify-public playlist-modify-private user-library-rea
 #                                                               client_secret=settings.SPOTIFY_CLIENT_SECRET))
 # However, playlist creation REQUIRES user authorization.
 
-def get_spotify_client_for_user(access_token: str = None) -> spotipy.Spotify:
+class SpotifyClientPool:
     """
-    Returns a Spotipy client.
-    If access_token is provided, uses it.
-    Otherwise, attempts to use SpotifyOAuth (which might require user interaction or cached token).
-    THIS IS A SIMPLIFIED AUTH HANDLING.
+    Reusable Spotipy clients, keyed by user (the server-wide cached token is "default")
+    or by a raw access token. All clients share one keep-alive requests.Session, so
+    playlist requests don't pay for new TCP/TLS connections or re-read the token cache.
+    Tokens that have a refresh token are refreshed by run_refresh_loop before they
+    expire, keeping refresh_access_token off the request path.
     """
-    if access_token:
-        return spotipy.Spotify(auth=access_token)
-    else:
-        # This will try to use cached token or prompt if run interactively.
-        # For a web server, you need a proper OAuth flow where the token is obtained
-        # via browser redirection and then passed to this function.
-        auth_manager = SpotifyOAuth(
-            client_id=settings.SPOTIFY_CLIENT_ID,
-            client_secret=settings.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIFY_REDIRECT_URI,
-            scope=SPOTIFY_SCOPE,
-            # cache_path=".spotify_cache" # Useful for local dev, add .spotify_cache to .gitignore
-        )
+
+    def __init__(self, max_clients: int = 100, refresh_margin_seconds: int = 300):
+        self.max_clients = max_clients
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._session = self._build_session()
+        self._auth_manager: Optional[SpotifyOAuth] = None
+        self._clients: "OrderedDict[str, spotipy.Spotify]" = OrderedDict()
+        self._token_infos: Dict[str, Dict[str, Any]] = {} # key -> token_info, only for refreshable tokens
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        session = requests.Session()
+        # Same retry policy Spotipy uses for its own sessions, sized for the Spotify thread pool
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]), respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.SPOTIFY_THREAD_POOL_SIZE, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def auth_manager(self) -> SpotifyOAuth:
+        if self._auth_manager is None:
+            self._auth_manager = SpotifyOAuth(
+                client_id=settings.SPOTIFY_CLIENT_ID,
+                client_secret=settings.SPOTIFY_CLIENT_SECRET,
+                redirect_uri=settings.SPOTIFY_REDIRECT_URI,
+                scope=SPOTIFY_SCOPE,
+                requests_session=self._session,
+                open_browser=False,
+                # cache_path=".spotify_cache" # Useful for local dev, add .spotify_cache to .gitignore
+            )
+        return self._auth_manager
+
+    def _store(self, key: str, client: spotipy.Spotify, token_info: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            self._clients[key] = client
+            self._clients.move_to_end(key)
+            if token_info and token_info.get('refresh_token'):
+                self._token_infos[key] = token_info
+            while len(self._clients) > self.max_clients:
+                evicted, _ = self._clients.popitem(last=False)
+                self._token_infos.pop(evicted, None)
+
+    def register_token(self, token_info: Dict[str, Any], key: str = "default") -> spotipy.Spotify:
+        """Creates (or replaces) the pooled client for `key` from a full OAuth token_info."""
+        client = spotipy.Spotify(auth=token_info['access_token'], requests_session=self._session)
+        self._store(key, client, token_info)
+        return client
+
+    def get_client(self, access_token: Optional[str] = None) -> spotipy.Spotify:
+        """
+        Returns a pooled client. With an access_token the client is keyed by that token;
+        without one it uses the token cached by SpotifyOAuth (the "default" user).
+        Blocking on a cache miss, call it through run_spotify_call.
+        """
+        key = access_token or "default"
+        with self._lock:
+            client = self._clients.get(key)
+            token_info = self._token_infos.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+        if client is not None:
+            # Only happens if the background refresh is not running or failed
+            if token_info and self.auth_manager.is_token_expired(token_info):
+                return self.register_token(self.auth_manager.refresh_access_token(token_info['refresh_token']), key)
+            return client
+
+        if access_token:
+            client = spotipy.Spotify(auth=access_token, requests_session=self._session)
+            self._store(key, client)
+            return client
+
         # Try to get a cached token
-        token_info = auth_manager.get_cached_token()
+        token_info = self.auth_manager.get_cached_token()
         if not token_info:
             # This part is problematic for a non-interactive server.
             # You'd typically redirect the user to auth_manager.get_authorize_url()
@@ -62,53 +139,173 @@ def get_spotify_client_for_user(access_token: str = None) -> spotipy.Spotify:
             raise SpotifyOauthError("No cached Spotify token. User needs to authenticate.")
 
         # Refresh token if needed
-        if auth_manager.is_token_expired(token_info):
-            token_info = auth_manager.refresh_access_token(token_info['refresh_token'])
+        if self.auth_manager.is_token_expired(token_info):
+            token_info = self.auth_manager.refresh_access_token(token_info['refresh_token'])
+        return self.register_token(token_info, key)
+
+    def refresh_expiring_tokens(self):
+        """Refreshes every pooled token that expires within refresh_margin_seconds (blocking)."""
+        with self._lock:
+            expiring = [
+                (key, token_info) for key, token_info in self._token_infos.items()
+                if token_info.get('expires_at', 0) - time.time() < self.refresh_margin_seconds
+            ]
+        for key, token_info in expiring:
+            try:
+                new_token_info = self.auth_manager.refresh_access_token(token_info['refresh_token'])
+            except Exception as e:
+                print(f"Could not refresh Spotify token for '{key}': {e}")
+                continue
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None: # Evicted meanwhile
+                    continue
+                client.set_auth(new_token_info['access_token'])
+                self._token_infos[key] = new_token_info
+            print(f"Refreshed Spotify token for '{key}'")
+
+    async def run_refresh_loop(self, interval_seconds: int = 60):
+        """Background task: keeps pooled tokens fresh. Start it once at app startup."""
+        while True:
+            try:
+                await run_spotify_call(self.refresh_expiring_tokens)
+            except Exception as e:
+                print(f"Spotify token refresh loop error: {e}")
+            await asyncio.sleep(interval_seconds)
+
 
-        return spotipy.Spotify(auth=token_info['access_token'])
+spotify_client_pool = SpotifyClientPool(
+    max_clients=settings.SPOTIFY_CLIENT_POOL_SIZE,
+    refresh_margin_seconds=settings.SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS,
+)
 
 
-async def map_tracks_to_spotify_ids(sp: spotipy.Spotify, tracks: List[Dict[str, Any]], limit_per_search=1) -> List[str]:
+def get_spotify_client_for_user(access_token: str = None) -> spotipy.Spotify:
     """
-    Maps a list of {"title": ..., "artist": ...} to Spotify Track IDs.
+    Returns a Spotipy client.
+    If access_token is provided, uses it.
+    Otherwise, attempts to use SpotifyOAuth (which might require user interaction or cached token).
+    Clients come from spotify_client_pool and are reused across requests.
+    THIS IS A SIMPLIFIED AUTH HANDLING.
     """
-    track_ids = []
-    for track_info in tracks:
-        title = track_info['title']
-        artist = track_info['artist']
-        query = f"track:{title} artist:{artist}"
+    return spotify_client_pool.get_client(access_token)
+
+
+def get_spotify_auth_url() -> str:
+    return spotify_client_pool.auth_manager.get_authorize_url()
+
+
+async def handle_spotify_callback_and_get_token(code: str) -> Dict[str, Any]:
+    """
+    Exchanges the OAuth code for a token and registers it in the client pool,
+    so the next playlist request starts with a warm, refreshable client.
+    """
+    auth_manager = spotify_client_pool.auth_manager
+    token_info = await run_spotify_call(auth_manager.get_access_token, code, as_dict=True, check_cache=False)
+    spotify_client_pool.register_token(token_info)
+    return token_info
+
+
+def validate_spotify_ids(sp: spotipy.Spotify, track_ids: List[str]) -> Tuple[Set[str], Set[str]]:
+    """
+    Checks stored track IDs in bulk with the several-tracks endpoint (50 IDs per call).
+    Returns (IDs Spotify still knows, IDs that could not be checked because their batch failed).
+    """
+    valid_ids, unchecked_ids = set(), set()
+    for i in range(0, len(track_ids), 50):
+        chunk = track_ids[i:i + 50]
         try:
-            results = sp.search(q=query, type="track", limit=limit_per_search)
-            items = results['tracks']['items']
-            if items:
-                # Take the first result (most relevant by Spotify's search)
-                track_ids.append(items[0]['id'])
-                print(f"Found Spotify ID for: {title} - {artist} -> {items[0]['id']}")
-            else:
-                print(f"Could not find Spotify ID for: {title} - {artist}")
+            results = sp.tracks(chunk)
+            valid_ids.update(track['id'] for track in results['tracks'] if track)
         except spotipy.SpotifyException as e:
-            print(f"Spotify API error while searching for '{query}': {e}")
-        except Exception as e:
-            print(f"Unexpected error searching Spotify for '{query}': {e}")
-    return track_ids
+            print(f"Spotify API error while validating track IDs, keeping them unchecked: {e}")
+            unchecked_ids.update(chunk)
+    return valid_ids, unchecked_ids
 
 
-async def create_spotify_playlist_from_tracks(
-    tracks: List[Dict[str, Any]],
-    playlist_name: str = "MoodTunes Generated Playlist",
-    # access_token: str = None # Pass user's access token here
-) -> str:
+async def run_spotify_call(func, *args, **kwargs):
     """
-    Creates a Spotify playlist from a list of track titles and artists.
-    Returns the URL of the created playlist.
-    `tracks` is a list of dicts: [{"title": "Track Title", "artist": "Artist Name"}, ...]
-    This function needs to handle Spotify authentication for the user.
+    Runs a blocking Spotipy call on the dedicated Spotify thread pool, so a slow
+    Spotify round trip never blocks the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_spotify_executor, functools.partial(func, *args, **kwargs))
+
+
+async def _search_track_id(sp: spotipy.Spotify, track_info: Dict[str, Any], limit_per_search: int,
+                           semaphore: asyncio.Semaphore) -> Optional[str]:
+    title = track_info['title']
+    artist = track_info['artist']
+    query = f"track:{title} artist:{artist}"
+    try:
+        async with semaphore:
+            results = await run_spotify_call(sp.search, q=query, type="track", limit=limit_per_search)
+        items = results['tracks']['items']
+        if items:
+            # Take the first result (most relevant by Spotify's search)
+            track_info['spotify_id'] = items[0]['id']
+            track_info['spotify_lookup'] = "found"
+            print(f"Found Spotify ID for: {title} - {artist} -> {items[0]['id']}")
+            return items[0]['id']
+        track_info['spotify_lookup'] = "miss"
+        print(f"Could not find Spotify ID for: {title} - {artist}")
+    except spotipy.SpotifyException as e:
+        track_info['spotify_lookup'] = "error"
+        print(f"Spotify API error while searching for '{query}': {e}")
+    except Exception as e:
+        track_info['spotify_lookup'] = "error"
+        print(f"Unexpected error searching Spotify for '{query}': {e}")
+    return None
+
+
+async def map_tracks_to_spotify_ids(sp: spotipy.Spotify, tracks: List[Dict[str, Any]], limit_per_search=1,
+                                    max_concurrency: Optional[int] = None) -> List[str]:
+    """
+    Maps a list of {"title": ..., "artist": ...} to Spotify Track IDs, keeping the input order.
+    A track can carry a known "spotify_id" (used without searching, re-validated in bulk
+    first if "revalidate" is set) or "skip_search" for a recent miss. The remaining tracks
+    are searched concurrently, at most `max_concurrency` (SPOTIFY_SEARCH_CONCURRENCY) at once.
+    The resolved "spotify_id" (or None) and a "spotify_lookup" status
+    ("cached", "validated", "found", "miss", "skipped" or "error") are written back
+    into each dict so the caller can persist them.
+    """
+    to_validate = [t for t in tracks if t.get('spotify_id') and t.get('revalidate')]
+    if to_validate:
+        valid_ids, unchecked_ids = await run_spotify_call(validate_spotify_ids, sp, [t['spotify_id'] for t in to_validate])
+        for track_info in to_validate:
+            if track_info['spotify_id'] in valid_ids:
+                track_info['spotify_lookup'] = "validated"
+            elif track_info['spotify_id'] in unchecked_ids:
+                track_info['spotify_lookup'] = "cached" # Used, but still due for validation next time
+            else:
+                print(f"Stored Spotify ID {track_info['spotify_id']} is no longer valid, searching again")
+                track_info['spotify_id'] = None
+
+    semaphore = asyncio.Semaphore(max_concurrency or settings.SPOTIFY_SEARCH_CONCURRENCY)
+    pending = []
+    for track_info in tracks:
+        if track_info.get('spotify_id'):
+            track_info.setdefault('spotify_lookup', "cached")
+        elif track_info.get('skip_search'):
+            track_info['spotify_lookup'] = "skipped"
+        else:
+            pending.append(_search_track_id(sp, track_info, limit_per_search, semaphore))
+    if pending:
+        await asyncio.gather(*pending)
+
+    return [track_info['spotify_id'] for track_info in tracks if track_info.get('spotify_id')]
+
+
+async def get_spotify_client_async(access_token: str = None) -> spotipy.Spotify:
+    """
+    Async wrapper around get_spotify_client_for_user: reading the token cache
+    (and refreshing it) is blocking I/O as well.
     """
     try:
         # IMPORTANT: In a real app, get_spotify_client_for_user() would need
         # the user's specific access_token obtained via OAuth.
         # For now, it relies on cached token or environment variables for Spotipy.
-        sp = get_spotify_client_for_user() # Pass access_token if available
+        return await run_spotify_call(get_spotify_client_for_user, access_token)
     except SpotifyOauthError as e:
         # This means the user needs to authenticate. The main API endpoint
         # should handle this by initiating the OAuth flow.
@@ -117,33 +314,56 @@ async def create_spotify_playlist_from_tracks(
         raise Exception("Spotify authentication required. Please log in with Spotify.") from e
 
 
-    user_profile = sp.current_user()
-    if not user_profile:
-        raise Exception("Could not get Spotify user profile. Authentication might have failed.")
-    user_id = user_profile['id']
-
-    spotify_track_ids = await map_tracks_to_spotify_ids(sp, tracks, limit_per_search=1)
-
-    if not spotify_track_ids:
-        raise Exception("No tracks could be mapped to Spotify IDs.")
-
+async def create_spotify_playlist_from_ids(
+    sp: spotipy.Spotify,
+    track_ids: List[str],
+    playlist_name: str = "MoodTunes Generated Playlist",
+) -> str:
+    """Creates a playlist for the client's user with already resolved track IDs. Returns its URL."""
     # Spotify API limits adding 100 items at a time
-    valid_track_ids = [tid for tid in spotify_track_ids if tid] # Filter out None if any
+    valid_track_ids = [tid for tid in track_ids if tid] # Filter out None if any
     if not valid_track_ids:
         raise Exception("No valid Spotify Track IDs found to add to playlist.")
 
-    playlist = sp.user_playlist_create(user=user_id, name=playlist_name, public=True) # Or public=False
+    user_profile = await run_spotify_call(sp.current_user)
+    if not user_profile:
+        raise Exception("Could not get Spotify user profile. Authentication might have failed.")
+    user_id = user_profile['id']
+
+    playlist = await run_spotify_call(sp.user_playlist_create, user=user_id, name=playlist_name, public=True) # Or public=False
     playlist_id = playlist['id']
     playlist_url = playlist['external_urls']['spotify']
 
     # Add tracks in chunks of 100
     for i in range(0, len(valid_track_ids), 100):
         chunk = valid_track_ids[i:i + 100]
-        sp.playlist_add_items(playlist_id, chunk)
+        await run_spotify_call(sp.playlist_add_items, playlist_id, chunk)
 
     print(f"Playlist '{playlist_name}' created successfully: {playlist_url}")
     return playlist_url
 
+
+async def create_spotify_playlist_from_tracks(
+    tracks: List[Dict[str, Any]],
+    playlist_name: str = "MoodTunes Generated Playlist",
+    # access_token: str = None # Pass user's access token here
+) -> str:
+    """
+    Creates a Spotify playlist from a list of track titles and artists.
+    Returns the URL of the created playlist.
+    `tracks` is a list of dicts: [{"title": "Track Title", "artist": "Artist Name"}, ...]
+    (see map_tracks_to_spotify_ids for the optional cached-ID keys and the results written back)
+    This function needs to handle Spotify authentication for the user.
+    """
+    sp = await get_spotify_client_async() # Pass access_token if available
+
+    spotify_track_ids = await map_tracks_to_spotify_ids(sp, tracks, limit_per_search=1)
+
+    if not spotify_track_ids:
+        raise Exception("No tracks could be mapped to Spotify IDs.")
+
+    return await create_spotify_playlist_from_ids(sp, spotify_track_ids, playlist_name)
+
 # To test this service (requires Spotify credentials set up for Spotipy to find, or cached token):
 # if __name__ == "__main__":
 #     import asyncio
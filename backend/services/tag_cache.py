@@ -0,0 +1,115 @@
+# backend/services/tag_cache.py
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+import threading
+
+from .. import crud, models
+from ..config import settings
+from ..database import run_db, DBSession
+from .lastfm_service import get_tags_for_tracks
+from .song_index import song_indexer
+
+
+def utcnow() -> datetime:
+    # Naive UTC, which is what SQLite hands back for DateTime columns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def as_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class TagCache:
+    """
+    Read-through cache for Last.fm track tags.
+    Lookup order: in-process LRU -> songs/tags tables (Song.tags_fetched_at) -> Last.fm.
+    Results fetched from Last.fm are written back to the DB, including empty results,
+    so tracks Last.fm doesn't know are not looked up again until their TTL runs out.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, negative_ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.negative_ttl = timedelta(seconds=negative_ttl_seconds)
+        self._entries: "OrderedDict[int, Tuple[List[str], datetime]]" = OrderedDict() # song_id -> (tags, fetched_at)
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, tags: List[str], fetched_at: Optional[datetime], now: datetime) -> bool:
+        if fetched_at is None:
+            return False
+        ttl = self.ttl if tags else self.negative_ttl
+        return now - as_naive_utc(fetched_at) < ttl
+
+    def _lru_get(self, song_id: int, now: datetime) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get(song_id)
+            if entry is None:
+                return None
+            tags, fetched_at = entry
+            if not self._is_fresh(tags, fetched_at, now):
+                del self._entries[song_id]
+                return None
+            self._entries.move_to_end(song_id)
+            return tags
+
+    def _lru_put(self, song_id: int, tags: List[str], fetched_at: datetime):
+        with self._lock:
+            self._entries[song_id] = (tags, as_naive_utc(fetched_at))
+            self._entries.move_to_end(song_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_cached_tags(self, song: models.Song) -> Optional[List[str]]:
+        """Returns the tags of a song if they are cached and fresh, without calling Last.fm."""
+        now = utcnow()
+        tags = self._lru_get(song.id, now)
+        if tags is not None:
+            return tags
+        if song.tags_fetched_at is not None:
+            tags = [tag.name for tag in song.tags]
+            if self._is_fresh(tags, song.tags_fetched_at, now):
+                self._lru_put(song.id, tags, song.tags_fetched_at)
+                return tags
+        return None
+
+    async def get_tags_for_songs(self, db: DBSession, songs: List[models.Song]) -> List[List[str]]:
+        """
+        Returns the tags for each song (same order), fetching only stale or unknown songs
+        from Last.fm. Failed lookups come back as [] but are not cached.
+        """
+        return [tags if tags is not None else [] for tags in await self.fetch_tags_for_songs(db, songs)]
+
+    async def fetch_tags_for_songs(self, db: DBSession, songs: List[models.Song]) -> List[Optional[List[str]]]:
+        """Like get_tags_for_songs, but failed Last.fm lookups come back as None (used for retries)."""
+        results: List[Optional[List[str]]] = [self.get_cached_tags(song) for song in songs]
+        missing = [i for i, tags in enumerate(results) if tags is None]
+        if missing:
+            fetched = await get_tags_for_tracks([(songs[i].title, songs[i].artist) for i in missing])
+            fetched_at = utcnow()
+            to_save = {}
+            for i, tags in zip(missing, fetched):
+                if tags is None: # Transient Last.fm error, try again next time
+                    continue
+                to_save[songs[i].id] = tags
+                results[i] = tags
+            # One set-based write and one commit for the whole batch
+            await run_db(db, crud.save_tags_for_songs, to_save, fetched_at, commit=True)
+            for song_id, tags in to_save.items():
+                self._lru_put(song_id, tags, fetched_at)
+            # Songs are embedded once their tags are known
+            song_indexer.enqueue(to_save)
+        print(f"Tag cache: {len(songs) - len(missing)}/{len(songs)} songs served from cache")
+        return results
+
+    def invalidate(self, song_id: int):
+        with self._lock:
+            self._entries.pop(song_id, None)
+
+
+tag_cache = TagCache(
+    max_entries=settings.TAG_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.TAG_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=settings.TAG_CACHE_NEGATIVE_TTL_SECONDS,
+)
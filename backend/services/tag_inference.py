@@ -0,0 +1,88 @@
+# backend/services/tag_inference.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from ..config import settings
+from .embedding_service import get_predictor
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submit() calls into one call of `batch_fn(items) -> results`
+    (same length and order). A batch is sent when it reaches max_batch_size or when the
+    first item has waited max_wait_seconds, and runs on `executor`, off the event loop.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int,
+                 max_wait_seconds: float, executor: ThreadPoolExecutor):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.executor = executor
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if not batch:
+            return
+        loop = asyncio.get_running_loop()
+        loop.create_task(self._run(batch))
+        if self._pending: # More than one batch arrived at once
+            self._timer = loop.call_later(0, self._flush)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done(): # The caller may have been cancelled meanwhile
+                future.set_result(result)
+
+
+# Inference gets its own thread, so tag predictions never queue behind Spotify/Last.fm/DB
+# work in the default pool (torch parallelizes each batch internally)
+_tag_prediction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tag-predictor")
+
+def _predict_tags_batch(requests: List[Tuple[str, float, int]]) -> List[List[Tuple[str, float]]]:
+    predictor = get_predictor()
+    # One forward pass with the loosest settings, then each request gets its own cut
+    min_threshold = min(threshold for _, threshold, _ in requests)
+    max_top_n = max(top_n for _, _, top_n in requests)
+    batch = predictor.predict_batch_with_scores([prompt for prompt, _, _ in requests], threshold=min_threshold, top_n=max_top_n)
+    return [
+        [(tag, p) for tag, p in tags if p > threshold][:top_n]
+        for (_, threshold, top_n), tags in zip(requests, batch)
+    ]
+
+tag_prediction_batcher = MicroBatcher(
+    _predict_tags_batch,
+    max_batch_size=settings.TAG_PREDICTION_MAX_BATCH_SIZE,
+    max_wait_seconds=settings.TAG_PREDICTION_MAX_WAIT_MS / 1000,
+    executor=_tag_prediction_executor,
+)
+
+async def predict_tags(prompt_text: str, threshold: float = 0.3, top_n: int = 5) -> List[Tuple[str, float]]:
+    """(tag, probability) pairs for a prompt, batched with concurrent requests."""
+    return await tag_prediction_batcher.submit((prompt_text, threshold, top_n))
+
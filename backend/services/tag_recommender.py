@@ -0,0 +1,202 @@
+# backend/services/tag_recommender.py
+import asyncio
+import threading
+import time
+from typing import List, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..config import settings
+from .tag_inference import predict_tags
+
+LOCAL_SOURCE = "local"
+
+
+class TagIndex:
+    """
+    Immutable TF-IDF index over the songs/tags tables, built with SciPy sparse.
+    Conceptually a songs x tags matrix whose rows are L2-normalized TF-IDF vectors (so long
+    tag lists don't dominate), stored column-wise (CSC): column j is the inverted list of
+    tag j, compact int32 song rows plus float32 weights. Each inverted list is sorted by
+    weight, highest first, so a query can stop after the most relevant postings of very
+    common tags (max_postings_per_tag) and stay fast on large catalogs.
+    """
+
+    def __init__(self, song_ids: np.ndarray, titles: List[str], artists: List[str],
+                 tag_columns: Dict[str, int], matrix: sparse.csc_matrix, idf: np.ndarray,
+                 max_postings_per_tag: Optional[int] = None):
+        self.song_ids = song_ids
+        self.titles = titles
+        self.artists = artists
+        self.tag_columns = tag_columns
+        self.matrix = matrix
+        self.idf = idf
+        self.max_postings_per_tag = max_postings_per_tag
+
+    @classmethod
+    def build(cls, songs: Sequence[Tuple[int, str, str]], song_tags: Sequence[Tuple[int, str]],
+              max_postings_per_tag: Optional[int] = None) -> "TagIndex":
+        """Builds the index from (song_id, title, artist) rows and (song_id, tag name) links."""
+        song_ids = np.fromiter((row[0] for row in songs), dtype=np.int64, count=len(songs))
+        song_rows = {int(song_id): row for row, song_id in enumerate(song_ids)}
+        tag_columns: Dict[str, int] = {}
+        rows, cols = [], []
+        for song_id, tag_name in song_tags:
+            row = song_rows.get(song_id)
+            if row is None:
+                continue
+            rows.append(row)
+            cols.append(tag_columns.setdefault(tag_name, len(tag_columns)))
+
+        shape = (len(song_ids), len(tag_columns))
+        binary = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (np.asarray(rows, dtype=np.int32), np.asarray(cols, dtype=np.int32))),
+            shape=shape,
+        )
+        binary.sum_duplicates()
+        binary.data[:] = 1.0
+        # Smooth IDF like scikit-learn: rare tags say more about a song than "rock" does
+        df = np.bincount(binary.indices, minlength=shape[1]).astype(np.float32)
+        idf = np.log((1 + shape[0]) / (1 + df)) + 1
+        weighted = binary.multiply(idf[None, :]).tocsr()
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.csc_matrix(sparse.diags(1 / norms).dot(weighted), dtype=np.float32)
+
+        # Impact order: sort every inverted list by weight, descending
+        columns_of_postings = np.repeat(np.arange(shape[1]), np.diff(matrix.indptr))
+        order = np.lexsort((-matrix.data, columns_of_postings))
+        matrix.indices = matrix.indices[order].astype(np.int32)
+        matrix.data = matrix.data[order]
+        matrix.has_sorted_indices = False
+        return cls(
+            song_ids=song_ids,
+            titles=[row[1] for row in songs],
+            artists=[row[2] for row in songs],
+            tag_columns=tag_columns,
+            matrix=matrix,
+            idf=idf.astype(np.float32),
+            max_postings_per_tag=max_postings_per_tag,
+        )
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    def search(self, weighted_tags: Sequence[Tuple[str, float]], k: int = 25,
+               max_per_artist: int = 2) -> List[Dict]:
+        """
+        Ranks songs by the TF-IDF-weighted overlap of their tags with `weighted_tags`
+        ((name, weight) pairs, e.g. predicted probabilities). Returns up to k
+        {"song_id", "title", "artist", "score"} dicts, best first.
+        """
+        indptr, indices, data = self.matrix.indptr, self.matrix.indices, self.matrix.data
+        posting_rows, posting_scores = [], []
+        for name, weight in weighted_tags:
+            column = self.tag_columns.get(name.lower().strip())
+            if column is None:
+                continue
+            start, end = indptr[column], indptr[column + 1]
+            if self.max_postings_per_tag:
+                end = min(end, start + self.max_postings_per_tag)
+            posting_rows.append(indices[start:end])
+            posting_scores.append(data[start:end] * np.float32(weight * self.idf[column]))
+        if not posting_rows:
+            return []
+
+        # Sparse dot product: only the (truncated) inverted lists of the query tags are touched
+        rows = np.concatenate(posting_rows)
+        scores = np.bincount(rows, weights=np.concatenate(posting_scores), minlength=len(self))
+        # A song appears once per matching tag, over-fetch so the per-artist cap can still fill k
+        top = min(len(rows), k * (max_per_artist + 2) * len(posting_rows))
+        best = rows[np.argpartition(-scores[rows], top - 1)[:top]]
+        best = np.unique(best)
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        results = []
+        per_artist: Dict[str, int] = {}
+        for row in best:
+            artist_key = self.artists[row].lower()
+            if per_artist.get(artist_key, 0) >= max_per_artist:
+                continue
+            per_artist[artist_key] = per_artist.get(artist_key, 0) + 1
+            results.append({
+                "song_id": int(self.song_ids[row]),
+                "title": self.titles[row],
+                "artist": self.artists[row],
+                "score": float(scores[row]),
+            })
+            if len(results) >= k:
+                break
+        return results
+
+
+class TagRecommender:
+    """
+    OpenAI-free recommendations: TagPredictor maps the prompt to tags, and the songs
+    we already know are ranked against them with a TagIndex built from the DB.
+    The index is rebuilt off the request path (refresh()) and swapped atomically.
+    """
+
+    def __init__(self, top_tags: int = 8, min_tag_probability: float = 0.05, max_postings_per_tag: Optional[int] = None):
+        self.top_tags = top_tags
+        self.min_tag_probability = min_tag_probability
+        self.max_postings_per_tag = max_postings_per_tag
+        self._index: Optional[TagIndex] = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def index(self) -> Optional[TagIndex]:
+        return self._index
+
+    def refresh(self, db: Session) -> TagIndex:
+        """Rebuilds the index from the songs/tags tables (blocking, run it in a thread)."""
+        with self._build_lock:
+            started = time.perf_counter()
+            index = TagIndex.build(crud.get_tagged_songs(db), crud.get_song_tag_pairs(db), self.max_postings_per_tag)
+            self._index = index
+            print(f"Tag recommender: indexed {len(index)} songs, {len(index.tag_columns)} tags "
+                  f"in {time.perf_counter() - started:.2f}s")
+            return index
+
+    def recommend_for_tags(self, weighted_tags: List[Tuple[str, float]], k: int = 25) -> List[Dict]:
+        """Ranks the indexed songs against (tag, weight) pairs, [] until the index is built."""
+        index = self._index
+        if index is None or len(index) == 0:
+            return []
+        songs = index.search(weighted_tags, k=k)
+        print(f"Tag recommender: {len(songs)} songs for tags {[tag for tag, _ in weighted_tags]}")
+        return songs
+
+    async def recommend_async(self, prompt_text: str, k: int = 25) -> List[Dict]:
+        """Predicts the prompt's tags (batched with concurrent requests) and ranks the indexed songs."""
+        if self._index is None or len(self._index) == 0:
+            return []
+        weighted_tags = await predict_tags(prompt_text, threshold=self.min_tag_probability, top_n=self.top_tags)
+        return self.recommend_for_tags(weighted_tags, k) # A few ms of NumPy, fine on the loop
+
+    async def run_refresh_loop(self, session_factory, interval_seconds: int):
+        """Background task: rebuilds the index every interval_seconds so new tags are picked up."""
+        if self._index is not None:
+            # Built before fork (preload): keep sharing the master's copy until the first scheduled rebuild
+            await asyncio.sleep(interval_seconds)
+        while True:
+            def _refresh():
+                db = session_factory()
+                try:
+                    self.refresh(db)
+                finally:
+                    db.close()
+            try:
+                await asyncio.to_thread(_refresh)
+            except Exception as e:
+                print(f"Tag recommender refresh error: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+tag_recommender = TagRecommender(
+    top_tags=settings.LOCAL_RECOMMENDER_TOP_TAGS,
+    max_postings_per_tag=settings.LOCAL_RECOMMENDER_MAX_POSTINGS_PER_TAG,
+)
@@ -0,0 +1,389 @@
+# backend/services/vector_index.py
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Iterable
+
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 42) -> np.ndarray:
+    """K-means on unit vectors using cosine similarity. Returns normalized centroids (n_clusters x dim)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        if empty.any(): # Re-seed empty clusters with random points
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Persistent cosine-similarity index over L2-normalized vectors, shared by every process
+    that opens the same `path` (a prefix).
+
+    Files under `path`:
+      .vectors            raw row-major vectors (float32 or float16), memory-mapped read-only
+      .ids                raw int64 ids, one per row
+      .fingerprints       raw int64 fingerprint of what was embedded, one per row (0 = unknown)
+      .meta.json          dim / dtype / current IVF training
+      .centroids.<v>.npy  IVF centroids of training v
+      .lists.<v>          raw int32 IVF list number of every row, for training v
+      .lock               flock'ed by writers
+
+    Appends only touch the end of the files and happen under an exclusive flock, after
+    catching up with what other processes appended, so row numbers agree everywhere.
+    Re-adding an id with a different fingerprint appends a replacement row: the latest
+    row of an id is the live one, searches skip the others.
+    Readers pick up new rows and trainings from the file sizes and meta.json before a
+    search, and only trust the rows that are complete in every file. Below `ivf_min_rows`
+    a search is an exact scan of the whole matrix; above it a coarse quantizer (spherical
+    k-means, ~4*sqrt(n) lists, retrained every 4x growth) is trained in a background
+    thread, and a search only scans the `nprobe` closest lists.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: str = "float32",
+                 nprobe: int = 8, ivf_min_rows: int = 20000):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._fingerprints = np.zeros(0, dtype=np.int64)
+        self._live = np.zeros(0, dtype=bool) # False for rows replaced by a later row of the same id
+        self._row_of: Dict[int, int] = {} # id -> its live row
+        # (centroids, inverted lists of row numbers), swapped as one object so searches
+        # never see centroids and lists from different trainings
+        self._ivf: Optional[Tuple[np.ndarray, List[np.ndarray]]] = None
+        self._ivf_version: Optional[int] = None
+        self._trained_rows = 0
+        self._meta: Optional[dict] = None
+        self._meta_stamp = None
+        self._training: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock, self._file_lock("lock"):
+            self._repair()
+            self._sync()
+
+    # --- Persistence ---
+    def _file(self, suffix: str) -> str:
+        return f"{self.path}.{suffix}"
+
+    def _ivf_files(self, version: int) -> Tuple[str, str]:
+        if version == 0: # Trained before trainings were versioned
+            return self._file("centroids.npy"), self._file("lists")
+        return self._file(f"centroids.{version}.npy"), self._file(f"lists.{version}")
+
+    @contextmanager
+    def _file_lock(self, name: str, blocking: bool = True):
+        """Exclusive flock on `<path>.<name>`, across processes. Raises BlockingIOError if not blocking and held."""
+        with open(self._file(name), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            stat = os.stat(self._file("meta.json"))
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp != self._meta_stamp: # Replaced atomically by _write_meta
+            with open(self._file("meta.json")) as f:
+                self._meta = json.load(f)
+            self._meta_stamp = stamp
+        return self._meta
+
+    def _write_meta(self, **changes):
+        meta = dict(self._read_meta() or {}, dim=self.dim, dtype=self.dtype.name, **changes)
+        tmp_path = self._file(f"meta.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _current_version(self, meta: dict) -> Optional[int]:
+        version = meta.get("ivf_version")
+        if version is None and os.path.exists(self._file("centroids.npy")):
+            version = 0
+        return version
+
+    @staticmethod
+    def _file_rows(path: str, row_bytes: int) -> int:
+        try:
+            return os.path.getsize(path) // row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def _complete_rows(self, version: Optional[int]) -> int:
+        """Rows present in every file: a concurrent append may have written some files only."""
+        rows = min(self._file_rows(self._file("vectors"), self.dim * self.dtype.itemsize),
+                   self._file_rows(self._file("ids"), 8), self._file_rows(self._file("fingerprints"), 8))
+        if version is not None:
+            rows = min(rows, self._file_rows(self._ivf_files(version)[1], 4))
+        return rows
+
+    def _repair(self):
+        """
+        Trims what a crashed writer left half-written, pads missing fingerprints with 0 (also
+        for indexes written before fingerprints existed) and assigns the rows missing from
+        the IVF lists file (caller holds the write lock, so no append is in flight).
+        """
+        meta = self._read_meta()
+        if meta is None:
+            return
+        dim, dtype = meta["dim"], np.dtype(meta["dtype"])
+        count = min(self._file_rows(self._file("vectors"), dim * dtype.itemsize), self._file_rows(self._file("ids"), 8))
+        for suffix, row_bytes in (("vectors", dim * dtype.itemsize), ("ids", 8)):
+            if os.path.exists(self._file(suffix)) and os.path.getsize(self._file(suffix)) != count * row_bytes:
+                os.truncate(self._file(suffix), count * row_bytes)
+        fingerprinted = self._file_rows(self._file("fingerprints"), 8)
+        with open(self._file("fingerprints"), "ab") as f:
+            f.truncate(min(fingerprinted, count) * 8)
+            f.write(bytes(max(0, count - fingerprinted) * 8))
+        version = self._current_version(meta)
+        if version is None:
+            return
+        centroids_path, lists_path = self._ivf_files(version)
+        assigned = self._file_rows(lists_path, 4)
+        if os.path.exists(lists_path) and os.path.getsize(lists_path) != min(assigned, count) * 4:
+            os.truncate(lists_path, min(assigned, count) * 4)
+        if assigned < count:
+            vectors = np.memmap(self._file("vectors"), dtype=dtype, mode="r", shape=(count, dim))
+            missing = self._assign(np.load(centroids_path), np.asarray(vectors[assigned:count], dtype=np.float32))
+            with open(lists_path, "ab") as f:
+                f.write(missing.tobytes())
+
+    def _sync(self):
+        """Catches up with the rows and trainings written by this or another process (caller holds _lock)."""
+        meta = self._read_meta()
+        if meta is None:
+            return
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._trained_rows = meta.get("ivf_trained_rows", 0)
+        version = self._current_version(meta)
+        known = len(self._ids)
+        count = self._complete_rows(version)
+        if count > known:
+            new_ids = np.fromfile(self._file("ids"), dtype=np.int64, count=count - known, offset=known * 8)
+            new_fingerprints = np.fromfile(self._file("fingerprints"), dtype=np.int64, count=count - known, offset=known * 8)
+            replaced = []
+            for row, item_id in enumerate(new_ids.tolist(), start=known):
+                previous = self._row_of.get(item_id)
+                if previous is not None:
+                    replaced.append(previous)
+                self._row_of[item_id] = row
+            live = np.concatenate([self._live, np.ones(count - known, dtype=bool)])
+            live[replaced] = False
+            self._fingerprints = np.concatenate([self._fingerprints, new_fingerprints])
+            self._live = live
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._remap(count)
+        if version != self._ivf_version:
+            if version is None:
+                self._ivf = None
+            else:
+                centroids_path, lists_path = self._ivf_files(version)
+                centroids = np.load(centroids_path)
+                assignments = np.fromfile(lists_path, dtype=np.int32, count=count)
+                self._ivf = (centroids, self._build_lists(centroids, assignments))
+            self._ivf_version = version
+        elif self._ivf is not None and count > known:
+            lists = self._ivf[1]
+            assignments = np.fromfile(self._ivf_files(version)[1], dtype=np.int32, count=count - known, offset=known * 4)
+            rows = np.arange(known, count, dtype=np.int64)
+            for list_no in np.unique(assignments):
+                lists[list_no] = np.concatenate([lists[list_no], rows[assignments == list_no]])
+
+    def _remap(self, count: int):
+        if count == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self._file("vectors"), dtype=self.dtype, mode="r", shape=(count, self.dim))
+
+    def refresh(self):
+        """Picks up rows and trainings from other processes. Skipped if this process is busy writing."""
+        if self._lock.acquire(blocking=False):
+            try:
+                self._sync()
+            finally:
+                self._lock.release()
+
+    # --- IVF ---
+    @staticmethod
+    def _assign(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+    @staticmethod
+    def _build_lists(centroids: np.ndarray, assignments: np.ndarray) -> List[np.ndarray]:
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        return [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+
+    def _needs_training(self) -> bool:
+        return len(self._ids) >= max(self.ivf_min_rows, 4 * self._trained_rows)
+
+    def train(self, n_lists: Optional[int] = None, sample_size: int = 50000):
+        """
+        (Re)trains the IVF quantizer on a sample of the stored vectors and reassigns every row
+        (blocking, seconds on a large index). K-means runs on a snapshot without any lock;
+        only the reassignment and the switch to the new training block other writers.
+        """
+        with self._lock:
+            self._sync()
+            vectors, count = self._vectors, len(self._ids)
+        if count == 0:
+            return
+        n_lists = n_lists or max(1, int(4 * np.sqrt(count)))
+        rng = np.random.default_rng(42)
+        sample_rows = np.sort(rng.choice(count, size=min(count, sample_size), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+        centroids = spherical_kmeans(sample, min(n_lists, len(sample)))
+
+        with self._lock, self._file_lock("lock"):
+            self._repair()
+            self._sync()
+            count = len(self._ids)
+            assignments = np.concatenate([
+                self._assign(centroids, np.asarray(self._vectors[start:start + 65536], dtype=np.float32))
+                for start in range(0, count, 65536)
+            ])
+            version = (self._ivf_version or 0) + 1
+            centroids_path, lists_path = self._ivf_files(version)
+            with open(centroids_path, "wb") as f:
+                np.save(f, centroids)
+            assignments.tofile(lists_path)
+            self._write_meta(ivf_trained_rows=count, ivf_version=version)
+            # Keep the previous training's files: another process may be loading them right now
+            if version >= 2:
+                for old_path in self._ivf_files(version - 2):
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+            self._sync()
+
+    def _train_if_needed(self):
+        try:
+            with self._file_lock("train.lock", blocking=False):
+                with self._lock:
+                    self._sync()
+                    needed = self._needs_training()
+                if needed: # Not trained meanwhile by another process
+                    started = time.perf_counter()
+                    self.train()
+                    print(f"Vector index {os.path.basename(self.path)}: trained {len(self._ivf[0])} lists "
+                          f"over {self._trained_rows} rows in {time.perf_counter() - started:.1f}s")
+        except BlockingIOError:
+            pass # Another process is training
+        except Exception as e:
+            print(f"Vector index {os.path.basename(self.path)}: training failed: {e}")
+
+    def wait_for_training(self, timeout: Optional[float] = None):
+        """Waits for a background training started by add(), if any."""
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    # --- Public API ---
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._row_of
+
+    def fingerprint(self, item_id: int) -> Optional[int]:
+        """Fingerprint the id's live row was added with, None if the id isn't indexed."""
+        row = self._row_of.get(item_id)
+        return None if row is None else int(self._fingerprints[row])
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray, fingerprints: Optional[Iterable[int]] = None):
+        """
+        Appends vectors (normalized here) for ids that are not in the index yet, or whose
+        fingerprint (e.g. a hash of the embedded text, default 0) changed: their new row
+        replaces the old one. Training the quantizer, when the index has grown enough,
+        happens in a background thread.
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        fingerprints = np.zeros(len(ids), dtype=np.int64) if fingerprints is None else np.asarray(list(fingerprints), dtype=np.int64)
+        with self._lock, self._file_lock("lock"):
+            self._repair()
+            self._sync() # Rows appended by other processes come first
+            keep = np.array([self.fingerprint(i) != fp for i, fp in zip(ids.tolist(), fingerprints.tolist())], dtype=bool)
+            ids, vectors, fingerprints = ids[keep], vectors[keep], fingerprints[keep]
+            if len(ids) == 0:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if self._read_meta() is None:
+                self._write_meta(ivf_trained_rows=0)
+            # Vectors, ids, fingerprints, then lists: readers only trust rows present in all of them
+            with open(self._file("vectors"), "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+            with open(self._file("ids"), "ab") as f:
+                f.write(ids.tobytes())
+            with open(self._file("fingerprints"), "ab") as f:
+                f.write(fingerprints.tobytes())
+            if self._ivf is not None:
+                with open(self._ivf_files(self._ivf_version)[1], "ab") as f:
+                    f.write(self._assign(self._ivf[0], vectors).tobytes())
+            self._sync()
+            # Train once the index is big enough, retrain when it has grown 4x (lists get too long)
+            if self._needs_training() and (self._training is None or not self._training.is_alive()):
+                self._training = threading.Thread(target=self._train_if_needed, name="vector-index-train", daemon=True)
+                self._training.start()
+
+    def _scores(self, block: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if block.dtype != np.float32: # float16 storage: numpy has no fast half-precision matmul
+            block = block.astype(np.float32)
+        return block @ query
+
+    def search(self, query: np.ndarray, k: int = 1, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Returns up to k (id, cosine similarity) pairs, best first."""
+        self.refresh()
+        vectors, ids, live, ivf = self._vectors, self._ids, self._live, self._ivf
+        if vectors is None or len(ids) == 0:
+            return []
+        query = normalize_rows(query)[0]
+        if ivf is None:
+            rows = None
+            scores = np.concatenate([
+                self._scores(vectors[start:start + 65536], query) for start in range(0, len(vectors), 65536)
+            ])
+            scores[~live[:len(scores)]] = -np.inf # Replaced rows
+        else:
+            centroids, lists = ivf
+            probe = min(nprobe or self.nprobe, len(centroids))
+            closest = np.argpartition(-(centroids @ query), probe - 1)[:probe]
+            rows = np.concatenate([lists[c] for c in closest])
+            rows = rows[rows < len(vectors)]
+            rows = rows[live[rows]]
+            if len(rows) == 0:
+                return []
+            scores = self._scores(vectors[rows], query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+        return [(int(ids[p]), float(scores[i])) for p, i in zip(positions, top) if scores[i] > -np.inf]
@@ -0,0 +1,132 @@
+# backend/services/warmup.py
+import asyncio
+import gc
+import time
+from typing import Callable, Dict, List, Tuple
+
+from ..config import settings
+from ..database import SessionLocal, create_db_and_tables, engine
+
+
+class Readiness:
+    """
+    State of the heavy resources that are initialized after import, for the /ready probe.
+    Each component is "pending", "ready" or "failed". The app is ready once the required
+    components are ready and nothing is pending any more; a failed optional component
+    (e.g. no trained tag model) is reported but doesn't keep the app out of rotation.
+    """
+
+    def __init__(self, required: Tuple[str, ...] = ("database",)):
+        self.required = required
+        self.components: Dict[str, Dict] = {}
+        self._started = time.perf_counter()
+
+    def start(self, name: str):
+        self.components[name] = {"status": "pending"}
+
+    def finish(self, name: str, seconds: float, error: Exception = None):
+        self.components[name] = {"status": "failed" if error else "ready", "seconds": round(seconds, 3)}
+        if error:
+            self.components[name]["error"] = str(error)
+
+    @property
+    def is_ready(self) -> bool:
+        return (
+            all(self.components.get(name, {}).get("status") == "ready" for name in self.required)
+            and all(component["status"] != "pending" for component in self.components.values())
+        )
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.is_ready,
+            "uptime_seconds": round(time.perf_counter() - self._started, 3),
+            "components": self.components,
+        }
+
+
+readiness = Readiness()
+
+async def init_component(name: str, fn: Callable[[], object]) -> bool:
+    """Runs a blocking initializer in a thread and records how it went. Returns True on success."""
+    readiness.start(name)
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(fn)
+    except Exception as e:
+        readiness.finish(name, time.perf_counter() - started, e)
+        print(f"Warm-up: {name} failed after {time.perf_counter() - started:.2f}s: {e}")
+        return False
+    readiness.finish(name, time.perf_counter() - started)
+    print(f"Warm-up: {name} ready in {time.perf_counter() - started:.2f}s")
+    return True
+
+def _warm_tag_predictor():
+    from .embedding_service import get_predictor
+    predictor = get_predictor()
+    predictor.predict_batch_with_scores(["warm up"]) # First forward pass allocates the torch buffers
+
+def _warm_lastfm():
+    from .lastfm_service import get_network
+    if get_network() is None:
+        raise RuntimeError("Last.fm network could not be created")
+
+def _warm_vector_indexes():
+    from .semantic_cache import get_prompt_index
+    from .song_index import get_song_vectors
+    if settings.SEMANTIC_CACHE_ENABLED:
+        get_prompt_index()
+    if settings.SONG_INDEX_ENABLED:
+        get_song_vectors()
+
+# Resources loaded in the background after startup, so the first request doesn't pay for them
+WARMUP_STEPS: List[Tuple[str, Callable[[], object]]] = [
+    ("tag_predictor", _warm_tag_predictor),
+    ("lastfm", _warm_lastfm),
+    ("vector_indexes", _warm_vector_indexes),
+]
+
+async def init_database() -> bool:
+    return await init_component("database", create_db_and_tables)
+
+async def warm_up():
+    """Initializes every WARMUP_STEPS resource concurrently (each in its own thread)."""
+    for name, _ in WARMUP_STEPS:
+        readiness.start(name) # Pending from the start, so /ready waits for all of them
+    await asyncio.gather(*(init_component(name, fn) for name, fn in WARMUP_STEPS))
+
+def preload_for_fork():
+    """
+    Loads what workers only read (tag model weights, unless they go to a GPU; the tag
+    recommender index) in the gunicorn master, before it forks. The vector indexes are
+    opened by each worker's warm-up: their memory maps share pages through the page cache.
+    No forward pass here: torch's thread pool must not be started before fork. Afterwards
+    every surviving object is moved out of the GC's reach (gc.freeze), so collections in
+    the workers don't write to their headers and un-share the pages.
+    """
+    started = time.perf_counter()
+    create_db_and_tables()
+    from .embedding_service import get_predictor
+    from .tag_recommender import tag_recommender
+    try:
+        import torch
+        if torch.cuda.is_available():
+            # CUDA can't be used in a forked child once the parent initialized it: each
+            # worker loads the model onto the GPU itself (warm-up)
+            print("Preload: CUDA available, the tag predictor is loaded by each worker instead")
+        else:
+            get_predictor()
+    except Exception as e:
+        print(f"Preload: could not load the tag predictor: {e}")
+    db = SessionLocal()
+    try:
+        if settings.RECOMMENDER_ENGINE != "openai":
+            tag_recommender.refresh(db)
+    except Exception as e:
+        print(f"Preload: could not build the tag recommender index: {e}")
+    finally:
+        db.close()
+    # Workers must open their own DB connections, not share the master's sockets/handles
+    engine.dispose()
+    gc.collect()
+    gc.freeze()
+    print(f"Preload: shared resources loaded in the master in {time.perf_counter() - started:.2f}s")
@@ -1,12 +1,24 @@
 from ytmusicapi import YTMusic
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import threading
 
-# Initialize anonymous client
-try:
-    ytmusic = YTMusic()
-except Exception as e:
-    print(f"Failed to initialize YTMusic (anonymous): {e}")
-    ytmusic = None # Allow app to run but this service will fail gracefully
+_ytmusic: Optional[YTMusic] = None
+_ytmusic_lock = threading.Lock()
+
+def get_ytmusic() -> Optional[YTMusic]:
+    """
+    The anonymous YTMusic client, created on first use (thread-safe) instead of at import.
+    None if it can't be created: the app still runs and this service fails gracefully.
+    """
+    global _ytmusic
+    if _ytmusic is None:
+        with _ytmusic_lock:
+            if _ytmusic is None:
+                try:
+                    _ytmusic = YTMusic()
+                except Exception as e:
+                    print(f"Failed to initialize YTMusic (anonymous): {e}")
+    return _ytmusic
 
 # For authenticated client (if needed later):
 # try:
@@ -26,6 +38,7 @@ async def search_ytmusic_for_tracks(query: str, limit: int = 10) -> List[Dict[st
     Searches YouTube Music for tracks based on a query.
     Returns a list of dicts: [{"title": "Track Title", "artist": "Artist Name"}, ...]
     """
+    ytmusic = get_ytmusic()
     if not ytmusic:
         print("YTMusic client not initialized. Skipping YouTube Music search.")
         return []
@@ -0,0 +1,108 @@
+# benchmarks/cold_start.py
+"""
+Cold-start benchmark for the API process (backend/main.py).
+
+Measures, each in a fresh interpreter:
+  import      time to `import backend.main` (nothing heavy may run at import)
+  first req   time from spawning uvicorn to the first 200 from GET /health
+  ready       time until GET /ready returns 200 (background warm-up done)
+
+and fails (exit code 1) if import or first request exceed their budget. Readiness
+depends on the model size and disk cache, so it is reported but not budgeted.
+Runs against a throwaway SQLite database and index directory.
+
+Run from the repo root:
+    python -m benchmarks.cold_start --runs 3
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_BUDGET_SECONDS = 2.0
+FIRST_REQUEST_BUDGET_SECONDS = 3.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def status_of(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def measure_import(env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import backend.main; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_startup(env: dict, ready_timeout: float) -> tuple:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_request = ready = None
+    try:
+        while time.perf_counter() - started < ready_timeout:
+            if first_request is None and status_of(f"{base}/health") == 200:
+                first_request = time.perf_counter() - started
+            if first_request is not None and status_of(f"{base}/ready") == 200:
+                ready = time.perf_counter() - started
+                break
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return first_request, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_SECONDS)
+    parser.add_argument("--first-request-budget", type=float, default=FIRST_REQUEST_BUDGET_SECONDS)
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    parser.add_argument("--no-warmup", action="store_true", help="Set WARMUP_ON_STARTUP=false")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/cold_start.db", INDEX_DIR=f"{tmp}/indexes",
+                   WARMUP_ON_STARTUP="false" if args.no_warmup else "true")
+        imports, first_requests, readies = [], [], []
+        for run in range(args.runs):
+            imports.append(measure_import(env))
+            first_request, ready = measure_startup(env, args.ready_timeout)
+            first_requests.append(first_request if first_request is not None else float("inf"))
+            readies.append(ready)
+            ready_text = f"{ready:.2f}s" if ready is not None else f"not ready after {args.ready_timeout:.0f}s"
+            print(f"run {run + 1}: import {imports[-1]:.2f}s, first request {first_requests[-1]:.2f}s, ready {ready_text}")
+
+    worst_import, worst_first = max(imports), max(first_requests)
+    print(f"worst import {worst_import:.2f}s (budget {args.import_budget:.2f}s), "
+          f"worst first request {worst_first:.2f}s (budget {args.first_request_budget:.2f}s)")
+    if worst_import > args.import_budget or worst_first > args.first_request_budget:
+        print("OVER BUDGET")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
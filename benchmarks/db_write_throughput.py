@@ -0,0 +1,113 @@
+# benchmarks/db_write_throughput.py
+"""
+Write-throughput benchmark for the database engine profiles in backend/database.py.
+
+Simulates concurrent playlist requests against a fresh SQLite file: each "request"
+creates a prompt, upserts 25 songs with 5 tags each and links them, with the same
+commits as the playlist endpoint (songs+links, tags, Spotify IDs).
+
+Run from the repo root:
+    python -m benchmarks.db_write_throughput --threads 8 --requests 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, models
+from backend.database import Base, create_db_engine
+
+SONGS_PER_REQUEST = 25
+TAGS_PER_SONG = 5
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def run_request(db, request_no: int, rng: random.Random):
+    prompt = crud.create_prompt(db, f"benchmark prompt {request_no} {rng.random()}", f"benchmark prompt {request_no}")
+    songs = [(f"title {rng.randrange(5000)}", f"artist {rng.randrange(500)}") for _ in range(SONGS_PER_REQUEST)]
+    songs = list(dict.fromkeys(songs))
+    db_songs = crud.save_recommendations(db, prompt.id, songs, "openai")
+    crud.save_tags_for_songs(
+        db, {song.id: [f"tag {rng.randrange(300)}" for _ in range(TAGS_PER_SONG)] for song in db_songs}, _utcnow()
+    )
+    db.commit()
+    for song in db_songs:
+        song.spotify_checked_at = _utcnow()
+    db.commit()
+
+
+def run_profile(profile: str, threads: int, requests_per_thread: int, directory: str = None) -> dict:
+    # Use a directory on the real disk: on tmpfs fsync is free and the profiles look alike
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_db_engine(url, profile)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        errors = []
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(worker_no: int):
+            rng = random.Random(worker_no)
+            db = Session()
+            try:
+                for i in range(requests_per_thread):
+                    start = time.perf_counter()
+                    try:
+                        run_request(db, worker_no * requests_per_thread + i, rng)
+                    except OperationalError as e: # "database is locked"
+                        db.rollback()
+                        with lock:
+                            errors.append(str(e.orig))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                db.close()
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan")
+    return {
+        "profile": profile,
+        "requests/s": len(latencies) / elapsed,
+        "p50 ms": latencies[len(latencies) // 2] * 1000 if latencies else float("nan"),
+        "p99 ms": p99 * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per thread")
+    parser.add_argument("--profiles", nargs="+", default=["default", "production"])
+    parser.add_argument("--dir", default=".", help="Where to create the benchmark database")
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.requests} requests, {SONGS_PER_REQUEST} songs x {TAGS_PER_SONG} tags each")
+    print(f"{'profile':<12}{'requests/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for profile in args.profiles:
+        r = run_profile(profile, args.threads, args.requests, args.dir)
+        print(f"{r['profile']:<12}{r['requests/s']:>12.1f}{r['p50 ms']:>10.1f}{r['p99 ms']:>10.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/local_recommender.py
+"""
+Latency benchmark for the local tag recommender index (backend/services/tag_recommender.py).
+
+Builds a TagIndex over synthetic songs whose tags follow a Zipf-like popularity curve
+(a few tags like "rock" are everywhere, most are rare), then ranks songs for random
+8-tag queries. Measures the index lookup only; tag prediction (SBERT + MLP) comes on top.
+
+Run from the repo root:
+    python -m benchmarks.local_recommender --songs 100000 --tags 5000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from backend.services.tag_recommender import TagIndex
+
+
+def build_synthetic_index(num_songs: int, num_tags: int, tags_per_song: int, max_postings_per_tag: int = None,
+                          seed: int = 0) -> TagIndex:
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, num_tags + 1)
+    popularity /= popularity.sum()
+    song_tags = rng.choice(num_tags, size=(num_songs, tags_per_song), p=popularity)
+    songs = [(song_id, f"title {song_id}", f"artist {song_id % (num_songs // 10 or 1)}") for song_id in range(1, num_songs + 1)]
+    pairs = [(song_id, f"tag {tag}") for song_id, tags in zip(range(1, num_songs + 1), song_tags.tolist()) for tag in tags]
+    return TagIndex.build(songs, pairs, max_postings_per_tag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, default=100000)
+    parser.add_argument("--tags", type=int, default=5000)
+    parser.add_argument("--tags-per-song", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--max-postings", type=int, default=20000, help="Postings scanned per tag, 0 = exact")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = build_synthetic_index(args.songs, args.tags, args.tags_per_song, args.max_postings)
+    print(f"Built index: {len(index)} songs, {len(index.tag_columns)} tags, "
+          f"{index.matrix.nnz} links in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(1)
+    latencies = []
+    overlaps = []
+    exact = TagIndex(index.song_ids, index.titles, index.artists, index.tag_columns, index.matrix, index.idf)
+    for _ in range(args.queries):
+        # Mostly popular tags, like real predictions
+        query_tags = rng.zipf(1.3, size=8) % args.tags
+        weighted = [(f"tag {tag}", float(p)) for tag, p in zip(query_tags, rng.uniform(0.05, 0.9, size=8))]
+        start = time.perf_counter()
+        results = index.search(weighted, k=args.k)
+        latencies.append(time.perf_counter() - start)
+        if args.max_postings:
+            # How many of the exact top-k the truncated scan returns
+            exact_ids = {song["song_id"] for song in exact.search(weighted, k=args.k)}
+            overlaps.append(len(exact_ids & {song["song_id"] for song in results}) / max(len(exact_ids), 1))
+
+    latencies = np.sort(np.asarray(latencies) * 1000)
+    print(f"{args.queries} queries, k={args.k}: "
+          f"p50 {latencies[len(latencies) // 2]:.2f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms")
+    if overlaps:
+        print(f"Top-{args.k} overlap with exact scoring: {np.mean(overlaps):.3f}")
+
+
+if __name__ == "__main__":
+    main()
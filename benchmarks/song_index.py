@@ -0,0 +1,89 @@
+# benchmarks/song_index.py
+"""
+Latency/recall benchmark for the song embedding index (backend/services/vector_index.py).
+
+Fills a fresh VectorIndex with synthetic 384-d embeddings (the all-MiniLM-L6-v2 size),
+drawn around a few thousand sub-genre centres grouped into genres, so the data has
+overlapping cluster structure like real song embeddings, inserting in batches the way SongIndexer does (the IVF
+quantizer trains and retrains in the background on the way). Then it times top-k queries per nprobe and
+compares them with an exact scan for recall@k.
+
+Run from the repo root:
+    python -m benchmarks.song_index --songs 100000
+    python -m benchmarks.song_index --songs 1000000 --dtype float16
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from backend.services.vector_index import VectorIndex, normalize_rows
+
+DIM = 384
+
+
+def synthetic_embeddings(rng: np.random.Generator, centres: np.ndarray, count: int) -> np.ndarray:
+    picks = rng.integers(len(centres), size=count)
+    return normalize_rows(centres[picks] + rng.normal(scale=2.0 / np.sqrt(DIM), size=(count, DIM)).astype(np.float32))
+
+
+def exact_top_k(index: VectorIndex, query: np.ndarray, k: int) -> set:
+    vectors = index._vectors
+    scores = np.concatenate([
+        np.asarray(vectors[start:start + 65536], dtype=np.float32) @ query for start in range(0, len(vectors), 65536)
+    ])
+    top = np.argpartition(-scores, k - 1)[:k]
+    return set(index._ids[top].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--songs", type=int, default=100000)
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--batch", type=int, default=10000, help="Songs per insert")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--dir", default=None, help="Where to create the index files")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # 2000 sub-genre centres grouped around 50 genres: neighbouring clusters overlap
+    genres = normalize_rows(rng.normal(size=(50, DIM)).astype(np.float32))
+    centres = normalize_rows(genres[rng.integers(50, size=2000)] + rng.normal(scale=1.0 / np.sqrt(DIM), size=(2000, DIM)))
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        index = VectorIndex(f"{tmp}/songs", dtype=args.dtype)
+        start = time.perf_counter()
+        for first_id in range(1, args.songs + 1, args.batch):
+            count = min(args.batch, args.songs + 1 - first_id)
+            index.add(range(first_id, first_id + count), synthetic_embeddings(rng, centres, count))
+        index.wait_for_training()
+        elapsed = time.perf_counter() - start
+        lists = len(index._ivf[0]) if index._ivf else 0
+        print(f"Inserted {len(index)} x {DIM} {args.dtype} vectors in {elapsed:.1f}s "
+              f"({len(index) / elapsed:.0f}/s incl. IVF training, {lists} lists)")
+
+        queries = synthetic_embeddings(rng, centres, args.queries)
+        truth = [exact_top_k(index, query, args.k) for query in queries]
+
+        start = time.perf_counter()
+        for query in queries[:20]:
+            exact_top_k(index, query, args.k)
+        print(f"Exact scan: {(time.perf_counter() - start) / 20 * 1000:.1f} ms/query")
+
+        print(f"{'nprobe':>6}{'p50 ms':>10}{'p99 ms':>10}{'recall@' + str(args.k):>12}")
+        for nprobe in args.nprobe:
+            latencies, recalls = [], []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                hits = index.search(query, k=args.k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(expected & {song_id for song_id, _ in hits}) / args.k)
+            latencies = np.sort(np.asarray(latencies) * 1000)
+            print(f"{nprobe:>6}{latencies[len(latencies) // 2]:>10.2f}"
+                  f"{latencies[int(len(latencies) * 0.99) - 1]:>10.2f}{np.mean(recalls):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
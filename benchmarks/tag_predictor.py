@@ -0,0 +1,76 @@
+# benchmarks/tag_predictor.py
+"""
+CPU throughput/latency benchmark for the TagPredictor inference backends
+(ai/tag_predictor.py): eager fp32 PyTorch vs the TorchScript exports of
+ai/export_model.py (fp32 and dynamic int8).
+
+The embedding cache is disabled so every prompt pays for the transformer. For each
+backend it measures single-prompt latency (p50/p99, what a request sees without
+micro-batching) and batched throughput in prompts/sec, and reports the top-k tag
+agreement with the fp32 model.
+
+Export first, then run from the repo root:
+    (cd ai && python export_model.py --int8)
+    python -m benchmarks.tag_predictor --threads 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from ai.tag_predictor import TagPredictor, top_k_agreement, INFERENCE_BACKENDS
+
+
+def load_prompts(path: str) -> list:
+    df = pd.read_csv(path)
+    return df["prompt_text" if "prompt_text" in df.columns else "prompt"].dropna().tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=os.path.join("ai", "data", "prompts_tags.csv"))
+    parser.add_argument("--backends", nargs="+", default=list(INFERENCE_BACKENDS), choices=INFERENCE_BACKENDS)
+    parser.add_argument("--single", type=int, default=200, help="Single-prompt calls timed per backend")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads, e.g. the worker's CPU share")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    prompts = load_prompts(args.data)
+    reference = None
+    print(f"{len(prompts)} prompts, {torch.get_num_threads()} threads")
+    print(f"{'backend':>18}{'p50 ms':>10}{'p99 ms':>10}{'prompts/s':>12}{'top-k agree':>13}")
+    for backend in args.backends:
+        predictor = TagPredictor(backend=backend, cache_embeddings=False)
+        if predictor.backend != backend:
+            print(f"{backend:>18}  not exported, skipped")
+            continue
+        predictor.predict_batch(prompts[:8]) # Warm-up (lazy init, allocator)
+
+        latencies = []
+        for i in range(args.single):
+            start = time.perf_counter()
+            predictor.predict_batch([prompts[i % len(prompts)]], top_n=args.top_n)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.sort(np.asarray(latencies) * 1000)
+
+        start = time.perf_counter()
+        predicted = []
+        for first in range(0, len(prompts), args.batch_size):
+            predicted += predictor.predict_batch(prompts[first:first + args.batch_size], threshold=0.0, top_n=args.top_n)
+        throughput = len(prompts) / (time.perf_counter() - start)
+
+        if reference is None:
+            reference = predicted if backend == "torch" else None
+        agreement = f"{top_k_agreement(reference, predicted, args.top_n):.3f}" if reference is not None else "-"
+        print(f"{backend:>18}{latencies[len(latencies) // 2]:>10.2f}"
+              f"{latencies[int(len(latencies) * 0.99) - 1]:>10.2f}{throughput:>12.0f}{agreement:>13}")
+
+
+if __name__ == "__main__":
+    main()
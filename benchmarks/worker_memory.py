@@ -0,0 +1,101 @@
+# benchmarks/worker_memory.py
+"""
+Memory report for multi-worker serving (backend/gunicorn_conf.py): starts gunicorn
+with N workers, with and without PRELOAD_MODELS, waits until the workers are ready
+and have served a few requests, then reads /proc/<pid>/smaps_rollup of the master
+and every worker.
+
+RSS counts every page a process maps, shared or not, so it barely changes with
+preloading. PSS splits each shared page between the processes sharing it, so the total
+PSS is what the machine actually spends; compare it between the two modes.
+
+Linux only. Run from the repo root:
+    python -m benchmarks.worker_memory --workers 4 8
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.cold_start import free_port, status_of
+
+
+def smaps_rollup(pid: int) -> dict:
+    """{"Rss": kB, "Pss": kB, ...} for one process."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values
+
+
+def child_pids(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure(workers: int, preload: bool, env: dict, requests: int, ready_timeout: float) -> dict:
+    port = free_port()
+    env = dict(env, PRELOAD_MODELS="true" if preload else "false", WEB_CONCURRENCY=str(workers),
+               BIND=f"127.0.0.1:{port}")
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "backend/gunicorn_conf.py", "backend.main:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        started = time.perf_counter()
+        # Every worker runs its own warm-up, so poll until enough /ready answers came back 200
+        ready_answers = 0
+        while ready_answers < workers * 4:
+            if time.perf_counter() - started > ready_timeout:
+                raise RuntimeError(f"workers not ready after {ready_timeout:.0f}s")
+            if master.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {master.returncode}")
+            ready_answers += status_of(f"http://127.0.0.1:{port}/ready") == 200
+            time.sleep(0.05)
+        for _ in range(requests):
+            status_of(f"http://127.0.0.1:{port}/health")
+        time.sleep(1)
+        worker_pids = child_pids(master.pid)
+        worker_stats = [smaps_rollup(pid) for pid in worker_pids]
+        master_stats = smaps_rollup(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+    return {
+        "workers": len(worker_pids),
+        "master_pss": master_stats["Pss"],
+        "worker_rss": sum(s["Rss"] for s in worker_stats) / len(worker_stats),
+        "worker_pss": sum(s["Pss"] for s in worker_stats) / len(worker_stats),
+        "total_pss": master_stats["Pss"] + sum(s["Pss"] for s in worker_stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--requests", type=int, default=200, help="Requests served before measuring")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/worker_memory.db", INDEX_DIR=f"{tmp}/indexes")
+        print(f"{'workers':>8}{'preload':>9}{'RSS/worker MB':>15}{'PSS/worker MB':>15}{'master PSS MB':>15}{'total PSS MB':>14}")
+        for workers in args.workers:
+            totals = {}
+            for preload in (False, True):
+                result = measure(workers, preload, env, args.requests, args.ready_timeout)
+                totals[preload] = result["total_pss"]
+                print(f"{result['workers']:>8}{str(preload).lower():>9}{result['worker_rss'] / 1024:>15.1f}"
+                      f"{result['worker_pss'] / 1024:>15.1f}{result['master_pss'] / 1024:>15.1f}{result['total_pss'] / 1024:>14.1f}")
+            print(f"{'':>8}preload saves {(totals[False] - totals[True]) / 1024:.1f} MB "
+                  f"({1 - totals[True] / totals[False]:.0%}) at {workers} workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# tests/conftest.py
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from backend import models # Registers the tables on Base
+from backend.database import Base, create_db_engine
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A session on a fresh SQLite database with every table created."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
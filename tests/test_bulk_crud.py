@@ -0,0 +1,79 @@
+# tests/test_bulk_crud.py
+from datetime import datetime
+
+import pytest
+
+from backend import crud, models
+
+FETCHED_AT = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture(params=["sqlite", "fallback"])
+def bulk_db(request, db, monkeypatch):
+    """Runs each test with ON CONFLICT DO NOTHING, and with the portable fallback of other dialects."""
+    if request.param == "fallback":
+        monkeypatch.setattr(db.get_bind().dialect, "name", "mssql")
+    return db
+
+
+def _tags_of(db, song_id):
+    db.expire_all()
+    return sorted(tag.name for tag in crud.get_song_with_tags(db, song_id).tags)
+
+
+def test_upsert_songs_skips_existing_and_duplicate_pairs(bulk_db):
+    first = crud.upsert_songs(bulk_db, [("Song A", "Artist"), ("Song B", "Artist"), ("Song A", "Artist")])
+    bulk_db.commit()
+    assert set(first) == {("Song A", "Artist"), ("Song B", "Artist")}
+    second = crud.upsert_songs(bulk_db, [("Song B", "Artist"), ("Song C", "Artist")])
+    bulk_db.commit()
+    assert second[("Song B", "Artist")] == first[("Song B", "Artist")]
+    assert bulk_db.query(models.Song).count() == 3
+
+
+def test_upsert_tags_normalizes_names(bulk_db):
+    tag_ids = crud.upsert_tags(bulk_db, ["Rock", " rock ", "Chill", "", "   "])
+    bulk_db.commit()
+    assert set(tag_ids) == {"rock", "chill"}
+    assert crud.upsert_tags(bulk_db, ["ROCK"]) == {"rock": tag_ids["rock"]}
+    assert bulk_db.query(models.Tag).count() == 2
+
+
+def test_prompt_links_keep_their_first_position(bulk_db):
+    prompt = crud.get_or_create_prompt(bulk_db, "rainy day", "rainy day")
+    song_ids = list(crud.upsert_songs(bulk_db, [("Song A", "Artist"), ("Song B", "Artist")]).values())
+    crud.link_prompt_to_songs(bulk_db, prompt.id, song_ids)
+    # Linking again (e.g. a retried request) keeps the stored order instead of failing
+    crud.link_prompt_to_songs(bulk_db, prompt.id, list(reversed(song_ids)))
+    bulk_db.commit()
+    songs = crud.get_recommended_songs_for_prompt(bulk_db, prompt.id, ["openai"])
+    assert [song.id for song in songs] == song_ids
+
+
+def test_save_tags_replaces_a_songs_tags(bulk_db):
+    song_ids = crud.upsert_songs(bulk_db, [("Song A", "Artist"), ("Song B", "Artist")])
+    song_a, song_b = song_ids[("Song A", "Artist")], song_ids[("Song B", "Artist")]
+    crud.save_tags_for_songs(bulk_db, {song_a: ["Rock", "sad", "rock"], song_b: ["chill"]}, FETCHED_AT)
+    bulk_db.commit()
+    assert _tags_of(bulk_db, song_a) == ["rock", "sad"]
+
+    # A refetch drops tags Last.fm no longer returns, and leaves other songs alone
+    crud.save_tags_for_songs(bulk_db, {song_a: ["rock", "rainy"]}, FETCHED_AT)
+    bulk_db.commit()
+    assert _tags_of(bulk_db, song_a) == ["rainy", "rock"]
+    assert _tags_of(bulk_db, song_b) == ["chill"]
+
+    # An empty result clears the tags but still records the fetch
+    crud.save_tags_for_songs(bulk_db, {song_b: []}, FETCHED_AT)
+    bulk_db.commit()
+    assert _tags_of(bulk_db, song_b) == []
+    assert crud.get_song_with_tags(bulk_db, song_b).tags_fetched_at == FETCHED_AT
+
+
+def test_insert_missing_dedupes_across_lookup_chunks(db):
+    table = models.Tag.__table__
+    crud._insert_missing(db, table, ["name"], [{"name": "rock"}])
+    rows = [{"name": name} for name in ["pop", "rock", "jazz", "pop", "folk", "jazz"]]
+    crud._insert_missing(db, table, ["name"], rows, chunk_size=2)
+    db.commit()
+    assert sorted(name for (name,) in db.query(models.Tag.name)) == ["folk", "jazz", "pop", "rock"]
@@ -0,0 +1,81 @@
+# tests/test_enrichment_queue.py
+from datetime import datetime, timedelta
+
+from backend import crud, models
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+LEASE = timedelta(minutes=5)
+
+
+def _claim(db, now, limit=10):
+    return crud.claim_enrichment_jobs(db, limit, now, lease_expired_before=now - LEASE)
+
+
+def _queue_songs(db, count):
+    song_ids = list(crud.upsert_songs(db, [(f"title {i}", f"artist {i}") for i in range(count)]).values())
+    crud.enqueue_enrichment_jobs(db, song_ids, NOW)
+    db.commit()
+    return song_ids
+
+
+def test_enqueue_dedupes_by_song(db):
+    song_ids = _queue_songs(db, 2)
+    crud.enqueue_enrichment_jobs(db, song_ids + song_ids, NOW)
+    db.commit()
+    assert db.query(models.EnrichmentJob).count() == 2
+
+
+def test_claimed_jobs_are_not_claimed_again_while_leased(db):
+    _queue_songs(db, 3)
+    jobs = _claim(db, NOW, limit=2)
+    assert [job.status for job in jobs] == ["running", "running"]
+    assert [job.attempts for job in jobs] == [1, 1]
+    # Only the third job is left, the first two are leased
+    assert len(_claim(db, NOW + timedelta(seconds=1))) == 1
+    assert _claim(db, NOW + LEASE - timedelta(seconds=1)) == []
+
+
+def test_expired_lease_is_taken_over(db):
+    _queue_songs(db, 1)
+    [job] = _claim(db, NOW)
+    [retaken] = _claim(db, NOW + LEASE + timedelta(seconds=1))
+    assert retaken.id == job.id
+    assert retaken.attempts == 2
+
+
+def test_failed_job_is_retried_after_backoff(db):
+    _queue_songs(db, 1)
+    [job] = _claim(db, NOW)
+    retry_after = NOW + timedelta(seconds=30)
+    crud.fail_enrichment_job(db, job.id, "Last.fm lookup failed", NOW, retry_after)
+    db.commit()
+    assert _claim(db, retry_after - timedelta(seconds=1)) == []
+    [retried] = _claim(db, retry_after)
+    assert retried.id == job.id
+    assert retried.attempts == 2
+    assert retried.last_error == "Last.fm lookup failed"
+
+
+def test_job_failed_for_good_is_requeued_by_enqueue(db):
+    [song_id] = _queue_songs(db, 1)
+    [job] = _claim(db, NOW)
+    crud.fail_enrichment_job(db, job.id, "Last.fm lookup failed", NOW, retry_after=None)
+    db.commit()
+    assert _claim(db, NOW + timedelta(days=1)) == []
+
+    later = NOW + timedelta(days=1)
+    crud.enqueue_enrichment_jobs(db, [song_id], later)
+    db.commit()
+    [requeued] = _claim(db, later)
+    assert requeued.attempts == 1
+    assert requeued.last_error is None
+
+
+def test_completed_jobs_are_not_claimed(db):
+    _queue_songs(db, 1)
+    [job] = _claim(db, NOW)
+    crud.complete_enrichment_jobs(db, [job.id], NOW)
+    db.commit()
+    assert _claim(db, NOW + LEASE * 2) == []
+    db.expire_all()
+    assert crud.get_enrichment_job_for_song(db, job.song_id).status == "done"
@@ -0,0 +1,29 @@
+# tests/test_lazy_indexes.py
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_index_services_touches_no_files(tmp_path):
+    index_dir = tmp_path / "indexes"
+    env = dict(os.environ, INDEX_DIR=str(index_dir), DATABASE_URL=f"sqlite:///{tmp_path / 'test.db'}")
+    subprocess.run(
+        [sys.executable, "-c", "import backend.services.semantic_cache, backend.services.song_index"],
+        cwd=ROOT, env=env, check=True, capture_output=True,
+    )
+    assert not index_dir.exists()
+
+
+def test_index_getters_open_one_shared_index(tmp_path):
+    index_dir = tmp_path / "indexes"
+    env = dict(os.environ, INDEX_DIR=str(index_dir), DATABASE_URL=f"sqlite:///{tmp_path / 'test.db'}")
+    code = (
+        "from backend.services.semantic_cache import get_prompt_index\n"
+        "from backend.services.song_index import get_song_vectors\n"
+        "assert get_prompt_index() is get_prompt_index()\n"
+        "assert get_song_vectors() is get_song_vectors()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, capture_output=True)
+    assert sorted(os.listdir(index_dir)) == ["prompts.lock", "songs.lock"]
@@ -0,0 +1,74 @@
+# tests/test_micro_batcher.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.services.tag_inference import MicroBatcher
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield executor
+
+
+def _recording_batcher(executor, max_batch_size, max_wait_seconds=60.0):
+    batches = []
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+    return MicroBatcher(batch_fn, max_batch_size, max_wait_seconds, executor), batches
+
+
+def test_full_batch_is_sent_without_waiting(executor):
+    # The timer would only fire after a minute: a full batch must not wait for it
+    batcher, batches = _recording_batcher(executor, max_batch_size=4)
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=5)
+    assert asyncio.run(main()) == [0, 10, 20, 30]
+    assert batches == [[0, 1, 2, 3]]
+
+
+def test_partial_batch_is_sent_after_max_wait(executor):
+    batcher, batches = _recording_batcher(executor, max_batch_size=100, max_wait_seconds=0.01)
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(3))), timeout=5)
+    assert asyncio.run(main()) == [0, 10, 20]
+    assert batches == [[0, 1, 2]]
+
+
+def test_results_keep_submission_order_across_batches(executor):
+    batcher, batches = _recording_batcher(executor, max_batch_size=3, max_wait_seconds=0.01)
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(8))), timeout=5)
+    assert asyncio.run(main()) == [i * 10 for i in range(8)]
+    assert batches == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+def test_batch_exception_reaches_every_caller(executor):
+    def batch_fn(items):
+        raise ValueError("model not loaded")
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_seconds=0.01, executor=executor)
+    async def main():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True), timeout=5
+        )
+    results = asyncio.run(main())
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) and str(result) == "model not loaded" for result in results)
+
+
+def test_batcher_keeps_working_after_a_failed_batch(executor):
+    calls = []
+    def batch_fn(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise RuntimeError("transient")
+        return [item + 1 for item in items]
+    batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_seconds=0.01, executor=executor)
+    async def main():
+        with pytest.raises(RuntimeError):
+            await batcher.submit(1)
+        return await asyncio.wait_for(batcher.submit(2), timeout=5)
+    assert asyncio.run(main()) == 3
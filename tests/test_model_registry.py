@@ -0,0 +1,83 @@
+# tests/test_model_registry.py
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("sklearn")
+pytest.importorskip("pandas")
+
+from ai.tag_predictor import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(root=str(tmp_path / "registry"))
+
+
+@pytest.fixture
+def model_files(tmp_path):
+    weights_path = tmp_path / "tag_mlp_model.pt"
+    weights_path.write_bytes(b"weights")
+    classes_path = tmp_path / "mlb_classes.npy"
+    np.save(classes_path, np.array(["chill", "rock", "sad"], dtype=object), allow_pickle=True)
+    return str(weights_path), str(classes_path)
+
+
+def _publish(registry, model_files, **kwargs):
+    return registry.publish(*model_files, encoder="all-MiniLM-L6-v2", input_dim=384, **kwargs)
+
+
+def test_publish_writes_an_immutable_version(registry, model_files):
+    version = _publish(registry, model_files, metrics={"f1": 0.5})
+    weights_path, classes_path = registry.paths(version)
+    with open(weights_path, "rb") as f:
+        assert f.read() == b"weights"
+    assert list(np.load(classes_path, allow_pickle=True)) == ["chill", "rock", "sad"]
+    manifest = registry.manifest(version)
+    assert manifest["version"] == version
+    assert manifest["num_tags"] == 3
+    assert manifest["metrics"] == {"f1": 0.5}
+    assert registry.active_version() == version
+    # No temporary directory is left behind
+    assert sorted(os.listdir(registry.root)) == sorted(["ACTIVE.json", version])
+
+
+def test_versions_published_in_the_same_second_get_distinct_names(registry, model_files):
+    versions = [_publish(registry, model_files) for _ in range(3)]
+    assert len(set(versions)) == 3
+    assert [manifest["version"] for manifest in registry.versions()] == versions
+
+
+def test_publish_without_activating(registry, model_files):
+    first = _publish(registry, model_files)
+    candidate = _publish(registry, model_files, parent=first, activate=False)
+    assert registry.active_version() == first
+    assert registry.manifest(candidate)["parent"] == first
+    registry.activate(candidate)
+    assert registry.active_version() == candidate
+
+
+def test_activate_unknown_version_fails(registry, model_files):
+    version = _publish(registry, model_files)
+    with pytest.raises(FileNotFoundError):
+        registry.activate("v19700101-000000")
+    assert registry.active_version() == version
+
+
+def test_rollback_walks_back_through_history(registry, model_files):
+    first = _publish(registry, model_files)
+    second = _publish(registry, model_files)
+    third = _publish(registry, model_files)
+    registry.activate(third) # Already active: not pushed onto the history twice
+    assert registry.rollback() == second
+    assert registry.active_version() == second
+    assert registry.rollback() == first
+    with pytest.raises(ValueError):
+        registry.rollback()
+    assert registry.active_version() == first
+    with open(registry.active_path) as f:
+        assert json.load(f) == {"version": first, "history": []}
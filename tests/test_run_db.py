@@ -0,0 +1,68 @@
+# tests/test_run_db.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.database import run_db
+
+
+class FakeSession:
+    """Just enough of a Session for run_db: an info dict, and a record of overlapping use."""
+
+    def __init__(self):
+        self.info = {}
+        self.active = 0
+        self.overlaps = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def work(self, name, seconds=0.0):
+        with self._lock:
+            self.active += 1
+            self.overlaps += self.active > 1
+        time.sleep(seconds)
+        with self._lock:
+            self.active -= 1
+        self.calls.append(name)
+        return name
+
+    def commit(self):
+        self.calls.append("commit")
+
+
+def _work(session, name, seconds=0.0):
+    return session.work(name, seconds)
+
+
+def test_run_db_returns_and_commits():
+    db = FakeSession()
+    assert asyncio.run(run_db(db, _work, "save", commit=True)) == "save"
+    assert db.calls == ["save", "commit"]
+
+
+def test_concurrent_calls_on_one_session_are_serialized():
+    db = FakeSession()
+    async def main():
+        return await asyncio.gather(*(run_db(db, _work, i, seconds=0.01) for i in range(5)))
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert db.overlaps == 0
+
+
+def test_cancelled_call_keeps_the_session_until_its_thread_is_done():
+    db = FakeSession()
+    async def main():
+        slow = asyncio.create_task(run_db(db, _work, "slow", seconds=0.2))
+        await asyncio.sleep(0.05)
+        slow.cancel()
+        following = asyncio.create_task(run_db(db, _work, "next"))
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        # The cancelled call only returns once its thread has left the session
+        assert db.calls == ["slow"]
+        assert db.active == 0
+        return await following
+    assert asyncio.run(main()) == "next"
+    assert db.calls == ["slow", "next"]
+    assert db.overlaps == 0
@@ -0,0 +1,61 @@
+# tests/test_schema_upgrade.py
+from sqlalchemy import inspect, text
+
+from backend.database import ADDED_COLUMNS, Base, add_missing_columns, create_db_engine
+
+# Tables as created by the first release, before any column in ADDED_COLUMNS existed
+BASELINE_SCHEMA = [
+    """CREATE TABLE prompts (
+        id INTEGER PRIMARY KEY, text VARCHAR NOT NULL UNIQUE, created_at DATETIME
+    )""",
+    """CREATE TABLE songs (
+        id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, artist VARCHAR NOT NULL, spotify_id VARCHAR UNIQUE,
+        CONSTRAINT _title_artist_uc UNIQUE (title, artist)
+    )""",
+    "CREATE TABLE tags (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+    """CREATE TABLE song_tag_association (
+        song_id INTEGER REFERENCES songs (id), tag_id INTEGER REFERENCES tags (id), PRIMARY KEY (song_id, tag_id)
+    )""",
+    """CREATE TABLE prompt_song_recommendation (
+        prompt_id INTEGER REFERENCES prompts (id), song_id INTEGER REFERENCES songs (id),
+        recommended_at DATETIME, source VARCHAR, PRIMARY KEY (prompt_id, song_id)
+    )""",
+]
+
+
+def _baseline_engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO prompts (id, text) VALUES (1, 'rainy day')"))
+    return engine
+
+
+def test_missing_columns_are_added_to_old_databases(tmp_path):
+    engine = _baseline_engine(tmp_path)
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    inspector = inspect(engine)
+    for table_name, column_names in ADDED_COLUMNS.items():
+        assert set(column_names) <= {column["name"] for column in inspector.get_columns(table_name)}
+    assert "ix_prompts_normalized_text" in {index["name"] for index in inspector.get_indexes("prompts")}
+    with engine.connect() as connection:
+        # Existing rows are kept, with the new columns NULL
+        assert connection.execute(text("SELECT text, normalized_text FROM prompts")).all() == [("rainy day", None)]
+    engine.dispose()
+
+
+def test_adding_missing_columns_is_idempotent(tmp_path):
+    engine = _baseline_engine(tmp_path)
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    add_missing_columns(engine)
+    new_engine = create_db_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    Base.metadata.create_all(bind=new_engine)
+    add_missing_columns(new_engine)
+    for table_name in ADDED_COLUMNS:
+        assert [column["name"] for column in inspect(new_engine).get_columns(table_name)] == \
+            [column.name for column in Base.metadata.tables[table_name].columns]
+    engine.dispose()
+    new_engine.dispose()
@@ -0,0 +1,72 @@
+# tests/test_semantic_cache.py
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend import crud
+from backend.services import semantic_cache
+from backend.services.vector_index import VectorIndex
+
+DIM = 8
+
+
+class FakeEncoder:
+    """Stands in for SBERT: paraphrases share a direction, and every call is recorded."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = None # asyncio.Event that holds encoding back while unset
+
+    def vector(self, text):
+        rng = np.random.default_rng(len(text.split()))
+        return rng.standard_normal(DIM).astype(np.float32)
+
+    async def __call__(self, texts, cache=True):
+        self.calls.append(list(texts))
+        if self.release is not None:
+            await self.release.wait()
+        return np.stack([self.vector(text) for text in texts])
+
+
+@pytest.fixture
+def encoder(tmp_path, monkeypatch):
+    index = VectorIndex(str(tmp_path / "prompts"))
+    encoder = FakeEncoder()
+    monkeypatch.setattr(semantic_cache, "get_prompt_index", lambda: index)
+    monkeypatch.setattr(semantic_cache, "encode_texts_async", encoder)
+    monkeypatch.setattr(semantic_cache.settings, "SEMANTIC_CACHE_ENABLED", True)
+    encoder.index = index
+    return encoder
+
+
+def test_exact_hit_indexes_the_prompt_in_the_background(db, encoder):
+    db_prompt = crud.get_or_create_prompt(db, "rainy day at home", "rainy day at home")
+    db.commit()
+    async def main():
+        encoder.release = asyncio.Event()
+        # Returns while the encoder is still blocked: nothing on the request path waits for it
+        assert await asyncio.wait_for(
+            semantic_cache.get_similar_prompt_recommendations(db, db_prompt, lookup=False), timeout=1
+        ) is None
+        assert db_prompt.id not in encoder.index
+        encoder.release.set()
+        await asyncio.gather(*semantic_cache._indexing_tasks)
+    asyncio.run(main())
+    assert db_prompt.id in encoder.index
+    # Already indexed: the encoder isn't called again
+    asyncio.run(semantic_cache.get_similar_prompt_recommendations(db, db_prompt, lookup=False))
+    assert encoder.calls == [["rainy day at home"]]
+
+
+def test_paraphrase_reuses_the_closest_prompts_songs(db, encoder):
+    first = crud.get_or_create_prompt(db, "rainy day at home", "rainy day at home")
+    db.commit()
+    crud.save_recommendations(db, first.id, [("Riders on the Storm", "The Doors")], "openai")
+    assert asyncio.run(semantic_cache.get_similar_prompt_recommendations(db, first)) is None
+
+    paraphrase = crud.get_or_create_prompt(db, "rainy afternoon at home", "rainy afternoon at home")
+    db.commit()
+    songs = asyncio.run(semantic_cache.get_similar_prompt_recommendations(db, paraphrase))
+    assert songs == [{"title": "Riders on the Storm", "artist": "The Doors"}]
+    assert paraphrase.id in encoder.index
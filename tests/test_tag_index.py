@@ -0,0 +1,70 @@
+# tests/test_tag_index.py
+import math
+
+import pytest
+
+from backend.services.tag_recommender import TagIndex
+
+
+def _build(song_tags, artists=None, max_postings_per_tag=None):
+    """song_tags: {song_id: [tag, ...]}; every song is by its own artist unless `artists` says otherwise."""
+    artists = artists or {}
+    songs = [(song_id, f"Song {song_id}", artists.get(song_id, f"Artist {song_id}")) for song_id in song_tags]
+    links = [(song_id, tag) for song_id, tags in song_tags.items() for tag in tags]
+    return TagIndex.build(songs, links, max_postings_per_tag=max_postings_per_tag)
+
+
+def _ids(results):
+    return [result["song_id"] for result in results]
+
+
+def test_rare_tags_outweigh_common_ones():
+    index = _build({1: ["rock"], 2: ["rock"], 3: ["rock"], 4: ["shoegaze"]})
+    results = index.search([("rock", 1.0), ("shoegaze", 1.0)], k=4)
+    assert _ids(results)[0] == 4
+    assert sorted(_ids(results)) == [1, 2, 3, 4]
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+
+
+def test_query_weights_and_tag_overlap_order_the_results():
+    index = _build({1: ["sad", "piano"], 2: ["sad"], 3: ["piano"], 4: ["metal"]})
+    assert _ids(index.search([("sad", 0.9), ("piano", 0.1)], k=10)) == [2, 1, 3]
+    assert _ids(index.search([("sad", 0.1), ("piano", 0.9)], k=10)) == [3, 1, 2]
+
+
+def test_query_tags_are_normalized_and_unknown_ones_ignored():
+    index = _build({1: ["chill"], 2: ["rock"]})
+    assert _ids(index.search([(" Chill ", 1.0), ("polka", 1.0)])) == [1]
+    assert index.search([("polka", 1.0)]) == []
+    assert index.search([]) == []
+
+
+def test_results_are_capped_at_k_and_per_artist():
+    song_tags = {song_id: ["lofi"] for song_id in range(1, 7)}
+    # Songs 1-3 have the fewest other tags, so the highest "lofi" weight, and share an artist
+    for song_id in range(4, 7):
+        song_tags[song_id] = ["lofi", "beats"]
+    index = _build(song_tags, artists={1: "Same", 2: "same", 3: "SAME"})
+    results = index.search([("lofi", 1.0)], k=4, max_per_artist=2)
+    assert len(results) == 4
+    assert sum(r["artist"].lower() == "same" for r in results) == 2
+    assert _ids(results)[:2] == [1, 2]
+    assert len(index.search([("lofi", 1.0)], k=2)) == 2
+
+
+def test_inverted_lists_are_truncated_to_their_best_postings():
+    song_tags = {1: ["rock"], 2: ["rock", "pop"], 3: ["rock", "pop", "jazz", "sad"]}
+    # Fewer tags -> a larger share of the normalized vector -> earlier in the "rock" list
+    assert _ids(_build(song_tags).search([("rock", 1.0)])) == [1, 2, 3]
+    truncated = _build(song_tags, max_postings_per_tag=2)
+    assert _ids(truncated.search([("rock", 1.0)])) == [1, 2]
+    # Still reachable through its other tags
+    assert sorted(_ids(truncated.search([("rock", 1.0), ("jazz", 1.0)]))) == [1, 2, 3]
+
+
+def test_songs_without_links_and_links_without_songs():
+    index = TagIndex.build([(1, "Song 1", "A"), (2, "Song 2", "B")], [(1, "rock"), (99, "rock")])
+    assert len(index) == 2
+    [result] = index.search([("rock", 1.0)])
+    # Only tag of the song (weight 1) times the smooth IDF of a tag on 1 of 2 songs
+    assert result == {"song_id": 1, "title": "Song 1", "artist": "A", "score": pytest.approx(math.log(3 / 2) + 1)}
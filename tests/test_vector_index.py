@@ -0,0 +1,89 @@
+# tests/test_vector_index.py
+import numpy as np
+
+from backend.services.vector_index import VectorIndex, normalize_rows
+
+DIM = 16
+
+
+def _vectors(count, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((count, DIM)))
+
+
+def test_add_and_search_round_trip(tmp_path):
+    index = VectorIndex(str(tmp_path / "songs"))
+    vectors = _vectors(50)
+    index.add(range(100, 150), vectors)
+    assert len(index) == 50
+    assert 120 in index and 99 not in index
+    for row in (0, 17, 49):
+        [(item_id, score)] = index.search(vectors[row], k=1)
+        assert item_id == 100 + row
+        assert np.isclose(score, 1.0, atol=1e-5)
+    results = index.search(vectors[0], k=5)
+    assert len(results) == 5
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def test_empty_index_returns_nothing(tmp_path):
+    assert VectorIndex(str(tmp_path / "songs"), dim=DIM).search(_vectors(1)[0], k=3) == []
+
+
+def test_reopened_index_keeps_rows(tmp_path):
+    path = str(tmp_path / "songs")
+    vectors = _vectors(20)
+    VectorIndex(path, dtype="float16").add(range(20), vectors)
+    reopened = VectorIndex(path, dtype="float16")
+    assert len(reopened) == 20
+    assert reopened.search(vectors[7], k=1)[0][0] == 7
+
+
+def test_other_instances_see_appends(tmp_path):
+    path = str(tmp_path / "songs")
+    writer, reader = VectorIndex(path), VectorIndex(path)
+    vectors = _vectors(30)
+    writer.add(range(10), vectors[:10])
+    assert reader.search(vectors[3], k=1)[0][0] == 3
+    # Appends from the reader go after the writer's rows, not over them
+    reader.add(range(10, 30), vectors[10:])
+    assert writer.search(vectors[25], k=1)[0][0] == 25
+    assert len(writer) == len(reader) == 30
+
+
+def test_changed_fingerprint_replaces_the_row(tmp_path):
+    index = VectorIndex(str(tmp_path / "songs"))
+    old, new = _vectors(2)
+    index.add([1], old[None, :], fingerprints=[11])
+    index.add([1], old[None, :], fingerprints=[11]) # Unchanged: skipped
+    assert len(index._ids) == 1
+    index.add([1], new[None, :], fingerprints=[22])
+    assert len(index) == 1
+    assert index.fingerprint(1) == 22
+    [(item_id, score)] = index.search(old, k=5)
+    assert item_id == 1
+    assert np.isclose(score, float(new @ old), atol=1e-5)
+
+
+def test_training_switches_to_ivf(tmp_path):
+    path = str(tmp_path / "songs")
+    index = VectorIndex(path, nprobe=64, ivf_min_rows=200)
+    vectors = _vectors(400)
+    index.add(range(150), vectors[:150])
+    assert index._ivf is None
+    index.add(range(150, 250), vectors[150:250])
+    index.wait_for_training()
+    index.refresh()
+    assert index._ivf_version == 1
+    assert index._trained_rows == 250
+    # Rows added after training are assigned to lists and searchable
+    index.add(range(250, 400), vectors[250:])
+    for row in (3, 200, 399):
+        assert index.search(vectors[row], k=1)[0][0] == row
+
+    # Growing 4x retrains; other instances pick up the new training
+    reader = VectorIndex(path, nprobe=64, ivf_min_rows=200)
+    index.add(range(400, 1000), _vectors(600, seed=1))
+    index.wait_for_training()
+    reader.refresh()
+    assert reader._ivf_version == 2
+    assert reader.search(vectors[42], k=1)[0][0] == 42